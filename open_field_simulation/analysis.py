@@ -0,0 +1,128 @@
+from cache import ResultsCache, CACHE_FILE
+from concurrent.futures import ProcessPoolExecutor
+from interactions import score_file, table_rows, write_table, TABLE_COLUMNS
+from reader import find_simulations
+import argparse
+import h5py
+import numpy as np
+import os
+from tqdm import tqdm
+
+
+def write_table_h5(rows, out_file):
+    """
+    write a tidy table of results as one compound dataset named results
+
+    Inputs
+    ------
+    rows: (list of dicts) rows with keys TABLE_COLUMNS
+    out_file: (str) h5 file to write
+    """
+    dtype = np.dtype([('file', h5py.string_dtype()),
+                      ('group', h5py.string_dtype()),
+                      ('n_mice', np.int64),
+                      ('mouse', np.int64),
+                      ('threshold_mm', np.float64),
+                      ('interaction_fraction', np.float64)])
+    table = np.array([tuple(row[column] for column in TABLE_COLUMNS)
+                      for row in rows], dtype=dtype)
+
+    with h5py.File(out_file, 'w') as f:
+        f.create_dataset('results', data=table)
+
+
+def analyze(directory, thresholds, out_file, recursive=True,
+            max_workers=None, cache_file=CACHE_FILE, **attrs):
+    """
+    score every simulation found under a directory for many thresholds, with
+    the simulations spread over a process pool. Simulations are found by
+    their h5 attrs and each is read in time chunks (see
+    interactions.score_group), so memory does not grow with the number or
+    length of the simulations. Only simulations and thresholds missing from
+    the cache are scored. Results are written to one tidy table
+
+    Inputs
+    ------
+    directory: (str) directory to search for simulations
+    thresholds: (array of floats) distance thresholds in mm
+    out_file: (str) table to write, an h5 file if it ends in .h5, a csv file
+              otherwise
+    recursive: (bool) also search the subdirectories
+    max_workers: (int) number of worker processes, defaults to all cores
+    cache_file: (str) cache of results of previous runs, relative to
+                directory, None to score everything
+    attrs: attr values simulations must have, e.g. n_mice=[2, 3], see
+           reader.find_simulations
+
+    Returns
+    -------
+    rows: (list of dicts) one row per simulation, mouse and threshold, with
+          keys TABLE_COLUMNS, in the order the simulations were found
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    simulations = find_simulations(directory, recursive, **attrs)
+    print(f'{len(simulations)} simulations found')
+
+    cache = None
+    if cache_file is not None:
+        cache = ResultsCache(os.path.join(directory, cache_file))
+
+    # thresholds each simulation still has to be scored for
+    pending = [thresholds if cache is None
+               else cache.missing(filename, group_name, thresholds)
+               for filename, group_name in simulations]
+    print(f'{sum(missing.size > 0 for missing in pending)} to score')
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(score_file, filename, group_name, missing)
+                   if missing.size else None
+                   for (filename, group_name), missing in zip(simulations,
+                                                              pending)]
+
+        # results are collected in order, the table does not depend on
+        # which worker finishes first
+        for (filename, group_name), missing, future in tqdm(
+                zip(simulations, pending, futures), total=len(simulations)):
+            if cache is None:
+                fractions = future.result()
+            else:
+                if future is not None:
+                    cache.put(filename, group_name, missing, future.result())
+                fractions = cache.fractions(filename, group_name, thresholds)
+            rows.extend(table_rows(filename, group_name, thresholds,
+                                   fractions))
+
+    if cache is not None:
+        cache.save()
+
+    if out_file.endswith('.h5'):
+        write_table_h5(rows, out_file)
+    else:
+        write_table(rows, out_file)
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='score mouse interactions of every simulation in a '
+                    'directory')
+    parser.add_argument('directory', help='directory to search')
+    parser.add_argument('--thresholds', nargs='+', type=float, required=True,
+                        help='distance thresholds in mm')
+    parser.add_argument('--out', default='interactions.csv',
+                        help='output table, .csv or .h5')
+    parser.add_argument('--n-mice', nargs='+', type=int,
+                        help='only score simulations with these numbers of '
+                             'mice')
+    parser.add_argument('--workers', type=int, help='number of processes')
+    parser.add_argument('--no-cache', action='store_true',
+                        help=f'score every simulation again instead of '
+                             f'reusing {CACHE_FILE}')
+    args = parser.parse_args()
+
+    attrs = {} if args.n_mice is None else {'n_mice': args.n_mice}
+    analyze(args.directory, args.thresholds, args.out,
+            max_workers=args.workers,
+            cache_file=None if args.no_cache else CACHE_FILE, **attrs)
@@ -0,0 +1,522 @@
+from collision import (ellipses_overlap, half_extents, in_rectangle,
+                       max_step_fraction)
+from engine import starting_positions
+from geometry import cached_template, place_template, PERIMETER_STEP
+from main import (ENV_WIDTH, ENV_HEIGHT, AVG_SPEED, SPEED_STD, TURN_STD,
+                  MAJOR_AXIS, MINOR_AXIS, build_filename,
+                  get_simulation_length_min)
+import h5py
+import math
+from motion import GaussianMotion
+import numpy as np
+from sampling import ReplicateSampler, SelectedReplicates
+from tqdm import tqdm
+from writer import StreamingWriter, CHUNK_SIZE
+
+
+class BatchSimulation:
+    """
+    Class to run R independent replicates of the open field simulation
+    together. The state of every replicate is held in (R, n_mice, ...) arrays
+    so one vectorized step advances all of them. Mice move in order within a
+    step as in main.main, drawing speeds and turns from the same motion
+    model, and replicates never interact. Each replicate draws from its own
+    child of the seed, so its trajectory does not depend on the number of
+    replicates it is run with. The random numbers of every replicate are
+    pre-drawn into one block, so a draw for all replicates is one indexing
+
+    Attributes
+    ----------
+    n_replicates: (int) number of independent replicates R
+    n_mice: (int) number of mice in each replicate
+    width: (int) width of arena in mm
+    height: (int) height of arena in mm
+    avg_speed: (float) mouse average speed (mm/ms)
+    speed_std: (float) mouse speed standard deviation (mm/ms)
+    turn_std: (float) standard deviation of the rotation angle around the
+              heading direction (radians)
+    motion: (motion.GaussianMotion or motion.EmpiricalMotion) draws the
+            speeds and turns of the mice
+    major_axis: (float) major axis of ellipse representing mouse (mm)
+    minor_axis: (float) minor axis of ellipse representing mouse (mm)
+    seed: (np.random.SeedSequence) seed of the batch
+    sampler: (ReplicateSampler) random numbers of the replicates, each drawn
+             from a child of seed
+    clip_to_walls: (bool) whether moves that would cross a wall are shortened
+                   to stop at the wall rather than resampled
+    n_candidates: (int) number of moves tested at once for each rejected
+                  move
+    max_retries: (int) maximum number of rejected moves in a step before a
+                 mouse stays put
+    perimeter_step: (float) angular step between perimeter points in radians
+    template: (np array of shape 2, n_points) mouse perimeter at the origin
+    centers: (np array of shape R, n_mice, 2) current center of each mouse
+    previous_centers: (np array of shape R, n_mice, 2) center before the
+                      last move, used for the heading direction
+    angles: (np array of shape R, n_mice) current rotation angle
+    perimeter_x: (np array of shape R, n_mice, n_points) x perimeter points
+    perimeter_y: (np array of shape R, n_mice, n_points) y perimeter points
+    n_steps: (int) number of steps taken so far
+    retry_counts: (np array of shape R, n_mice) number of rejected moves of
+                  each mouse in the last step
+    stay_put_count: (np array of shape R, n_mice) number of steps where no
+                    valid move was found
+
+    Methods
+    -------
+    initialize_positions()
+        place the mice of every replicate at their starting positions
+    draw(rows, distribution)
+        draw values for the given replicates from their own generators
+    place(mouse, rows, x, y, rotation_angle)
+        move one mouse in the given replicates
+    propose_move(mouse, rows, duration, hit_wall)
+        sample a new center and rotation angle for one mouse
+    valid_move(mouse, rows, new_x, new_y, rotation_angle)
+        determine which proposed moves are valid
+    step(movement_duration)
+        move every mouse of every replicate once
+    center_history_row()
+        current centers in the center_history layout of main.main
+    pose_history_row()
+        current poses in the pose_history layout of main.main
+    perimeter_history_row()
+        current perimeters in the perimeter_history layout of main.main
+    """
+    def __init__(self, n_replicates, n_mice, width=ENV_WIDTH,
+                 height=ENV_HEIGHT, avg_speed=AVG_SPEED, speed_std=SPEED_STD,
+                 major_axis=MAJOR_AXIS, minor_axis=MINOR_AXIS, seed=None,
+                 clip_to_walls=True, n_candidates=16, max_retries=256,
+                 perimeter_step=PERIMETER_STEP, turn_std=TURN_STD,
+                 motion=None):
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        if motion is None:
+            motion = GaussianMotion(avg_speed, speed_std, turn_std)
+
+        self.n_replicates = n_replicates
+        self.n_mice = n_mice
+        self.width = width
+        self.height = height
+        self.motion = motion
+        self.avg_speed = motion.avg_speed
+        self.speed_std = motion.speed_std
+        self.turn_std = motion.turn_std
+        self.major_axis = major_axis
+        self.minor_axis = minor_axis
+        self.seed = seed
+        # child r of a SeedSequence is the same whatever the number spawned
+        self.sampler = ReplicateSampler(
+            np.random.default_rng(child) for child in seed.spawn(n_replicates))
+        self.clip_to_walls = clip_to_walls
+        self.n_candidates = n_candidates
+        self.max_retries = max_retries
+
+        self.perimeter_step = perimeter_step
+        self.template = cached_template(major_axis, minor_axis,
+                                        perimeter_step)
+        n_points = self.template.shape[1]
+
+        self.centers = np.zeros((n_replicates, n_mice, 2))
+        self.previous_centers = np.zeros((n_replicates, n_mice, 2))
+        self.angles = np.zeros((n_replicates, n_mice))
+        self.perimeter_x = np.zeros((n_replicates, n_mice, n_points))
+        self.perimeter_y = np.zeros((n_replicates, n_mice, n_points))
+        self.n_steps = 0
+        self.retry_counts = np.zeros((n_replicates, n_mice), dtype=np.int32)
+        self.stay_put_count = np.zeros((n_replicates, n_mice), dtype=np.int64)
+
+        self.initialize_positions()
+
+    def initialize_positions(self):
+        """
+        place the mice of every replicate at their starting positions. As in
+        Mouse.initialize_position, mice are spaced equidistantly across the
+        environment and get a uniform random rotation angle
+        """
+        x, y = starting_positions(self.n_mice, self.width, self.height,
+                                  self.major_axis)
+
+        rows = np.arange(self.n_replicates)
+        for mouse in range(self.n_mice):
+            angle = 2*math.pi*self.draw(rows, SelectedReplicates.random)
+            self.place(mouse, rows, x[mouse], y[mouse], angle)
+
+        self.previous_centers[:] = self.centers
+
+    def draw(self, rows, distribution):
+        """
+        draw one value for each entry of rows, each from the generator of
+        its own replicate, so the values of a replicate do not depend on the
+        others. All entries are drawn at once
+
+        Inputs
+        ------
+        rows: (np array of ints) sorted replicates, a replicate repeated n
+              times gets n values
+        distribution: (callable) distribution(sampler, size) returning size
+                      values, e.g. SelectedReplicates.random or motion.speed
+
+        Returns
+        -------
+        values: (np array of floats of shape rows)
+        """
+        return distribution(self.sampler.select(rows), rows.size)
+
+    def place(self, mouse, rows, x, y, rotation_angle):
+        """
+        move one mouse in the given replicates
+
+        Inputs
+        ------
+        mouse: (int) index of the mouse
+        rows: (np array of ints) replicates to update
+        x, y: (float or np array) new center(s)
+        rotation_angle: (float or np array) new rotation angle(s) in radians
+        """
+        self.centers[rows, mouse, 0] = x
+        self.centers[rows, mouse, 1] = y
+        self.angles[rows, mouse] = rotation_angle
+        perimeter_x, perimeter_y = place_template(
+            self.template, np.broadcast_to(x, rows.shape),
+            np.broadcast_to(y, rows.shape), rotation_angle)
+        self.perimeter_x[rows, mouse] = perimeter_x
+        self.perimeter_y[rows, mouse] = perimeter_y
+
+    def propose_move(self, mouse, rows, duration, hit_wall=False):
+        """
+        sample a new center and rotation angle for one mouse in the given
+        replicates, following Mouse.propose_move
+
+        Inputs
+        ------
+        mouse: (int) index of the mouse
+        rows: (np array of ints) sorted replicates to propose a move for
+        duration: (float) duration for movement in milliseconds
+        hit_wall: (bool) whether the previous movement attempt was rejected
+
+        Returns
+        -------
+        new_x, new_y: (np array of floats) proposed centers
+        rotation_angle: (np array of floats) proposed rotation angles
+        """
+        speed = self.draw(rows, self.motion.speed)
+        distance = speed*duration
+
+        if self.n_steps == 0 or hit_wall:
+            rotation_angle = 2*math.pi*self.draw(rows,
+                                                 SelectedReplicates.random)
+        else:
+            heading = (self.previous_centers[rows, mouse]
+                       - self.centers[rows, mouse])
+            heading_direction = np.arctan2(heading[:, 1], heading[:, 0])
+            rotation_angle = heading_direction + self.draw(rows,
+                                                           self.motion.turn)
+
+            # after staying put there is no heading direction
+            stayed = (heading == 0).all(axis=1)
+            if stayed.any():
+                rotation_angle[stayed] = 2*math.pi*self.draw(
+                    rows[stayed], SelectedReplicates.random)
+
+        current_x = self.centers[rows, mouse, 0]
+        current_y = self.centers[rows, mouse, 1]
+        dx = distance*np.cos(rotation_angle)
+        dy = distance*np.sin(rotation_angle)
+
+        if self.clip_to_walls:
+            # shorten moves that would cross a wall, as Mouse.propose_move
+            half_width, half_height = half_extents(
+                self.major_axis, self.minor_axis, rotation_angle)
+            fraction = max_step_fraction(current_x, current_y, dx, dy,
+                                         half_width, half_height, self.width,
+                                         self.height)
+            fraction = np.where(fraction > 0, fraction, 1)
+            dx, dy = fraction*dx, fraction*dy
+
+        return current_x + dx, current_y + dy, rotation_angle
+
+    def valid_move(self, mouse, rows, new_x, new_y, rotation_angle):
+        """
+        determine which proposed moves are valid
+
+        Inputs
+        ------
+        mouse: (int) index of the mouse
+        rows: (np array of ints) replicates the moves were proposed for
+        new_x, new_y: (np array of shape rows) proposed centers
+        rotation_angle: (np array of shape rows) proposed rotation angles
+
+        Returns
+        -------
+        (np array of bools of shape rows) whether each proposed move is valid
+        """
+        valid = in_rectangle(new_x, new_y, self.major_axis, self.minor_axis,
+                             rotation_angle, self.width, self.height)
+
+        others = [m for m in range(self.n_mice) if m != mouse]
+        if others:
+            others = np.ix_(rows, others)
+            valid &= ~ellipses_overlap(
+                new_x[:, None], new_y[:, None], self.major_axis,
+                self.minor_axis, rotation_angle[:, None],
+                self.centers[others + (0,)], self.centers[others + (1,)],
+                self.major_axis, self.minor_axis,
+                self.angles[others]).any(axis=1)
+
+        return valid
+
+    def step(self, movement_duration):
+        """
+        move every mouse of every replicate once. As in Mouse.move, rejected
+        moves are resampled in batches of n_candidates moves with a uniform
+        rotation angle, only in the replicates that need it, and a mouse
+        stays put after max_retries rejections
+
+        Inputs
+        ------
+        movement_duration: (float) duration for movement in milliseconds
+        """
+        rows = np.arange(self.n_replicates)
+        self.retry_counts[:] = 0
+
+        for mouse in range(self.n_mice):
+            new_x, new_y, rotation_angle = self.propose_move(
+                mouse, rows, movement_duration)
+            valid = self.valid_move(mouse, rows, new_x, new_y, rotation_angle)
+            n_rejected = (~valid).astype(np.int32)
+
+            while not valid.all():
+                retry = rows[~valid & (n_rejected <= self.max_retries)]
+                if not retry.size:
+                    break
+
+                # n_candidates moves for each replicate, tested at once
+                candidates = np.repeat(retry, self.n_candidates)
+                candidate_x, candidate_y, candidate_angle = self.propose_move(
+                    mouse, candidates, movement_duration, hit_wall=True)
+                accepted = self.valid_move(
+                    mouse, candidates, candidate_x, candidate_y,
+                    candidate_angle).reshape(-1, self.n_candidates)
+
+                found = accepted.any(axis=1)
+                first = accepted.argmax(axis=1)
+                n_rejected[retry] += np.where(found, first, self.n_candidates)
+
+                pick = (np.arange(retry.size)*self.n_candidates + first)[found]
+                retry = retry[found]
+                new_x[retry] = candidate_x[pick]
+                new_y[retry] = candidate_y[pick]
+                rotation_angle[retry] = candidate_angle[pick]
+                valid[retry] = True
+
+            # the current pose is always valid, as other mice only move where
+            # they do not overlap this one
+            stay = ~valid
+            new_x[stay] = self.centers[stay, mouse, 0]
+            new_y[stay] = self.centers[stay, mouse, 1]
+            rotation_angle[stay] = self.angles[stay, mouse]
+            self.stay_put_count[stay, mouse] += 1
+            self.retry_counts[:, mouse] = n_rejected
+
+            self.previous_centers[:, mouse] = self.centers[:, mouse]
+            self.place(mouse, rows, new_x, new_y, rotation_angle)
+
+        self.n_steps += 1
+
+    def center_history_row(self):
+        """
+        current centers in the center_history layout of main.main
+
+        Returns
+        -------
+        (np array of shape R, n_mice*2) x and y column for each mouse
+        """
+        return self.centers.reshape(self.n_replicates, self.n_mice*2)
+
+    def pose_history_row(self):
+        """
+        current poses in the pose_history layout of main.main
+
+        Returns
+        -------
+        (np array of shape R, n_mice, 3) x, y and rotation angle of each mouse
+        """
+        return np.concatenate((self.centers, self.angles[..., None]), axis=2)
+
+    def perimeter_history_row(self):
+        """
+        current perimeters in the perimeter_history layout of main.main
+
+        Returns
+        -------
+        (np array of shape R, n_mice*2, n_points) x and y row for each mouse
+        """
+        perimeters = np.stack((self.perimeter_x, self.perimeter_y), axis=2)
+        return perimeters.reshape(self.n_replicates, self.n_mice*2, -1)
+
+
+def run_batch(N_MICE, n_replicates, env_width=ENV_WIDTH,
+              env_height=ENV_HEIGHT, avg_speed=AVG_SPEED, speed_std=SPEED_STD,
+              major_axis=MAJOR_AXIS, minor_axis=MINOR_AXIS,
+              simulation_length_min=None, combined=False, seed=None,
+              clip_to_walls=True, n_candidates=16, max_retries=256,
+              progress=True, chunk_size=CHUNK_SIZE, compression='gzip',
+              pose_dtype=np.float64, store_perimeters=False,
+              perimeter_step=PERIMETER_STEP, turn_std=TURN_STD, motion=None,
+              decimate=1):
+    """
+    run R independent replicates of main.main in one vectorized batch. Data
+    are stored either in one h5 file per replicate, with the same layout as
+    main.main, or in one combined h5 file with a group per replicate
+
+    Inputs
+    ------
+    N_MICE: (int) the number of mice to simulate
+    n_replicates: (int) the number of independent replicates
+    env_width: (int) width of arena in mm
+    env_height: (int) height of arena in mm
+    avg_speed: (float) mouse average speed (mm/ms)
+    speed_std: (float) mouse speed standard deviation (mm/ms)
+    major_axis: (float) major axis of ellipse representing mouse (mm)
+    minor_axis: (float) minor axis of ellipse representing mouse (mm)
+    simulation_length_min: (float) simulated time in minutes, defaults to the
+                           length used for N_MICE
+    combined: (bool) write a single file with one group per replicate
+    seed: (int or np.random.SeedSequence) seed of the batch, fresh entropy
+          is drawn when not given. Recorded in the h5 attrs either way.
+          Replicate r draws from child r of the seed, so it is the same
+          whatever n_replicates
+    clip_to_walls: (bool) whether moves that would cross a wall are shortened
+                   to stop at the wall rather than resampled
+    n_candidates: (int) number of moves tested at once after a rejection
+    max_retries: (int) maximum number of rejected moves in a step before a
+                 mouse stays put
+    progress: (bool) whether to show a progress bar
+    chunk_size: (int) number of timepoints buffered before each write
+    compression: (str or None) h5py compression filter of the datasets
+    pose_dtype: (np dtype) data type of pose_history
+    store_perimeters: (bool) also store every perimeter point in
+                      perimeter_history
+    perimeter_step: (float) angular step between perimeter points in
+                    radians
+    turn_std: (float) standard deviation of the rotation angle around the
+              heading direction (radians)
+    motion: (motion.GaussianMotion or motion.EmpiricalMotion or None) draws
+            the speeds and turns of the mice as in main.main, replacing the
+            default speeds and turn_std. None for gaussians
+    decimate: (int) store every decimate-th timepoint, from the initial
+              position on, as in main.main
+
+    Returns
+    -------
+    filenames: (list of str) the files that were written
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    if decimate < 1:
+        raise ValueError('decimate must be at least 1')
+
+    sim = BatchSimulation(n_replicates, N_MICE, env_width, env_height,
+                          avg_speed, speed_std, major_axis, minor_axis,
+                          seed=seed, clip_to_walls=clip_to_walls,
+                          n_candidates=n_candidates, max_retries=max_retries,
+                          perimeter_step=perimeter_step, turn_std=turn_std,
+                          motion=motion)
+
+    # duration is chosen so movements are on avg 1/5 of body length
+    movement_duration = (1/5)*(sim.major_axis/sim.avg_speed)
+
+    if simulation_length_min is None:
+        simulation_length_min = get_simulation_length_min(N_MICE)
+
+    simulation_length_ms = int(simulation_length_min*60*1000)
+    simulation_length_ms = int(simulation_length_ms/movement_duration)
+    n_timepoints = simulation_length_ms + 1
+
+    # open the output files, rows are streamed to them as the batch runs.
+    # Existing files are never overwritten
+    if combined:
+        filenames = [build_filename(N_MICE, simulation_length_min,
+                                    f'_batch{n_replicates}')]
+        files = [h5py.File(filenames[0], 'x')]
+        groups = [files[0].create_group(f'replicate_{r:03d}')
+                  for r in range(n_replicates)]
+    else:
+        filenames = [build_filename(N_MICE, simulation_length_min,
+                                    f'_r{r:03d}')
+                     for r in range(n_replicates)]
+        files = [h5py.File(filename, 'x') for filename in filenames]
+        groups = files
+
+    writers = [StreamingWriter(group, chunk_size=chunk_size,
+                               compression=compression) for group in groups]
+    for r, writer in enumerate(writers):
+        positions = writer.create_dataset('center_history', (N_MICE*2,))
+        poses = writer.create_dataset('pose_history', (N_MICE, 3),
+                                      dtype=pose_dtype)
+        poses.attrs['columns'] = 'x, y, rotation_angle'
+        poses.attrs['perimeter_step'] = perimeter_step
+        if store_perimeters:
+            writer.create_dataset('perimeter_history',
+                                  (N_MICE*2, sim.template.shape[1]))
+        retries = writer.create_dataset('retry_history', (N_MICE,),
+                                        dtype=np.int32)
+        retries.attrs['n_candidates'] = n_candidates
+        retries.attrs['max_retries'] = max_retries
+        positions.attrs['env_width'] = sim.width
+        positions.attrs['env_height'] = sim.height
+        positions.attrs['n_mice'] = N_MICE
+        positions.attrs['simulation_length_min'] = simulation_length_min
+        positions.attrs['avg_speed'] = sim.avg_speed
+        positions.attrs['speed_std'] = sim.speed_std
+        positions.attrs['turn_std'] = sim.turn_std
+        positions.attrs['major_axis'] = sim.major_axis
+        positions.attrs['minor_axis'] = sim.minor_axis
+        positions.attrs['clip_to_walls'] = clip_to_walls
+        positions.attrs['decimate'] = decimate
+        # entropy may not fit in 64 bits, so it is stored as a string
+        positions.attrs['seed'] = str(seed.entropy)
+        positions.attrs['spawn_key'] = np.array(seed.spawn_key, dtype=np.int64)
+        positions.attrs['replicate'] = r
+        positions.attrs['n_replicates'] = n_replicates
+        if motion is not None:
+            motion.write(groups[r])
+
+    try:
+        for timepoint in tqdm(range(n_timepoints), disable=not progress):
+            # the first timepoint is the initial position
+            if timepoint:
+                sim.step(movement_duration)
+            # only every decimate-th timepoint is stored
+            if timepoint % decimate:
+                continue
+
+            center_rows = sim.center_history_row()
+            pose_rows = sim.pose_history_row()
+            if store_perimeters:
+                perimeter_rows = sim.perimeter_history_row()
+            for r, writer in enumerate(writers):
+                writer.append('center_history', center_rows[r])
+                writer.append('pose_history', pose_rows[r])
+                if store_perimeters:
+                    writer.append('perimeter_history', perimeter_rows[r])
+                # retries are recorded for every stored step
+                if timepoint:
+                    writer.append('retry_history', sim.retry_counts[r])
+
+        for r, writer in enumerate(writers):
+            writer.flush()
+            writer.datasets['retry_history'].attrs['stay_put_count'] = (
+                sim.stay_put_count[r])
+    finally:
+        for f in files:
+            f.close()
+
+    return filenames
+
+
+if __name__ == "__main__":
+    simulation_rounds = 30
+
+    run_batch(N_MICE=2, n_replicates=simulation_rounds)
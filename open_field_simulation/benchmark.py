@@ -0,0 +1,478 @@
+from batch import BatchSimulation
+from core import Environment, Mouse
+from datetime import datetime
+import h5py
+from history import RingHistory
+from interactions import measure_interactions, score_group
+from kernel import KernelSimulation, HAVE_NUMBA
+from main import (main, ENV_WIDTH, ENV_HEIGHT, MAJOR_AXIS, MINOR_AXIS,
+                  AVG_SPEED, SPEED_STD)
+import argparse
+import json
+import numpy as np
+import os
+import platform
+from reader import read_perimeters
+import subprocess
+import tempfile
+import time
+from writer import StreamingWriter, CHUNK_SIZE
+
+
+# duration of a step, as in main.main
+MOVEMENT_DURATION = (1/5)*(MAJOR_AXIS/AVG_SPEED)
+# replicates advanced together by the batch engine
+BATCH_REPLICATES = 32
+# timepoints scored by the perimeter based reference scorer, which is slow
+REFERENCE_TIMEPOINTS = 200
+
+
+def python_engine(n_mice, n_steps, seed):
+    """
+    run the object engine of main.main (Environment and Mouse) without
+    writing any output
+
+    Inputs
+    ------
+    n_mice: (int) number of mice
+    n_steps: (int) number of steps to run
+    seed: (int) seed of the run
+
+    Returns
+    -------
+    (dict) elapsed_s, steps (timepoints advanced), mouse_steps, rejected
+    (rejected moves) and stay_put (steps where a mouse found no valid move)
+    """
+    env = Environment(ENV_WIDTH, ENV_HEIGHT,
+                      rng=np.random.default_rng(seed))
+    mice = [Mouse(env, n_mice, i,
+                  history=RingHistory(1, store_perimeters=False))
+            for i in range(n_mice)]
+
+    rejected = 0
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        for mouse in mice:
+            mouse.move(movement_duration=MOVEMENT_DURATION)
+            rejected += mouse.retry_history[-1]
+    elapsed = time.perf_counter() - start
+
+    return {'elapsed_s': elapsed,
+            'steps': n_steps,
+            'mouse_steps': n_steps*n_mice,
+            'rejected': int(rejected),
+            'stay_put': sum(mouse.stay_put_count for mouse in mice)}
+
+
+def batch_engine(n_mice, n_steps, seed, n_replicates=BATCH_REPLICATES):
+    """
+    run the vectorized engine of batch.run_batch without writing any output.
+    Each step advances every replicate, so steps count replicate timepoints
+
+    Inputs
+    ------
+    n_mice: (int) number of mice
+    n_steps: (int) number of steps to run
+    seed: (int) seed of the run
+    n_replicates: (int) number of replicates advanced together
+
+    Returns
+    -------
+    (dict) see python_engine
+    """
+    sim = BatchSimulation(n_replicates, n_mice, seed=seed)
+
+    rejected = 0
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        sim.step(MOVEMENT_DURATION)
+        rejected += sim.retry_counts.sum()
+    elapsed = time.perf_counter() - start
+
+    return {'elapsed_s': elapsed,
+            'steps': n_steps*n_replicates,
+            'mouse_steps': n_steps*n_replicates*n_mice,
+            'rejected': int(rejected),
+            'stay_put': int(sim.stay_put_count.sum())}
+
+
+def kernel_engine(n_mice, n_steps, seed):
+    """
+    run the step kernel of kernel.KernelSimulation without writing any
+    output. With numba, the first run of a process includes compilation,
+    which best_of discards by keeping the fastest repeat. Without numba the
+    kernel runs as plain python
+
+    Inputs
+    ------
+    n_mice: (int) number of mice
+    n_steps: (int) number of steps to run
+    seed: (int) seed of the run
+
+    Returns
+    -------
+    (dict) see python_engine
+    """
+    sim = KernelSimulation(n_mice, ENV_WIDTH, ENV_HEIGHT, AVG_SPEED,
+                           SPEED_STD, MAJOR_AXIS, MINOR_AXIS,
+                           rng=np.random.default_rng(seed))
+
+    start = time.perf_counter()
+    _, retries = sim.run(n_steps, MOVEMENT_DURATION)
+    elapsed = time.perf_counter() - start
+
+    return {'elapsed_s': elapsed,
+            'steps': n_steps,
+            'mouse_steps': n_steps*n_mice,
+            'rejected': int(retries.sum()),
+            'stay_put': int(sim.stay_put_count.sum())}
+
+
+# engines that can be benchmarked, {name: function(n_mice, n_steps, seed)}
+# returning a dict as python_engine does
+ENGINES = {'python': python_engine,
+           'batch': batch_engine,
+           'kernel': kernel_engine}
+
+
+def best_of(function, repeats, *args):
+    """
+    run a benchmark several times and keep the fastest run, which is the
+    least disturbed by other processes
+
+    Inputs
+    ------
+    function: (callable) benchmark returning a dict with elapsed_s
+    repeats: (int) number of runs
+    args: arguments of function
+
+    Returns
+    -------
+    (dict) result of the fastest run
+    """
+    return min((function(*args) for _ in range(repeats)),
+               key=lambda result: result['elapsed_s'])
+
+
+def bench_engine(engine, n_mice, n_steps, seed, repeats=3):
+    """
+    steps per second and move rejection rate of an engine
+
+    Inputs
+    ------
+    engine: (str) name of the engine in ENGINES
+    n_mice: (int) number of mice
+    n_steps: (int) number of steps per run
+    seed: (int) seed of every run, so each run does the same work
+    repeats: (int) number of runs, the fastest is kept
+
+    Returns
+    -------
+    (dict) one result record
+    """
+    result = best_of(ENGINES[engine], repeats, n_mice, n_steps, seed)
+    # each accepted move ends a run of rejected ones
+    proposed = result['rejected'] + result['mouse_steps'] - result['stay_put']
+
+    return {'benchmark': 'steps',
+            'engine': engine,
+            # whether the kernel ran compiled or as plain python
+            'compiled': engine == 'kernel' and HAVE_NUMBA,
+            'n_mice': n_mice,
+            **result,
+            'steps_per_s': result['steps']/result['elapsed_s'],
+            'mouse_steps_per_s': result['mouse_steps']/result['elapsed_s'],
+            'rejection_rate': result['rejected']/proposed,
+            'stay_put_rate': result['stay_put']/result['mouse_steps']}
+
+
+def write_rows(filename, rows, compression, chunk_size=CHUNK_SIZE):
+    """
+    stream rows to a new h5 file with a StreamingWriter
+
+    Inputs
+    ------
+    filename: (str) file to write
+    rows: (np array of shape n_rows, ...) rows to append
+    compression: (str or None) h5py compression filter
+    chunk_size: (int) number of rows buffered before each write
+
+    Returns
+    -------
+    (dict) elapsed_s
+    """
+    start = time.perf_counter()
+    with h5py.File(filename, 'w') as f:
+        writer = StreamingWriter(f, chunk_size=chunk_size,
+                                 compression=compression)
+        writer.create_dataset('pose_history', rows.shape[1:], rows.dtype)
+        for row in rows:
+            writer.append('pose_history', row)
+        writer.flush()
+
+    return {'elapsed_s': time.perf_counter() - start}
+
+
+def bench_writes(n_mice, n_rows, seed, directory, compression='gzip',
+                 repeats=3):
+    """
+    throughput of streaming pose_history rows to an h5 file, as main.main
+    does. The rows are random walks, which compress like simulated poses
+
+    Inputs
+    ------
+    n_mice: (int) number of mice per row
+    n_rows: (int) number of rows written
+    seed: (int) seed of the random poses
+    directory: (str) directory of the temporary file
+    compression: (str or None) h5py compression filter
+    repeats: (int) number of runs, the fastest is kept
+
+    Returns
+    -------
+    (dict) one result record
+    """
+    rng = np.random.default_rng(seed)
+    rows = ENV_HEIGHT/2 + rng.normal(0, 1, (n_rows, n_mice, 3)).cumsum(axis=0)
+    filename = os.path.join(directory, 'writes.h5')
+
+    result = best_of(write_rows, repeats, filename, rows, compression)
+    file_size = os.path.getsize(filename)
+    os.remove(filename)
+
+    return {'benchmark': 'writes',
+            'compression': compression,
+            'n_mice': n_mice,
+            'rows': n_rows,
+            **result,
+            'rows_per_s': n_rows/result['elapsed_s'],
+            'mb_per_s': rows.nbytes/result['elapsed_s']/1e6,
+            'compression_ratio': rows.nbytes/file_size}
+
+
+def time_scoring(filename, thresholds):
+    """
+    score every timepoint of a simulation file with interactions.score_group
+
+    Inputs
+    ------
+    filename: (str) simulation file
+    thresholds: (array of floats) distance thresholds in mm
+
+    Returns
+    -------
+    (dict) elapsed_s
+    """
+    start = time.perf_counter()
+    with h5py.File(filename, 'r') as f:
+        score_group(f, thresholds)
+
+    return {'elapsed_s': time.perf_counter() - start}
+
+
+def score_reference(filename, threshold, n_timepoints):
+    """
+    score the first timepoints of a simulation file from their perimeters,
+    with interactions.measure_interactions
+
+    Inputs
+    ------
+    filename: (str) simulation file
+    threshold: (float) distance threshold in mm
+    n_timepoints: (int) number of timepoints scored
+
+    Returns
+    -------
+    (dict) elapsed_s
+    """
+    with h5py.File(filename, 'r') as f:
+        n_mice = f['center_history'].attrs['n_mice']
+        perimeters = read_perimeters(f)[:n_timepoints]
+
+    start = time.perf_counter()
+    measure_interactions(n_mice, perimeters, threshold, MAJOR_AXIS)
+
+    return {'elapsed_s': time.perf_counter() - start}
+
+
+def bench_scoring(n_mice, n_steps, seed, directory, thresholds=(10,),
+                  repeats=3):
+    """
+    interaction scoring speed on a simulation of n_steps steps, for the
+    chunked exact gap scorer used by the analysis scripts and the perimeter
+    based reference scorer
+
+    Inputs
+    ------
+    n_mice: (int) number of mice
+    n_steps: (int) number of steps simulated
+    seed: (int) seed of the simulation
+    directory: (str) directory of the temporary simulation file
+    thresholds: (array of floats) distance thresholds in mm
+    repeats: (int) number of runs, the fastest is kept
+
+    Returns
+    -------
+    (list of dicts) one result record per scorer
+    """
+    filename = os.path.join(directory, 'scoring.h5')
+    simulation_length_min = n_steps*MOVEMENT_DURATION/60/1000
+    main(n_mice, simulation_length_min=simulation_length_min, seed=seed,
+         filename=filename, progress=False)
+
+    with h5py.File(filename, 'r') as f:
+        n_timepoints = f['pose_history'].shape[0]
+    n_reference = min(n_timepoints, REFERENCE_TIMEPOINTS)
+
+    chunked = best_of(time_scoring, repeats, filename, thresholds)
+    reference = best_of(score_reference, repeats, filename, thresholds[0],
+                        n_reference)
+    os.remove(filename)
+
+    return [{'benchmark': 'scoring',
+             'scorer': 'score_group',
+             'n_mice': n_mice,
+             'timepoints': n_timepoints,
+             'n_thresholds': len(thresholds),
+             **chunked,
+             'timepoints_per_s': n_timepoints/chunked['elapsed_s']},
+            {'benchmark': 'scoring',
+             'scorer': 'measure_interactions',
+             'n_mice': n_mice,
+             'timepoints': n_reference,
+             'n_thresholds': 1,
+             **reference,
+             'timepoints_per_s': n_reference/reference['elapsed_s']}]
+
+
+def git_commit():
+    """
+    commit of the code being benchmarked
+
+    Returns
+    -------
+    (str or None) hash of HEAD, None outside a git repository
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def engine_label(engine):
+    """
+    name of an engine in the printed results, saying whether the kernel is
+    compiled
+
+    Inputs
+    ------
+    engine: (str) name of the engine in ENGINES
+
+    Returns
+    -------
+    (str) label of the engine
+    """
+    if engine != 'kernel':
+        return f'{engine} engine'
+    if HAVE_NUMBA:
+        return 'kernel engine (numba)'
+    return 'kernel engine (plain python, numba not installed)'
+
+
+def run_benchmarks(n_mice=(1, 2, 3, 8), engines=tuple(ENGINES), n_steps=500,
+                   seed=0, repeats=3, out_file=None):
+    """
+    run the benchmark suite and write its results as json. Every benchmark
+    uses a fixed seed, so runs on different commits do the same work and
+    their results can be compared. When the python engine is benchmarked,
+    each engine result also gives its speedup over it in mouse steps per
+    second
+
+    Inputs
+    ------
+    n_mice: (list of ints) numbers of mice to benchmark
+    engines: (list of str) engines of ENGINES to benchmark
+    n_steps: (int) number of steps per engine run and simulated for scoring
+    seed: (int) seed of every benchmark
+    repeats: (int) number of runs of each benchmark, the fastest is kept
+    out_file: (str) json file to write, defaults to a timestamped name
+
+    Returns
+    -------
+    report: (dict) metadata and results, as written to out_file
+    """
+    if out_file is None:
+        str_datetime = datetime.now().strftime('%m%d%Y_%H%M%S')
+        out_file = f'benchmark_{str_datetime}.json'
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n in n_mice:
+            engine_results = [bench_engine(engine, n, n_steps, seed, repeats)
+                              for engine in engines]
+            if 'python' in engines:
+                python_rate = engine_results[engines.index('python')][
+                    'mouse_steps_per_s']
+                for result in engine_results:
+                    result['speedup'] = (result['mouse_steps_per_s']
+                                         /python_rate)
+
+            for result in engine_results:
+                speedup = (f", {result['speedup']:.1f}x the python engine"
+                           if 'speedup' in result else '')
+                print(f"{engine_label(result['engine'])}, {n} mice: "
+                      f"{result['steps_per_s']:.0f} steps/s{speedup}")
+            results.extend(engine_results)
+
+            for compression in ('gzip', None):
+                results.append(bench_writes(n, n_steps*10, seed, directory,
+                                            compression, repeats))
+                print(f"writes, {n} mice, {compression}: "
+                      f"{results[-1]['rows_per_s']:.0f} rows/s")
+
+            if n > 1:
+                results.extend(bench_scoring(n, n_steps, seed, directory,
+                                             repeats=repeats))
+                print(f"scoring, {n} mice: "
+                      f"{results[-2]['timepoints_per_s']:.0f} timepoints/s")
+
+    report = {'metadata': {'date': datetime.now().isoformat(),
+                           'commit': git_commit(),
+                           'python': platform.python_version(),
+                           'numpy': np.__version__,
+                           'h5py': h5py.__version__,
+                           'numba': HAVE_NUMBA,
+                           'machine': platform.machine(),
+                           'processor': platform.processor(),
+                           'n_steps': n_steps,
+                           'seed': seed,
+                           'repeats': repeats},
+              'results': results}
+
+    with open(out_file, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='benchmark the simulation engines, h5 writes and '
+                    'interaction scoring')
+    parser.add_argument('--n-mice', nargs='+', type=int, default=[1, 2, 3, 8],
+                        help='numbers of mice to benchmark')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES),
+                        choices=list(ENGINES), help='engines to benchmark')
+    parser.add_argument('--steps', type=int, default=500,
+                        help='steps per run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='runs per benchmark, the fastest is kept')
+    parser.add_argument('--out', help='json file to write')
+    args = parser.parse_args()
+
+    run_benchmarks(args.n_mice, args.engines, args.steps, args.seed,
+                   args.repeats, args.out)
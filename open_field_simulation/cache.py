@@ -0,0 +1,208 @@
+import h5py
+import hashlib
+import json
+import numpy as np
+import os
+
+
+# default name of the cache, kept next to the simulations
+CACHE_FILE = 'interaction_cache.json'
+# modules whose code determines the interaction scores
+SCORING_MODULES = ('collision.py', 'geometry.py', 'interactions.py',
+                   'reader.py')
+
+
+def code_version():
+    """
+    hash of the source of the modules the interaction scores depend on, so
+    cached results are dropped whenever that code changes
+
+    Returns
+    -------
+    (str) hex digest
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    digest = hashlib.sha256()
+    for module in SCORING_MODULES:
+        with open(os.path.join(directory, module), 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def file_hash(filename, block_size=1 << 20):
+    """
+    hash of the content of a file
+
+    Inputs
+    ------
+    filename: (str) file to hash
+    block_size: (int) number of bytes read at a time
+
+    Returns
+    -------
+    (str) hex digest
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class ResultsCache:
+    """
+    Class to keep interaction fractions between runs. Results are keyed by
+    the content hash of the simulation file, the simulation group, the body
+    axes and the threshold, so a simulation is only scored again when it
+    changes or for a new threshold. Results computed by another version of
+    the scoring code are dropped when the cache is loaded
+
+    Attributes
+    ----------
+    filename: (str) json file the cache is stored in
+    version: (str) code version of the cached results, see code_version
+    hashes: (dict) {path: [size, mtime_ns, hash]} content hash of each file,
+            reused while the file size and modification time are unchanged
+    results: (dict) {key: list of floats} fraction of time each mouse is
+             interacting
+
+    Methods
+    -------
+    hash(filename)
+        content hash of a simulation file
+    keys(filename, group_name, thresholds)
+        cache keys of one simulation for each threshold
+    missing(filename, group_name, thresholds)
+        thresholds of a simulation that are not in the cache
+    fractions(filename, group_name, thresholds)
+        cached fractions of a simulation
+    put(filename, group_name, thresholds, fractions)
+        store fractions of a simulation
+    save()
+        write the cache to its file
+    """
+    def __init__(self, filename=CACHE_FILE):
+        self.filename = filename
+        self.version = code_version()
+        self.hashes = {}
+        self.results = {}
+
+        if os.path.exists(filename):
+            with open(filename) as f:
+                stored = json.load(f)
+            self.hashes = stored['hashes']
+            if stored['version'] == self.version:
+                self.results = stored['results']
+
+    def hash(self, filename):
+        """
+        content hash of a simulation file. Files are only read again when
+        their size or modification time changed
+
+        Inputs
+        ------
+        filename: (str) simulation file
+
+        Returns
+        -------
+        (str) hex digest
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        size, mtime_ns, digest = self.hashes.get(path, (None, None, None))
+
+        if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            digest = file_hash(path)
+            self.hashes[path] = [stat.st_size, stat.st_mtime_ns, digest]
+
+        return digest
+
+    def keys(self, filename, group_name, thresholds):
+        """
+        cache keys of one simulation for each threshold
+
+        Inputs
+        ------
+        filename: (str) simulation file
+        group_name: (str) simulation group in the file
+        thresholds: (array of floats) distance thresholds in mm
+
+        Returns
+        -------
+        (list of str) key of the results for each threshold
+        """
+        with h5py.File(filename, 'r') as f:
+            attrs = f[group_name]['center_history'].attrs
+            major_axis = float(attrs['major_axis'])
+            minor_axis = float(attrs['minor_axis'])
+
+        prefix = (f'{self.hash(filename)}:{group_name}:{major_axis!r}:'
+                  f'{minor_axis!r}')
+        return [f'{prefix}:{float(threshold)!r}' for threshold in thresholds]
+
+    def missing(self, filename, group_name, thresholds):
+        """
+        thresholds of a simulation that are not in the cache
+
+        Inputs
+        ------
+        filename: (str) simulation file
+        group_name: (str) simulation group in the file
+        thresholds: (array of floats) distance thresholds in mm
+
+        Returns
+        -------
+        (np array of floats) thresholds still to be scored
+        """
+        keys = self.keys(filename, group_name, thresholds)
+        return np.array([threshold for threshold, key in zip(thresholds, keys)
+                         if key not in self.results], dtype=float)
+
+    def fractions(self, filename, group_name, thresholds):
+        """
+        cached fractions of a simulation, every threshold must be cached
+
+        Inputs
+        ------
+        filename: (str) simulation file
+        group_name: (str) simulation group in the file
+        thresholds: (array of floats) distance thresholds in mm
+
+        Returns
+        -------
+        fractions: (np array of shape n_mice, n_thresholds) fraction of time
+                   each mouse is interacting
+        """
+        keys = self.keys(filename, group_name, thresholds)
+        return np.array([self.results[key] for key in keys]).T
+
+    def put(self, filename, group_name, thresholds, fractions):
+        """
+        store fractions of a simulation
+
+        Inputs
+        ------
+        filename: (str) simulation file
+        group_name: (str) simulation group in the file
+        thresholds: (array of floats) distance thresholds in mm
+        fractions: (np array of shape n_mice, n_thresholds) fraction of time
+                   each mouse is interacting
+        """
+        keys = self.keys(filename, group_name, thresholds)
+        for key, column in zip(keys, np.asarray(fractions).T):
+            self.results[key] = column.tolist()
+
+    def save(self):
+        """
+        write the cache to its file. It is written under a temporary name
+        and renamed, so an interrupted save never corrupts it
+        """
+        partial = self.filename + '.partial'
+        with open(partial, 'w') as f:
+            json.dump({'version': self.version,
+                       'hashes': self.hashes,
+                       'results': self.results}, f)
+        os.replace(partial, self.filename)
@@ -0,0 +1,419 @@
+import numpy as np
+
+
+def half_extents(major_axis, minor_axis, rotation_angle):
+    """
+    half width and half height of the axis-aligned bounding box of a rotated
+    ellipse
+
+    Inputs
+    ------
+    major_axis: (float or np array) major axis of ellipse (mm)
+    minor_axis: (float or np array) minor axis of ellipse (mm)
+    rotation_angle: (float or np array) angle in radians
+
+    Returns
+    -------
+    half_width: (float or np array) half extent along x
+    half_height: (float or np array) half extent along y
+    """
+    a, b = major_axis/2, minor_axis/2
+    cos, sin = np.cos(rotation_angle), np.sin(rotation_angle)
+
+    half_width = np.sqrt((a*cos)**2 + (b*sin)**2)
+    half_height = np.sqrt((a*sin)**2 + (b*cos)**2)
+
+    return half_width, half_height
+
+
+def in_rectangle(x, y, major_axis, minor_axis, rotation_angle, width,
+                 height):
+    """
+    check whether rotated ellipses lie inside a width x height rectangle,
+    using the closed form half extents instead of perimeter points
+
+    Inputs
+    ------
+    x, y: (float or np array) center of ellipse(s)
+    major_axis: (float or np array) major axis of ellipse(s) (mm)
+    minor_axis: (float or np array) minor axis of ellipse(s) (mm)
+    rotation_angle: (float or np array) angle in radians
+    width: (float) width of rectangle
+    height: (float) height of rectangle
+
+    Returns
+    -------
+    (bool or np array of bools) whether each ellipse is inside
+    """
+    half_width, half_height = half_extents(
+        major_axis, minor_axis, rotation_angle)
+
+    return ((x - half_width > 0) & (x + half_width < width)
+            & (y - half_height > 0) & (y + half_height < height))
+
+
+def max_step_fraction(x, y, dx, dy, half_width, half_height, width, height):
+    """
+    largest fraction s in [0, 1] of the displacement (dx, dy) such that an
+    ellipse with the given half extents, moved to (x + s*dx, y + s*dy), lies
+    inside a width x height rectangle. The fraction is kept slightly below
+    the exact limit so the clipped ellipse is strictly inside
+
+    Inputs
+    ------
+    x, y: (float or np array) current center of ellipse(s)
+    dx, dy: (float or np array) proposed displacement
+    half_width, half_height: (float or np array) half extents of ellipse(s)
+                             at the proposed rotation angle
+    width: (float) width of rectangle
+    height: (float) height of rectangle
+
+    Returns
+    -------
+    (np array of floats) allowed fraction, 0 where no fraction of the
+    displacement keeps the ellipse inside
+    """
+    x, y, dx, dy = (np.asarray(value, dtype=float) for value in (x, y, dx, dy))
+
+    # slab method: along each axis the center must stay between the two
+    # walls shrunk by the half extent, which bounds s to an interval. A zero
+    # displacement gives an infinite interval when the center is between the
+    # walls and an empty one otherwise
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_1, x_2 = (half_width - x)/dx, (width - half_width - x)/dx
+        y_1, y_2 = (half_height - y)/dy, (height - half_height - y)/dy
+
+    lower = np.maximum(np.maximum(np.minimum(x_1, x_2), np.minimum(y_1, y_2)),
+                       0)
+    upper = np.minimum(np.minimum(np.maximum(x_1, x_2), np.maximum(y_1, y_2)),
+                       1)
+    upper = np.where(upper < 1, upper*(1 - 1e-9), upper)
+
+    return np.where(lower < upper, upper, 0.0)
+
+
+def shape_matrix(major_axis, minor_axis, rotation_angle):
+    """
+    entries of the symmetric matrix R diag(a^2, b^2) R^T describing a rotated
+    ellipse with semi-axes a, b
+
+    Inputs
+    ------
+    major_axis: (float or np array) major axis of ellipse (mm)
+    minor_axis: (float or np array) minor axis of ellipse (mm)
+    rotation_angle: (float or np array) angle in radians
+
+    Returns
+    -------
+    xx, xy, yy: (float or np array) entries of the shape matrix
+    """
+    a2, b2 = (major_axis/2)**2, (minor_axis/2)**2
+    cos, sin = np.cos(rotation_angle), np.sin(rotation_angle)
+
+    xx = a2*cos**2 + b2*sin**2
+    xy = (a2 - b2)*cos*sin
+    yy = a2*sin**2 + b2*cos**2
+
+    return xx, xy, yy
+
+
+def contact_polynomial(dx, dy, shape_1, shape_2):
+    """
+    coefficients of the cubic P(l) = det C(l) - l(1-l) r^T adj C(l) r, with
+    C(l) = (1-l) S1 + l S2 and r the vector between the centers. This is
+    the Perram-Wertheim contact function written over a common denominator:
+    the ellipses overlap exactly when P > 0 for every l in [0, 1]
+
+    Inputs
+    ------
+    dx, dy: (np array) vector between the ellipse centers
+    shape_1: (tuple of np arrays) shape matrix entries of the first ellipse
+    shape_2: (tuple of np arrays) shape matrix entries of the second ellipse
+
+    Returns
+    -------
+    c0, c1, c2, c3: (np arrays) coefficients of P, lowest order first
+    """
+    xx, xy, yy = shape_1
+    dxx, dxy, dyy = (shape_2[0] - xx, shape_2[1] - xy, shape_2[2] - yy)
+
+    # det C(l) = d0 + d1 l + d2 l^2
+    d0 = xx*yy - xy**2
+    d1 = xx*dyy + dxx*yy - 2*xy*dxy
+    d2 = dxx*dyy - dxy**2
+
+    # r^T adj C(l) r = n0 + n1 l
+    n0 = yy*dx**2 - 2*xy*dx*dy + xx*dy**2
+    n1 = dyy*dx**2 - 2*dxy*dx*dy + dxx*dy**2
+
+    return d0, d1 - n0, d2 + n0 - n1, n1
+
+
+def separated(c0, c1, c2, c3):
+    """
+    determine whether the contact polynomial reaches zero inside (0, 1). P is
+    positive at both ends, so it does exactly when it is non-positive at one
+    of its turning points in (0, 1), which are found in closed form
+
+    Inputs
+    ------
+    c0, c1, c2, c3: (np arrays) coefficients of the contact polynomial
+
+    Returns
+    -------
+    (np array of bools) whether each pair of ellipses is separated
+    """
+    # turning points are the roots of P'(l) = c1 + 2 c2 l + 3 c3 l^2, solved
+    # in the numerically stable form that also covers c3 == 0
+    a, b, c = 3*c3, 2*c2, c1
+    discriminant = b**2 - 4*a*c
+    has_roots = discriminant >= 0
+    root = np.sqrt(np.where(has_roots, discriminant, 0))
+    q = -0.5*(b + np.copysign(root, b))
+
+    is_separated = np.zeros(np.shape(q), dtype=bool)
+    for numerator, denominator in ((q, a), (c, q)):
+        # turning points at -1 are ignored, this covers zero denominators
+        turning_point = np.divide(numerator, denominator,
+                                  out=np.full(np.shape(q), -1.0),
+                                  where=has_roots & (denominator != 0))
+        inside = (turning_point > 0) & (turning_point < 1)
+        value = c0 + turning_point*(
+            c1 + turning_point*(c2 + turning_point*c3))
+        is_separated |= inside & (value <= 0)
+
+    return is_separated
+
+
+def ellipses_overlap(x_1, y_1, major_1, minor_1, angle_1,
+                     x_2, y_2, major_2, minor_2, angle_2):
+    """
+    exact overlap test between ellipses. All inputs broadcast against each
+    other. Pairs are first culled with a bounding circle and an axis-aligned
+    bounding box test, pairs whose inscribed circles overlap are accepted,
+    and only the rest go through the analytic contact function test
+
+    Inputs
+    ------
+    x_1, y_1: (float or np array) center of first ellipse(s)
+    major_1, minor_1: (float or np array) axes of first ellipse(s) (mm)
+    angle_1: (float or np array) rotation angle of first ellipse(s)
+    x_2, y_2: (float or np array) center of second ellipse(s)
+    major_2, minor_2: (float or np array) axes of second ellipse(s) (mm)
+    angle_2: (float or np array) rotation angle of second ellipse(s)
+
+    Returns
+    -------
+    (np array of bools) whether each pair of ellipses overlaps. Ellipses that
+    only touch do not overlap
+    """
+    dx, dy = x_2 - x_1, y_2 - y_1
+    distance_sq = dx**2 + dy**2
+
+    # broad phase: bounding circles, then bounding boxes
+    candidates = distance_sq < ((major_1 + major_2)/2)**2
+    if not np.any(candidates):
+        return candidates
+
+    half_width_1, half_height_1 = half_extents(major_1, minor_1, angle_1)
+    half_width_2, half_height_2 = half_extents(major_2, minor_2, angle_2)
+    candidates &= ((np.abs(dx) < half_width_1 + half_width_2)
+                   & (np.abs(dy) < half_height_1 + half_height_2))
+
+    # inscribed circles overlap, so the ellipses do
+    overlap = candidates & (distance_sq < ((minor_1 + minor_2)/2)**2)
+    if not np.any(candidates & ~overlap):
+        return overlap
+
+    # narrow phase: exact test. It is closed form, so evaluating every pair
+    # is cheaper than gathering the few remaining candidates
+    shape_1 = shape_matrix(major_1, minor_1, angle_1)
+    shape_2 = shape_matrix(major_2, minor_2, angle_2)
+    overlap |= candidates & ~separated(
+        *contact_polynomial(dx, dy, shape_1, shape_2))
+
+    return overlap
+
+
+def point_ellipse_distance(x, y, semi_major, semi_minor, iterations=10):
+    """
+    distance from points to an axis-aligned ellipse centered at the origin.
+    The closest point is found from the root of g, the equation of the
+    Lagrange multiplier s of the projection (Eberly's method). g is convex
+    and decreasing, so Newton steps started below the root climb to it
+    without overshooting, quadratically once close. Points on or inside the
+    ellipse get 0
+
+    Inputs
+    ------
+    x, y: (np array) coordinates of the points in the frame of the ellipse
+    semi_major: (float or np array) semi-axis of the ellipse along x
+    semi_minor: (float or np array) semi-axis of the ellipse along y, not
+                larger than semi_major
+    iterations: (int) number of Newton steps, 10 reach float precision for
+                axis ratios up to 10
+
+    Returns
+    -------
+    (np array) distance from each point to the ellipse
+    """
+    # by symmetry the first quadrant is enough
+    y_0, y_1 = np.abs(x), np.abs(y)
+    z_0, z_1 = y_0/semi_major, y_1/semi_minor
+    ratio = (semi_major/semi_minor)**2
+    ratio_z_0 = ratio*z_0
+
+    # each term of g alone reaches 0 below the root, which is 0 for points
+    # inside the ellipse
+    s = np.maximum(np.maximum(ratio_z_0 - ratio, z_1 - 1), 0)
+    for _ in range(iterations):
+        p, q = ratio_z_0/(s + ratio), z_1/(s + 1)
+        g = p**2 + q**2 - 1
+        slope = 2*(p**2/(s + ratio) + q**2/(s + 1))
+        step = np.divide(g, slope, out=np.zeros(np.shape(g)),
+                         where=slope > 0)
+        s = np.maximum(s + step, 0)
+
+    return np.hypot(ratio*y_0/(s + ratio) - y_0, y_1/(s + 1) - y_1)
+
+
+def ellipse_gap(x_1, y_1, major_1, minor_1, angle_1,
+                x_2, y_2, major_2, minor_2, angle_2, samples=64,
+                iterations=40):
+    """
+    exact minimum distance between the outlines of pairs of ellipses, 0 for
+    ellipses that overlap. The distance from the first ellipse to the second
+    is a smooth function of the angle parametrizing the first outline: it is
+    sampled at a few angles and refined around the best sample by golden
+    section search, every point distance being exact
+
+    Inputs
+    ------
+    x_1, y_1: (np array) center of first ellipse(s)
+    major_1, minor_1: (float or np array) axes of first ellipse(s) (mm)
+    angle_1: (np array) rotation angle of first ellipse(s)
+    x_2, y_2: (np array) center of second ellipse(s)
+    major_2, minor_2: (float or np array) axes of second ellipse(s) (mm)
+    angle_2: (np array) rotation angle of second ellipse(s)
+    samples: (int) number of angles sampled along the first outline
+    iterations: (int) golden section steps refining the best sample
+
+    Returns
+    -------
+    (np array) minimum distance between each pair of ellipses (mm)
+    """
+    x_1, y_1, angle_1, x_2, y_2, angle_2, major_1, minor_1, major_2, \
+        minor_2 = np.broadcast_arrays(x_1, y_1, angle_1, x_2, y_2, angle_2,
+                                      major_1, minor_1, major_2, minor_2)
+    overlap = ellipses_overlap(x_1, y_1, major_1, minor_1, angle_1,
+                               x_2, y_2, major_2, minor_2, angle_2)
+
+    # the first outline in the frame of the second ellipse: centered, with
+    # its major axis along x
+    cos_2, sin_2 = np.cos(angle_2), np.sin(angle_2)
+    dx, dy = x_1 - x_2, y_1 - y_2
+    center_u = (dx*cos_2 + dy*sin_2)[..., None]
+    center_v = (dy*cos_2 - dx*sin_2)[..., None]
+    relative = (angle_1 - angle_2)[..., None]
+    cos_r, sin_r = np.cos(relative), np.sin(relative)
+    a_1, b_1 = major_1[..., None]/2, minor_1[..., None]/2
+    a_2, b_2 = major_2[..., None]/2, minor_2[..., None]/2
+
+    def distance(t):
+        x, y = a_1*np.cos(t), b_1*np.sin(t)
+        return point_ellipse_distance(center_u + x*cos_r - y*sin_r,
+                                      center_v + x*sin_r + y*cos_r, a_2, b_2)
+
+    step = 2*np.pi/samples
+    sampled = distance(np.arange(samples)*step)
+    best = sampled.argmin(axis=-1)[..., None]
+    gap = np.take_along_axis(sampled, best, axis=-1)
+
+    # golden section search over the two sampling intervals around the best
+    lower, upper = best*step - step, best*step + step
+    golden = (np.sqrt(5) - 1)/2
+    t_1, t_2 = upper - golden*(upper - lower), lower + golden*(upper - lower)
+    d_1, d_2 = distance(t_1), distance(t_2)
+    for _ in range(iterations):
+        left = d_1 < d_2
+        upper = np.where(left, t_2, upper)
+        lower = np.where(left, lower, t_1)
+        t_1, t_2 = (upper - golden*(upper - lower),
+                    lower + golden*(upper - lower))
+        d_1, d_2 = distance(t_1), distance(t_2)
+
+    gap = np.minimum(gap, np.minimum(d_1, d_2))[..., 0]
+    return np.where(overlap, 0.0, gap)
+
+
+def ellipses_within(x_1, y_1, major_1, minor_1, angle_1,
+                    x_2, y_2, major_2, minor_2, angle_2, distance,
+                    samples=(64, 1024)):
+    """
+    whether pairs of ellipses are closer than a distance, i.e. whether
+    ellipse_gap is below it, without measuring the gap of most pairs. The
+    distances of points sampled along the first outline bound the gap from
+    above, and since every outline point lies within half a sample spacing
+    of a sample, from below too. Pairs whose bounds straddle the distance
+    are sampled again more densely, and only those still undecided are
+    measured with ellipse_gap
+
+    Inputs
+    ------
+    x_1, y_1: (np array) center of first ellipse(s)
+    major_1, minor_1: (float or np array) axes of first ellipse(s) (mm)
+    angle_1: (np array) rotation angle of first ellipse(s)
+    x_2, y_2: (np array) center of second ellipse(s)
+    major_2, minor_2: (float or np array) axes of second ellipse(s) (mm)
+    angle_2: (np array) rotation angle of second ellipse(s)
+    distance: (float) distance in mm
+    samples: (tuple of ints) number of angles sampled along the first
+             outline in each round
+
+    Returns
+    -------
+    within: (np array of bools) whether each pair of ellipses is closer than
+            distance
+    """
+    args = np.broadcast_arrays(x_1, y_1, major_1, minor_1, angle_1,
+                               x_2, y_2, major_2, minor_2, angle_2)
+    x_1, y_1, major_1, minor_1, angle_1, \
+        x_2, y_2, major_2, minor_2, angle_2 = args
+    within = np.array(ellipses_overlap(*args))
+
+    # the outlines are at least the center distance minus the two semi-major
+    # axes apart
+    center_distance = np.hypot(x_2 - x_1, y_2 - y_1)
+    undecided = np.array(~within & (center_distance - (major_1 + major_2)/2
+                                    < distance))
+
+    for n_samples in samples:
+        if not undecided.any():
+            return within
+
+        # sampled points of the first outline in the frame of the second
+        x_1, y_1, major_1, minor_1, angle_1, \
+            x_2, y_2, major_2, minor_2, angle_2 = [arg[undecided]
+                                                   for arg in args]
+        cos_2, sin_2 = np.cos(angle_2), np.sin(angle_2)
+        dx, dy = x_1 - x_2, y_1 - y_2
+        cos_r = np.cos(angle_1 - angle_2)[:, None]
+        sin_r = np.sin(angle_1 - angle_2)[:, None]
+        step = 2*np.pi/n_samples
+        t = np.arange(n_samples)*step
+        x, y = major_1[:, None]/2*np.cos(t), minor_1[:, None]/2*np.sin(t)
+        sampled = point_ellipse_distance(
+            (dx*cos_2 + dy*sin_2)[:, None] + x*cos_r - y*sin_r,
+            (dy*cos_2 - dx*sin_2)[:, None] + x*sin_r + y*cos_r,
+            major_2[:, None]/2, minor_2[:, None]/2).min(axis=-1)
+
+        # the outline moves at most a semi-major axis per radian
+        error = major_1/2*step/2
+        within[undecided] = sampled < distance
+        undecided[undecided] = ((sampled >= distance)
+                                & (sampled - error < distance))
+
+    if undecided.any():
+        within[undecided] = ellipse_gap(
+            *[arg[undecided] for arg in args]) < distance
+    return within
@@ -1,58 +1,107 @@
 import numpy as np
 import math
 import string
-import random
+from collision import half_extents, in_rectangle, max_step_fraction
+from engine import ArrayEngine, starting_positions
+from geometry import PERIMETER_STEP
+from history import FullHistory
+from motion import GaussianMotion
+from profiling import DISABLED
+from sampling import BlockSampler
 
 
 class Environment:
     """
-    Class to represent rectangular environment
+    Class to represent rectangular environment. The state of every mouse
+    lives in an ArrayEngine, this class is a view over it
 
     Attributes
     ----------
     width: (int) width of arena in mm
     height: (int) height of arena in mm
-    mice: (dict) {'mouse_id': {'x': [], 'y': []}} contains current position
-          (perimeter) of all mice in the arena.
+    rng: (np.random.Generator) random number generator shared by the mice
+    engine: (ArrayEngine) array-backed centers, angles and perimeters of all
+            mice in the arena
+    mice: (dict) {'mouse_id': row} row of each mouse in the engine arrays
+    metrics: (InteractionMetrics or None) interaction metrics accumulated
+             while the simulation runs, see metrics.py
+    profiler: (Profiler) phase timers and counters of the simulation, see
+              profiling.py. Disabled unless one is given
+    perimeter_step: (float) angular step between perimeter points in radians
+    angle_bins: (int or None) build perimeters from templates pre-rotated to
+                this many quantized angles, None to rotate them exactly
 
     Methods
     -------
-    register_mouse(ID)
+    register_mouse(ID, major_axis, minor_axis)
         register a new mouse to the environment
+    get_mouse_perimeter(ID)
+        returns the stored perimeter of a given mouse
     store_mouse_position(ID, x, y)
         store current position of a given mouse
-    in_environment(mouse_perimeter)
+    in_environment(ID, center_x, center_y, rotation_angle)
         determines if mouse is in the environment
-    intersects(list_1, list_2)
-        determines whether two lists of points overlap
-    space_occupied(ID, mouse_perimeter_x, mouse_perimeter_y)
+    clip_to_walls(ID, new_x, new_y, rotation_angle)
+        shortens a proposed move so the mouse stops at the wall
+    space_occupied(ID, center_x, center_y, rotation_angle)
         determines whether a given space is occupied
-    valid_move(mouse_perimeter_x, mouse_perimeter_y, ID)
+    valid_move(ID, center_x, center_y, rotation_angle)
         determine if a proposed move is valid
+    update_metrics()
+        record the current poses in the interaction metrics
     """
-    def __init__(self, width, height):
+    def __init__(self, width, height, rng=None, metrics=None, profiler=None,
+                 perimeter_step=PERIMETER_STEP, angle_bins=None):
+        if rng is None:
+            rng = np.random.default_rng()
+
         self.width = width
         self.height = height
+        self.rng = rng
+        self.perimeter_step = perimeter_step
+        self.angle_bins = angle_bins
+        self.engine = ArrayEngine(perimeter_step=perimeter_step,
+                                  angle_bins=angle_bins)
         self.mice = {}
+        self.metrics = metrics
+        self.profiler = DISABLED if profiler is None else profiler
 
-    def register_mouse(self, ID):
+    def register_mouse(self, ID, major_axis=60, minor_axis=30):
         """
         register a new mouse in the environment
 
         Inputs
         ------
         ID: (str) mouse ID
+        major_axis: (float) major axis of ellipse representing mouse (mm)
+        minor_axis: (float) minor axis of ellipse representing mouse (mm)
 
         Returns
         -------
         bool whether the registration was successful
         """
         if ID not in self.mice.keys():
-            self.mice[ID] = {'x': [], 'y': []}
+            self.mice[ID] = self.engine.add_mouse(major_axis, minor_axis)
             return True
         else:
             return False
 
+    def get_mouse_perimeter(self, ID):
+        """
+        get the stored perimeter of a mouse
+
+        Inputs
+        ------
+        ID: (str) mouse ID
+
+        Returns
+        -------
+        x_points: (np array of floats) points along mouse perimeter
+        y_points: (np array of floats) points along mouse perimeter
+        """
+        index = self.mice[ID]
+        return self.engine.perimeter_x[index], self.engine.perimeter_y[index]
+
     def store_mouse_position(self, ID, x_points, y_points):
         """
         store current position of mouse
@@ -60,130 +109,189 @@ class Environment:
         Inputs
         ------
         ID: (str) mouse ID
-        x_points: (list of floats) points along mouse perimeter
-        y_points: (list of floats) points along mouse perimeter
+        x_points: (array of floats) points along mouse perimeter
+        y_points: (array of floats) points along mouse perimeter
 
         Returns
         -------
         """
-        self.mice[ID]['x'] = x_points
-        self.mice[ID]['y'] = y_points
+        index = self.mice[ID]
+        self.engine.perimeter_x[index] = x_points
+        self.engine.perimeter_y[index] = y_points
 
-    def in_environment(self, x_points, y_points):
+    def in_environment(self, ID, center_x, center_y, rotation_angle):
         """
-        check whether the passed points are in the environment
+        check whether a mouse at the given pose(s) is in the environment, from
+        the closed form half extents of its ellipse
 
         Inputs
         ------
-        x_points: (list of floats) points along mouse perimeter
-        y_points: (list of floats) points along mouse perimeter
+        ID: (str) mouse ID
+        center_x, center_y: (float or np array) proposed center(s) of mouse
+        rotation_angle: (float or np array) proposed rotation angle(s) in
+                        radians
 
         Returns
         -------
-        (bool) whether the points are in the environment or not
+        (bool or np array of bools) whether the mouse is in the environment
         """
-        x_in_env = [point > 0 and point < self.width for point in x_points]
-        y_in_env = [point > 0 and point < self.height for point in y_points]
-
-        return all(x_in_env + y_in_env)
+        major_axis, minor_axis = self.engine.axes[self.mice[ID]]
+        return in_rectangle(center_x, center_y, major_axis, minor_axis,
+                            rotation_angle, self.width, self.height)
 
-    def intersects(self, list_1, list_2):
+    def clip_to_walls(self, ID, new_x, new_y, rotation_angle):
         """
-        check whether the points in the two lists overlap
+        shorten a proposed move so the mouse stops at the wall instead of
+        crossing it. The move is shortened along its own direction, to the
+        largest displacement that keeps the mouse in the environment
 
         Inputs
         ------
-        list_1: (list of floats) points along mouse perimeter
-        list_2: (list of floats) points along mouse perimeter
+        ID: (str) mouse ID
+        new_x, new_y: (float or np array) proposed center(s) of mouse
+        rotation_angle: (float or np array) proposed rotation angle(s) in
+                        radians
 
         Returns
         -------
-        (bool) whether the points overlap
+        new_x, new_y: (float or np array) the clipped center(s), or the
+                      proposed one where no part of the move keeps the mouse
+                      in the environment
         """
-        points_greater = []
-        points_less_than = []
+        if np.all(self.in_environment(ID, new_x, new_y, rotation_angle)):
+            return new_x, new_y
 
-        for point in list_1:
-            greater = [point > x for x in list_2]
-            less_than = [point < x for x in list_2]
+        index = self.mice[ID]
+        current_x, current_y = self.engine.centers[index]
+        dx, dy = new_x - current_x, new_y - current_y
 
-            points_greater.append(any(greater))
-            points_less_than.append(any(less_than))
+        half_width, half_height = half_extents(
+            *self.engine.axes[index], rotation_angle)
+        fraction = max_step_fraction(current_x, current_y, dx, dy, half_width,
+                                     half_height, self.width, self.height)
 
-        return any(points_greater) and any(less_than)
+        # moves inside the environment have a fraction of 1
+        fraction = np.where(fraction > 0, fraction, 1)
+        return current_x + fraction*dx, current_y + fraction*dy
 
-    def space_occupied(self, ID, mouse_perimeter_x, mouse_perimeter_y):
+    def space_occupied(self, ID, center_x, center_y, rotation_angle):
         """
-        determine if the passed space is occupied
+        determine if the space a mouse would take at the given pose(s) is
+        occupied by any other mouse, with an exact ellipse overlap test
 
         Inputs
         ------
         ID: (str) mouse ID
-        mouse_perimeter_x: (list of floats) x points along mouse perimeter
-        mouse_perimeter_y: (list of floats) y points along mouse perimeter
+        center_x, center_y: (float or np array) proposed center(s) of mouse
+        rotation_angle: (float or np array) proposed rotation angle(s) in
+                        radians
 
         Returns
         -------
-        (bool) whether the space is occupied
+        (bool or np array of bools) whether the space is occupied
         """
-        is_occupied = []
-
-        other_mice = list(self.mice.keys())
-        other_mice.remove(ID)
-
-        if other_mice:
-            for mouse in other_mice:
-                x_within = self.intersects(
-                    mouse_perimeter_x, self.mice[mouse]['x'])
-                y_within = self.intersects(
-                    mouse_perimeter_x, self.mice[mouse]['y'])
-
-                is_occupied.append(x_within and y_within)
+        return self.engine.overlaps(
+            self.mice[ID], center_x, center_y, rotation_angle).any(axis=-1)
 
-            return any(is_occupied)
-        else:
-            return False
-
-    def valid_move(self, mouse_perimeter_x, mouse_perimeter_y, ID):
+    def valid_move(self, ID, center_x, center_y, rotation_angle):
         """"
-        determine if a proposed move is valid
+        determine if proposed move(s) are valid
 
         Inputs
         ------
-        mouse_perimeter_x: (list of floats) x points along mouse perimeter
-        mouse_perimeter_y: (list of floats) y points along mouse perimeter
         ID: (str) mouse ID
+        center_x, center_y: (float or np array) proposed center(s) of mouse
+        rotation_angle: (float or np array) proposed rotation angle(s) in
+                        radians
 
         Returns
         -------
-        (bool) whether the proposed move is valid
+        (bool or np array of bools) whether each proposed move is valid
 
         """
-        return (self.in_environment(mouse_perimeter_x, mouse_perimeter_y)
-                and not self.space_occupied(
-                                ID, mouse_perimeter_x, mouse_perimeter_y))
+        profiler = self.profiler
+        with profiler.phase('wall_check'):
+            valid = self.in_environment(ID, center_x, center_y,
+                                        rotation_angle)
+        if not np.any(valid):
+            profiler.count('rejected_wall', np.size(valid))
+            return valid
+
+        with profiler.phase('collision_check'):
+            occupied = self.space_occupied(
+                ID, center_x, center_y, rotation_angle)
+
+        if profiler.enabled:
+            profiler.count('rejected_wall', np.size(valid)
+                           - np.count_nonzero(valid))
+            profiler.count('rejected_collision',
+                           np.count_nonzero(valid & occupied))
+            profiler.count('accepted', np.count_nonzero(valid & ~occupied))
+
+        return valid & ~occupied
+
+    def update_metrics(self):
+        """
+        record the current pose of every mouse in the interaction metrics,
+        once per timepoint. Does nothing when no metrics are attached
+        """
+        if self.metrics is None:
+            return
+
+        n = self.engine.n_mice
+        with self.profiler.phase('metrics'):
+            self.metrics.update(self.engine.centers[:n],
+                                self.engine.angles[:n], self.engine.axes[:n])
 
 
 class Mouse:
     """
-    Class to represent a mouse. Modeled as a circle for now.
+    Class to represent a mouse. Modeled as an ellipse whose center, rotation
+    angle and perimeter are stored in the environment's ArrayEngine.
 
     Attributes
     ----------
     avg_speed: (int) mouse average speed (mm/ms) default 0.09
     speed_std: (int) mouse speed standard deviation (mm/ms) default 0.06
+    turn_std: (float) standard deviation of the rotation angle around the
+              heading direction (radians) default pi/4
+    motion: (GaussianMotion or EmpiricalMotion) draws speeds and turns, see
+            motion.py. Defaults to a GaussianMotion with avg_speed,
+            speed_std and turn_std, which are otherwise taken from it
     major_axis: (int) major axis of ellipse representing mouse (mm) default 60
     minor_axis: (int) minor axis of ellipse representing mouse (mm) default 30
     mouse_id: (str) unique random str for each mouse
     environment: (Environment) environment instance
+    rng: (np.random.Generator) random number generator, defaults to the
+         environment's
+    sampler: (BlockSampler) draws speeds and angles from rng in blocks
+    index: (int) row of this mouse in the environment's engine arrays
     x_center: (float) x position of mouse center
     y_center: (float) y position of mouse center
-    x_center_history: (list of floats) past x center positions
-    y_center_history: (list of floats) past y center positions
-    x_perimeter_history: (list of floats) past x perimeter positions
-    y_perimeter_history: (list of floats) past y perimeter positions
+    rotation_angle: (float) current rotation angle of mouse in radians
+    template: (np array of shape 2, n_points) perimeter at the origin
+    previous_center: (tuple of floats or None) center before the last move,
+                     None before the first move. The heading direction only
+                     needs it and the current center
+    history: (History) past positions, perimeters and retry counts, kept
+             according to its policy, see history.py. Defaults to a
+             FullHistory; positions streamed to a file as the simulation
+             runs only need a small RingHistory
+    x_center_history: (np array of floats) past x center positions
+    y_center_history: (np array of floats) past y center positions
+    x_perimeter_history: (np array of floats) past x perimeter positions
+    y_perimeter_history: (np array of floats) past y perimeter positions
     n_mice: (int) number of mice in arena
     order_placed: (int) the order this mouse was placed in arena (1st, 2nd...)
+    clip_to_walls: (bool) whether moves that would cross a wall are shortened
+                   to stop at the wall rather than resampled
+    n_candidates: (int) number of moves drawn and tested at once when a
+                  proposed move is rejected
+    max_retries: (int) maximum number of rejected moves in a step before the
+                 mouse stays put
+    retry_history: (np array of ints) number of rejected moves at each
+                   recorded step, 0 for the initial position
+    stay_put_count: (int) number of steps where no valid move was found
 
     Methods
     -------
@@ -205,66 +313,137 @@ class Mouse:
     get_mouse_perimeter(center_x, center_y, rotation_angle):
         get points along mouse perimeter
 
-    get_speed()
-        samples mouse speed from gaussian centered at avg_speed with std given
-        by speed_std
+    get_speed(size)
+        samples mouse speed from the motion model
 
     get_heading_direction()
         get mouse heading direction
 
-    get_rotation_angle(hit_wall)
+    get_rotation_angle(hit_wall, size)
         samples rotation angle from uniform (first move or if hit wall) or
-        gaussian distribution
+        the turns of the motion model
 
-    compute_new_center(duration, hit_wall)
+    compute_new_center(duration, hit_wall, size)
         compute new mouse center position
 
+    propose_move(duration, hit_wall, size)
+        propose a new center, stopping at the wall if clip_to_walls is set
+
+    resample_move(duration)
+        search for a valid move in batches of n_candidates
+
     move(movement_duration)
         move the mouse
 
-    update_position_history(mouse_perimeter_x, mouse_perimeter_y)
-        update center and perimeter history lists
+    update_position_history(mouse_perimeter_x, mouse_perimeter_y,
+                            n_rejected)
+        record the current position in the history
 
     get_position_history()
-        return center and perimeter history lists
+        return center and perimeter histories
     """
     def __init__(self, environment, n_mice, order_placed, avg_speed=None,
-                 speed_std=None, major_axis=None, minor_axis=None):
+                 speed_std=None, major_axis=None, minor_axis=None, rng=None,
+                 clip_to_walls=True, n_candidates=16, max_retries=256,
+                 history=None, turn_std=None, motion=None):
         if not avg_speed:
             avg_speed = 0.09
         if not speed_std:
             speed_std = 0.06
+        if not turn_std:
+            turn_std = math.pi/4
         if not major_axis:
             major_axis = 60
         if not minor_axis:
             minor_axis = 30
-
-        self.avg_speed = avg_speed
-        self.speed_std = speed_std
+        if rng is None:
+            rng = environment.rng
+        if motion is None:
+            motion = GaussianMotion(avg_speed, speed_std, turn_std)
+
+        self.motion = motion
+        self.avg_speed = motion.avg_speed
+        self.speed_std = motion.speed_std
+        self.turn_std = motion.turn_std
         self.major_axis = major_axis
         self.minor_axis = minor_axis
         self.ID = ''
         self.environment = environment
+        self.rng = rng
+        self.sampler = BlockSampler(rng)
+        self.clip_to_walls = clip_to_walls
+        self.n_candidates = n_candidates
+        self.max_retries = max_retries
+        self.stay_put_count = 0
+
+        if history is None:
+            history = FullHistory()
+        self.history = history
+        self.previous_center = None
 
-        self.x_center_history = []
-        self.y_center_history = []
-        self.x_perimeter_history = []
-        self.y_perimeter_history = []
-
-        self.initialize_position(n_mice, order_placed)
         self.register_to_env()
+        self.initialize_position(n_mice, order_placed)
+
+    @property
+    def x_center(self):
+        return self.environment.engine.centers[self.index, 0]
+
+    @x_center.setter
+    def x_center(self, value):
+        self.environment.engine.centers[self.index, 0] = value
+
+    @property
+    def y_center(self):
+        return self.environment.engine.centers[self.index, 1]
+
+    @y_center.setter
+    def y_center(self, value):
+        self.environment.engine.centers[self.index, 1] = value
+
+    @property
+    def rotation_angle(self):
+        return self.environment.engine.angles[self.index]
+
+    @rotation_angle.setter
+    def rotation_angle(self, value):
+        self.environment.engine.angles[self.index] = value
+
+    @property
+    def template(self):
+        return self.environment.engine.templates[self.index]
+
+    @property
+    def x_center_history(self):
+        return self.history.x_center
+
+    @property
+    def y_center_history(self):
+        return self.history.y_center
+
+    @property
+    def x_perimeter_history(self):
+        return self.history.x_perimeter
+
+    @property
+    def y_perimeter_history(self):
+        return self.history.y_perimeter
+
+    @property
+    def retry_history(self):
+        return self.history.retries
 
     def generate_id(self):
         """
         generate mouse ID
         """
         id_length = 10
-        self.ID = ''.join(random.choices(string.ascii_uppercase, k=id_length))
+        self.ID = ''.join(self.rng.choice(list(string.ascii_uppercase),
+                                          id_length))
 
     def initialize_position(self, n_mice, order_placed):
         """
         initialize mouse position. Mice are spaced equidistantly across the
-        environment width.
+        environment width, or on a lattice for large colonies.
 
         Inputs
         -------
@@ -272,22 +451,20 @@ class Mouse:
         order_placed: (int) the order this mouse was placed in environment
                            (1st, 2nd...)
         """
-        if n_mice == 1:
-            self.x_center = self.environment.width/2
-            self.y_center = self.environment.height/2
-        else:
-            # space mice equidistantly across the width of the environment
-            all_positions_x = np.linspace(0, self.environment.width, n_mice+2)
-            all_positions_y = np.linspace(0, self.environment.height, n_mice+2)
+        all_positions_x, all_positions_y = starting_positions(
+            n_mice, self.environment.width, self.environment.height,
+            self.major_axis)
 
-            self.x_center = all_positions_x[order_placed+1]
-            self.y_center = all_positions_y[order_placed+1]
+        self.x_center = all_positions_x[order_placed]
+        self.y_center = all_positions_y[order_placed]
 
-        rotation_angle = self.get_rotation_angle()
+        self.rotation_angle = self.get_rotation_angle()
         x_perimeter, y_perimeter = self.get_mouse_perimeter(
-            self.x_center, self.y_center, rotation_angle)
+            self.x_center, self.y_center, self.rotation_angle)
 
         self.update_position_history(x_perimeter, y_perimeter)
+        self.environment.store_mouse_position(
+            self.ID, x_perimeter, y_perimeter)
 
     def register_to_env(self):
         """
@@ -296,7 +473,10 @@ class Mouse:
         successful = False
         while not successful:
             self.generate_id()
-            successful = self.environment.register_mouse(self.ID)
+            successful = self.environment.register_mouse(
+                self.ID, self.major_axis, self.minor_axis)
+
+        self.index = self.environment.mice[self.ID]
 
     def get_position(self):
         """
@@ -332,41 +512,26 @@ class Mouse:
 
         Returns
         -------
-        mouse_perimeter_x: (list of floats) x points along mouse perimeter
-        mouse_perimeter_y: (list of floats) y points along mouse perimeter
+        mouse_perimeter_x: (np array of floats) x points along mouse perimeter
+        mouse_perimeter_y: (np array of floats) y points along mouse perimeter
         """
-        # discretize mouse perimeter at origin
-        x = [(self.major_axis/2)*math.cos(i)
-             for i in np.arange(0, 2*math.pi, 0.05)]
-        y = [(self.minor_axis/2)*math.sin(i)
-             for i in np.arange(0, 2*math.pi, 0.05)]
+        return self.environment.engine.perimeter(
+            self.index, center_x, center_y, rotation_angle)
 
-        mouse_perimeter_x, mouse_perimeter_y = [], []
-
-        # rotate mouse perimeter and move it to (center_x, center_y)
-        for i in range(len(x)):
-            mouse_perimeter_x.append(
-                x[i]*math.cos(rotation_angle)-y[i]*math.sin(rotation_angle)
-                + center_x)
-            mouse_perimeter_y.append(
-                y[i]*math.cos(rotation_angle)+x[i]*math.sin(rotation_angle)
-                + center_y)
-
-        return mouse_perimeter_x, mouse_perimeter_y
-
-    def get_speed(self):
+    def get_speed(self, size=None):
         """
-        samples mouse speed from gaussian centered at avg_speed with std given
-        by speed_std
+        samples mouse speed from the motion model, by default a gaussian
+        centered at avg_speed with std given by speed_std
+
+        Inputs
+        ------
+        size: (int) number of samples, None for a single float
 
         Returns
         -------
-        speed: (float) mm/ms
+        speed: (float or np array of floats) mm/ms
         """
-        return np.random.default_rng().normal(
-            self.avg_speed,
-            self.speed_std,
-            1)[0]
+        return self.motion.speed(self.sampler, size)
 
     def get_heading_direction(self):
         """
@@ -375,40 +540,42 @@ class Mouse:
         Returns
         heading_direction: (float) heading direction in radians
         """
+        previous_x, previous_y = self.previous_center
         return math.atan2(
-            (self.y_center_history[-2] - self.y_center_history[-1]),
-            (self.x_center_history[-2] - self.x_center_history[-1])
+            (previous_y - self.y_center),
+            (previous_x - self.x_center)
         )
 
-    def get_rotation_angle(self, hit_wall=False):
+    def get_rotation_angle(self, hit_wall=False, size=None):
         """
-        samples mouse's rotation angle from uniform(first move or hit wall) or
-        from gaussian centered at previous heading drxn
+        samples mouse's rotation angle from uniform(first move, hit wall or
+        stayed put) or from the turns of the motion model around previous
+        heading drxn
 
         Inputs
         ------
         hit_wall: (bool) whether the previous movement attempt hit the wall
+        size: (int) number of samples, None for a single float
 
         Returns
         -------
-        rotation_angle: (float) radians
+        rotation_angle: (float or np array of floats) radians
         """
-        if len(self.x_center_history) <= 1 or hit_wall:
-            angle = np.random.default_rng().uniform(0, 2*math.pi, 1)[0]
+        # after staying put there is no heading direction
+        if (self.previous_center is None or hit_wall
+                or self.previous_center == (self.x_center, self.y_center)):
+            angle = 2*math.pi*self.sampler.random(size)
             return angle
 
         elif not hit_wall:
             heading_direction = self.get_heading_direction()
 
-            angle = np.random.default_rng().normal(
-                heading_direction,
-                math.pi/4,
-                1
-            )[0]
+            angle = (heading_direction
+                     + self.motion.turn(self.sampler, size))
 
             return angle
 
-    def compute_new_center(self, duration, hit_wall=False):
+    def compute_new_center(self, duration, hit_wall=False, size=None):
         """
         compute new mouse center position
 
@@ -416,20 +583,21 @@ class Mouse:
         ------
         duration: (float) duration for movement in milliseconds
         hit_wall: (bool) whether the previous movement attempt hit the wall
+        size: (int) number of candidate moves, None for a single move
 
         Returns
         -------
-        new_x: (float) mouse's new x coordinate
-        new_y: (float) mouse's new y coordinate
-        rotation_angle: (float) rotation angle in radians
+        new_x: (float or np array) mouse's new x coordinate
+        new_y: (float or np array) mouse's new y coordinate
+        rotation_angle: (float or np array) rotation angle in radians
         """
-        speed = self.get_speed()
+        speed = self.get_speed(size)
         distance = speed*duration
 
-        rotation_angle = self.get_rotation_angle(hit_wall)
+        rotation_angle = self.get_rotation_angle(hit_wall, size)
 
-        displacement_x = distance*math.cos(rotation_angle)
-        displacement_y = distance*math.sin(rotation_angle)
+        displacement_x = distance*np.cos(rotation_angle)
+        displacement_y = distance*np.sin(rotation_angle)
 
         current_x, current_y = self.get_position()
 
@@ -438,46 +606,124 @@ class Mouse:
 
         return new_x, new_y, rotation_angle
 
+    def propose_move(self, duration, hit_wall=False, size=None):
+        """
+        propose a new center and rotation angle. With clip_to_walls, a move
+        that would cross a wall is shortened to stop at the wall
+
+        Inputs
+        ------
+        duration: (float) duration for movement in milliseconds
+        hit_wall: (bool) whether the previous movement attempt hit the wall
+        size: (int) number of candidate moves, None for a single move
+
+        Returns
+        -------
+        new_x: (float or np array) mouse's new x coordinate
+        new_y: (float or np array) mouse's new y coordinate
+        rotation_angle: (float or np array) rotation angle in radians
+        """
+        profiler = self.environment.profiler
+        with profiler.phase('sampling'):
+            new_x, new_y, rotation_angle = self.compute_new_center(
+                duration, hit_wall, size)
+
+        if self.clip_to_walls:
+            with profiler.phase('wall_clip'):
+                new_x, new_y = self.environment.clip_to_walls(
+                    self.ID, new_x, new_y, rotation_angle)
+
+        return new_x, new_y, rotation_angle
+
+    def resample_move(self, duration):
+        """
+        search for a valid move after a rejection. Batches of n_candidates
+        moves with a uniform rotation angle are tested at once and the first
+        valid one is taken, for at most max_retries candidates
+
+        Inputs
+        ------
+        duration: (float) duration for movement in milliseconds
+
+        Returns
+        -------
+        move: (tuple of floats or None) new_x, new_y and rotation_angle of the
+              first valid candidate, None if none was found
+        n_rejected: (int) number of candidates rejected
+        """
+        n_rejected = 0
+        while n_rejected < self.max_retries:
+            new_x, new_y, rotation_angle = self.propose_move(
+                duration, hit_wall=True, size=self.n_candidates)
+            valid = self.environment.valid_move(
+                self.ID, new_x, new_y, rotation_angle)
+
+            if valid.any():
+                first = int(valid.argmax())
+                return ((new_x[first], new_y[first], rotation_angle[first]),
+                        n_rejected + first)
+            n_rejected += self.n_candidates
+
+        return None, n_rejected
+
     def move(self, movement_duration):
         """
-        move the mouse
+        move the mouse. A rejected move is resampled with resample_move, and
+        the mouse stays put if no valid move is found. The number of rejected
+        moves is recorded in retry_history
 
         Inputs
         ------
         movement_duration: (float) duration for movement in milliseconds
         """
-        new_x, new_y, rotation_angle = self.compute_new_center(
-            movement_duration)
+        profiler = self.environment.profiler
+        new_x, new_y, rotation_angle = self.propose_move(movement_duration)
+        n_rejected = 0
 
-        mouse_perimeter_x, mouse_perimeter_y = self.get_mouse_perimeter(
-            new_x, new_y, rotation_angle)
+        if not self.environment.valid_move(
+                self.ID, new_x, new_y, rotation_angle):
+            with profiler.phase('resample'):
+                accepted, n_rejected = self.resample_move(movement_duration)
+            n_rejected += 1
 
-        while not self.environment.valid_move(
-                mouse_perimeter_x, mouse_perimeter_y, self.ID):
+            if accepted is None:
+                # the current pose is always valid, as other mice only move
+                # where they do not overlap this one
+                self.stay_put_count += 1
+                profiler.count('stay_put')
+                accepted = (self.x_center, self.y_center, self.rotation_angle)
+            new_x, new_y, rotation_angle = accepted
 
-            new_x, new_y, rotation_angle = self.compute_new_center(
-                        movement_duration, hit_wall=True)
+        profiler.record('retries_per_step', n_rejected)
+
+        # the perimeter is only built for the accepted move
+        with profiler.phase('perimeter'):
             mouse_perimeter_x, mouse_perimeter_y = self.get_mouse_perimeter(
                 new_x, new_y, rotation_angle)
 
-        self.set_position(new_x, new_y)
-        self.update_position_history(mouse_perimeter_x, mouse_perimeter_y)
-        self.environment.store_mouse_position(
-            self.ID, mouse_perimeter_x, mouse_perimeter_y)
+        with profiler.phase('history'):
+            self.previous_center = (self.x_center, self.y_center)
+            self.set_position(new_x, new_y)
+            self.rotation_angle = rotation_angle
+            self.update_position_history(mouse_perimeter_x, mouse_perimeter_y,
+                                         n_rejected)
+            self.environment.store_mouse_position(
+                self.ID, mouse_perimeter_x, mouse_perimeter_y)
 
-    def update_position_history(self, mouse_perimeter_x, mouse_perimeter_y):
+    def update_position_history(self, mouse_perimeter_x, mouse_perimeter_y,
+                                n_rejected=0):
         """
-        update center and perimeter history lists
+        record the current center and perimeter in the history, if its
+        policy keeps this step
 
         Inputs
         ------
-        mouse_perimeter_x: (list of floats) current x perimeter points
-        mouse_perimeter_y: (list of floats) current y perimeter points
+        mouse_perimeter_x: (np array of floats) current x perimeter points
+        mouse_perimeter_y: (np array of floats) current y perimeter points
+        n_rejected: (int) moves rejected before reaching this position
         """
-        self.x_center_history.append(self.x_center)
-        self.y_center_history.append(self.y_center)
-        self.x_perimeter_history.append(mouse_perimeter_x)
-        self.y_perimeter_history.append(mouse_perimeter_y)
+        self.history.append(self.x_center, self.y_center, mouse_perimeter_x,
+                            mouse_perimeter_y, n_rejected)
 
     def get_position_history(self):
         """
@@ -485,10 +731,12 @@ class Mouse:
 
         Returns
         -------
-        x_center_history: (list of floats) past x center positions
-        y_center_history: (list of floats) past y center positions
-        x_perimeter_history: (list of floats) past x perimeter positions
-        y_perimeter_history: (list of floats) past y perimeter positions
+        x_center_history: (np array of floats) past x center positions
+        y_center_history: (np array of floats) past y center positions
+        x_perimeter_history: (np array of shape n_rows, n_points) past x
+                             perimeter positions
+        y_perimeter_history: (np array of shape n_rows, n_points) past y
+                             perimeter positions
         """
         return (self.x_center_history, self.y_center_history,
                 self.x_perimeter_history, self.y_perimeter_history)
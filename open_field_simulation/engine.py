@@ -0,0 +1,203 @@
+import numpy as np
+import math
+from collision import ellipses_overlap
+from geometry import (cached_template, ellipse_template, place_rotated,
+                      place_template, rotated_templates, PERIMETER_STEP)
+
+
+class ArrayEngine:
+    """
+    Class holding the state of every mouse in an environment in preallocated
+    numpy arrays. Environment and Mouse are thin views over this state, with
+    each mouse owning one row of every array
+
+    Attributes
+    ----------
+    n_mice: (int) number of mice stored in the engine
+    perimeter_step: (float) angular step between perimeter points in radians
+    angle_bins: (int or None) number of quantized rotation angles whose
+                pre-rotated templates are looked up by perimeter, None to
+                rotate templates exactly
+    n_points: (int) number of points along each mouse perimeter
+    centers: (np array of shape capacity, 2) x, y center of each mouse
+    angles: (np array of shape capacity) rotation angle of each mouse
+    axes: (np array of shape capacity, 2) major, minor axis of each mouse
+    templates: (np array of shape capacity, 2, n_points) unrotated perimeter
+               of each mouse at the origin, from the shared geometry cache
+    rotations: (list of np arrays) shared pre-rotated templates of each
+               mouse when angle_bins is set, see geometry.rotated_templates
+    perimeter_x: (np array of shape capacity, n_points) x perimeter points
+    perimeter_y: (np array of shape capacity, n_points) y perimeter points
+
+    Methods
+    -------
+    add_mouse(major_axis, minor_axis)
+        add a row for a new mouse
+    perimeter(index, center_x, center_y, rotation_angle)
+        perimeter of a mouse at the given pose
+    others(index)
+        indices of every mouse except the given one
+    overlaps(index, center_x, center_y, rotation_angle)
+        which other mice a mouse would overlap at the given pose(s)
+    """
+    def __init__(self, capacity=4, perimeter_step=PERIMETER_STEP,
+                 angle_bins=None):
+        self.n_mice = 0
+        self.perimeter_step = perimeter_step
+        self.angle_bins = angle_bins
+        self.n_points = ellipse_template(1, 1, perimeter_step).shape[1]
+        self.rotations = []
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        """
+        (re)allocate the state arrays, keeping the rows already in use
+
+        Inputs
+        ------
+        capacity: (int) number of rows to allocate
+        """
+        n, p = self.n_mice, self.n_points
+        arrays = {
+            'centers': np.zeros((capacity, 2)),
+            'angles': np.zeros(capacity),
+            'axes': np.zeros((capacity, 2)),
+            'templates': np.zeros((capacity, 2, p)),
+            'perimeter_x': np.zeros((capacity, p)),
+            'perimeter_y': np.zeros((capacity, p)),
+        }
+        for name, array in arrays.items():
+            if n:
+                array[:n] = getattr(self, name)[:n]
+            setattr(self, name, array)
+
+    def add_mouse(self, major_axis, minor_axis):
+        """
+        add a row for a new mouse
+
+        Inputs
+        ------
+        major_axis: (float) major axis of ellipse representing mouse (mm)
+        minor_axis: (float) minor axis of ellipse representing mouse (mm)
+
+        Returns
+        -------
+        index: (int) row of the new mouse in the state arrays
+        """
+        if self.n_mice == self.centers.shape[0]:
+            self._allocate(2*self.centers.shape[0])
+
+        index = self.n_mice
+        self.n_mice += 1
+
+        self.templates[index] = cached_template(major_axis, minor_axis,
+                                                self.perimeter_step)
+        if self.angle_bins is not None:
+            self.rotations.append(rotated_templates(
+                major_axis, minor_axis, self.perimeter_step, self.angle_bins))
+        self.axes[index] = major_axis, minor_axis
+
+        return index
+
+    def perimeter(self, index, center_x, center_y, rotation_angle):
+        """
+        perimeter of a mouse at the given pose(s). With angle_bins, the
+        template pre-rotated to the nearest quantized angle is looked up
+        instead of rotating the template
+
+        Inputs
+        ------
+        index: (int) row of the mouse
+        center_x, center_y: (float or np array) center(s) of the mouse
+        rotation_angle: (float or np array) rotation angle(s) in radians
+
+        Returns
+        -------
+        perimeter_x: (np array of shape ..., n_points) x perimeter points
+        perimeter_y: (np array of shape ..., n_points) y perimeter points
+        """
+        if self.angle_bins is not None:
+            return place_rotated(self.rotations[index], center_x, center_y,
+                                 rotation_angle)
+
+        return place_template(self.templates[index], center_x, center_y,
+                              rotation_angle)
+
+    def others(self, index):
+        """
+        indices of every mouse except the given one
+
+        Inputs
+        ------
+        index: (int) row of the reference mouse
+
+        Returns
+        -------
+        (np array of ints) rows of the other mice
+        """
+        rows = np.arange(self.n_mice)
+        return rows[rows != index]
+
+    def overlaps(self, index, center_x, center_y, rotation_angle,
+                 others=None):
+        """
+        which other mice a mouse would overlap at the given pose(s), using
+        the exact ellipse test of collision.ellipses_overlap
+
+        Inputs
+        ------
+        index: (int) row of the mouse
+        center_x, center_y: (float or np array of shape ...) proposed center
+        rotation_angle: (float or np array of shape ...) proposed angle
+        others: (np array of ints) rows to test against, defaults to every
+                other mouse
+
+        Returns
+        -------
+        (np array of bools of shape ..., n_others) overlap with each mouse
+        """
+        if others is None:
+            others = self.others(index)
+
+        major_axis, minor_axis = self.axes[index]
+        return ellipses_overlap(
+            np.asarray(center_x)[..., None], np.asarray(center_y)[..., None],
+            major_axis, minor_axis, np.asarray(rotation_angle)[..., None],
+            self.centers[others, 0], self.centers[others, 1],
+            self.axes[others, 0], self.axes[others, 1], self.angles[others])
+
+
+def starting_positions(n_mice, width, height, major_axis):
+    """
+    starting centers of the mice. Up to a few mice are spaced equidistantly
+    along the diagonal of the environment. When that spacing is shorter than
+    a mouse, as in large colonies, they are placed on a lattice instead
+
+    Inputs
+    ------
+    n_mice: (int) number of mice in environment
+    width: (float) width of arena in mm
+    height: (float) height of arena in mm
+    major_axis: (float) largest major axis of the mice (mm)
+
+    Returns
+    -------
+    x, y: (np arrays of shape n_mice) starting centers
+    """
+    if n_mice == 1:
+        return np.array([width/2]), np.array([height/2])
+
+    if math.hypot(width, height)/(n_mice+1) > major_axis:
+        # space mice equidistantly across the width of the environment
+        x = np.linspace(0, width, n_mice+2)[1:-1]
+        y = np.linspace(0, height, n_mice+2)[1:-1]
+        return x, y
+
+    columns = math.ceil(math.sqrt(n_mice*width/height))
+    rows = math.ceil(n_mice/columns)
+    if min(width/columns, height/rows) <= major_axis:
+        raise ValueError(f'{n_mice} mice do not fit in a {width} x {height} '
+                         f'mm environment')
+
+    row, column = np.divmod(np.arange(n_mice), columns)
+    return (column + 0.5)*width/columns, (row + 0.5)*height/rows
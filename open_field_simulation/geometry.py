@@ -0,0 +1,151 @@
+import numpy as np
+import math
+
+
+# angular step (radians) used to discretize the mouse perimeter
+PERIMETER_STEP = 0.05
+# number of quantized rotation angles of pre-rotated templates
+ANGLE_BINS = 720
+
+# templates already computed, shared by every mouse with the same body
+_templates = {}
+_rotated_templates = {}
+
+
+def ellipse_template(major_axis, minor_axis, step=PERIMETER_STEP):
+    """
+    discretize an ellipse centered at the origin with its major axis along x
+
+    Inputs
+    ------
+    major_axis: (float) major axis of ellipse (mm)
+    minor_axis: (float) minor axis of ellipse (mm)
+    step: (float) angular step between perimeter points in radians
+
+    Returns
+    -------
+    template: (np array of shape 2, n_points) x and y points along perimeter
+    """
+    t = np.arange(0, 2*math.pi, step)
+    template = np.empty((2, t.size))
+    template[0] = (major_axis/2)*np.cos(t)
+    template[1] = (minor_axis/2)*np.sin(t)
+
+    return template
+
+
+def cached_template(major_axis, minor_axis, step=PERIMETER_STEP):
+    """
+    perimeter template of a body geometry, computed once and shared by every
+    mouse, engine and reader with the same geometry. The template is a
+    contiguous read-only array
+
+    Inputs
+    ------
+    major_axis: (float) major axis of ellipse (mm)
+    minor_axis: (float) minor axis of ellipse (mm)
+    step: (float) angular step between perimeter points in radians
+
+    Returns
+    -------
+    template: (np array of shape 2, n_points) x and y points along perimeter
+    """
+    key = (float(major_axis), float(minor_axis), float(step))
+    template = _templates.get(key)
+
+    if template is None:
+        template = np.ascontiguousarray(
+            ellipse_template(major_axis, minor_axis, step))
+        template.flags.writeable = False
+        _templates[key] = template
+
+    return template
+
+
+def rotated_templates(major_axis, minor_axis, step=PERIMETER_STEP,
+                      n_angles=ANGLE_BINS):
+    """
+    templates of a body geometry rotated to n_angles equally spaced angles,
+    computed once and shared, see place_rotated
+
+    Inputs
+    ------
+    major_axis: (float) major axis of ellipse (mm)
+    minor_axis: (float) minor axis of ellipse (mm)
+    step: (float) angular step between perimeter points in radians
+    n_angles: (int) number of rotation angles over a full turn
+
+    Returns
+    -------
+    rotations: (np array of shape n_angles, 2, n_points) x and y points along
+               the perimeter at each angle
+    """
+    key = (float(major_axis), float(minor_axis), float(step), int(n_angles))
+    rotations = _rotated_templates.get(key)
+
+    if rotations is None:
+        angles = np.arange(n_angles)*(2*math.pi/n_angles)
+        rotations = np.stack(place_template(
+            cached_template(major_axis, minor_axis, step), 0, 0, angles),
+            axis=1)
+        rotations.flags.writeable = False
+        _rotated_templates[key] = rotations
+
+    return rotations
+
+
+def place_rotated(rotations, center_x, center_y, rotation_angle):
+    """
+    place a template pre-rotated to the nearest quantized angle at the given
+    center(s). This only costs a lookup and an addition, but points are off
+    by up to major_axis*pi/(2*n_angles) mm from place_template
+
+    Inputs
+    ------
+    rotations: (np array of shape n_angles, 2, n_points) pre-rotated
+               templates, see rotated_templates
+    center_x, center_y: (float or np array) center of ellipse
+    rotation_angle: (float or np array) angle in radians
+
+    Returns
+    -------
+    perimeter_x: (np array of shape ..., n_points) x points along perimeter
+    perimeter_y: (np array of shape ..., n_points) y points along perimeter
+    """
+    n_angles = rotations.shape[0]
+    bins = np.rint(np.asarray(rotation_angle)*(n_angles/(2*math.pi)))
+    template = rotations[bins.astype(int) % n_angles]
+
+    perimeter_x = template[..., 0, :] + np.asarray(center_x)[..., None]
+    perimeter_y = template[..., 1, :] + np.asarray(center_y)[..., None]
+
+    return perimeter_x, perimeter_y
+
+
+def place_template(template, center_x, center_y, rotation_angle):
+    """
+    rotate a perimeter template and move it to the given center(s). All
+    inputs broadcast, so many poses are placed in one batched operation
+
+    Inputs
+    ------
+    template: (np array of shape ..., 2, n_points) perimeter at the origin
+    center_x, center_y: (float or np array of shape ...) center of ellipse
+    rotation_angle: (float or np array of shape ...) angle in radians
+
+    Returns
+    -------
+    perimeter_x: (np array of shape ..., n_points) x points along perimeter
+    perimeter_y: (np array of shape ..., n_points) y points along perimeter
+    """
+    center_x = np.asarray(center_x, dtype=float)[..., None]
+    center_y = np.asarray(center_y, dtype=float)[..., None]
+    rotation_angle = np.asarray(rotation_angle, dtype=float)[..., None]
+
+    cos, sin = np.cos(rotation_angle), np.sin(rotation_angle)
+    x, y = template[..., 0, :], template[..., 1, :]
+
+    perimeter_x = x*cos - y*sin + center_x
+    perimeter_y = y*cos + x*sin + center_y
+
+    return perimeter_x, perimeter_y
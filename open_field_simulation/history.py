@@ -0,0 +1,203 @@
+import numpy as np
+
+
+class History:
+    """
+    Class to record the positions of a mouse in preallocated numpy arrays.
+    Each recorded row holds the center, the perimeter and the number of
+    moves rejected before reaching that position. Subclasses choose which
+    steps are kept: FullHistory keeps all of them, RingHistory the last K
+    and DecimatedHistory every Nth one
+
+    Attributes
+    ----------
+    capacity: (int) number of rows currently allocated
+    every: (int) only steps that are a multiple of every are recorded
+    ring: (bool) whether the oldest rows are overwritten once capacity is
+          reached, rather than the arrays grown
+    store_perimeters: (bool) whether perimeters are recorded
+    n_steps: (int) number of steps seen, recorded or not
+    n_recorded: (int) number of rows recorded, including overwritten ones
+    steps: (np array of ints) step of each kept row, oldest first
+    centers: (np array of shape n_rows, 2) x, y center of each kept row
+    x_center, y_center: (np array of floats) center of each kept row
+    x_perimeter, y_perimeter: (np array of shape n_rows, n_points) perimeter
+                              of each kept row
+    retries: (np array of ints) moves rejected before each kept row, 0 for
+             the initial position
+
+    Methods
+    -------
+    append(center_x, center_y, perimeter_x, perimeter_y, n_rejected)
+        record the position reached at one step
+    """
+    def __init__(self, capacity=1024, every=1, ring=False,
+                 store_perimeters=True):
+        if capacity < 1 or every < 1:
+            raise ValueError('capacity and every must be at least 1')
+
+        self.capacity = capacity
+        self.every = every
+        self.ring = ring
+        self.store_perimeters = store_perimeters
+        self.n_steps = 0
+        self.n_recorded = 0
+
+        self._steps = np.zeros(capacity, dtype=np.int64)
+        self._centers = np.zeros((capacity, 2))
+        self._retries = np.zeros(capacity, dtype=np.int64)
+        # allocated on the first append, once the number of points is known
+        self._perimeters = None
+
+    def __len__(self):
+        return min(self.n_recorded, self.capacity)
+
+    def _allocate(self, capacity):
+        """
+        grow the arrays, keeping the rows already recorded
+
+        Inputs
+        ------
+        capacity: (int) number of rows to allocate
+        """
+        n = len(self)
+        for name in ('_steps', '_centers', '_retries', '_perimeters'):
+            array = getattr(self, name)
+            if array is None:
+                continue
+            grown = np.zeros((capacity,) + array.shape[1:], array.dtype)
+            grown[:n] = array[:n]
+            setattr(self, name, grown)
+        self.capacity = capacity
+
+    def append(self, center_x, center_y, perimeter_x=None, perimeter_y=None,
+               n_rejected=0):
+        """
+        record the position reached at one step, if the policy keeps it
+
+        Inputs
+        ------
+        center_x, center_y: (float) center of the mouse
+        perimeter_x, perimeter_y: (np array of floats) perimeter of the mouse
+        n_rejected: (int) moves rejected before reaching this position
+        """
+        step = self.n_steps
+        self.n_steps += 1
+        if step % self.every:
+            return
+
+        if self.n_recorded == self.capacity and not self.ring:
+            self._allocate(2*self.capacity)
+        row = self.n_recorded % self.capacity
+
+        self._steps[row] = step
+        self._centers[row] = center_x, center_y
+        self._retries[row] = n_rejected
+        if self.store_perimeters and perimeter_x is not None:
+            if self._perimeters is None:
+                self._perimeters = np.zeros(
+                    (self.capacity, 2, np.size(perimeter_x)))
+            self._perimeters[row, 0] = perimeter_x
+            self._perimeters[row, 1] = perimeter_y
+        self.n_recorded += 1
+
+    def _ordered(self, array):
+        """
+        kept rows of an array, oldest first
+
+        Inputs
+        ------
+        array: (np array) one of the storage arrays
+
+        Returns
+        -------
+        (np array) a view of the recorded rows, or a copy once a ring buffer
+        has wrapped around
+        """
+        n = len(self)
+        if self.n_recorded <= self.capacity:
+            return array[:n]
+
+        start = self.n_recorded % self.capacity
+        return np.concatenate((array[start:], array[:start]))
+
+    @property
+    def steps(self):
+        return self._ordered(self._steps)
+
+    @property
+    def centers(self):
+        return self._ordered(self._centers)
+
+    @property
+    def x_center(self):
+        return self.centers[:, 0]
+
+    @property
+    def y_center(self):
+        return self.centers[:, 1]
+
+    @property
+    def x_perimeter(self):
+        if self._perimeters is None:
+            return np.zeros((0, 0))
+        return self._ordered(self._perimeters)[:, 0]
+
+    @property
+    def y_perimeter(self):
+        if self._perimeters is None:
+            return np.zeros((0, 0))
+        return self._ordered(self._perimeters)[:, 1]
+
+    @property
+    def retries(self):
+        return self._ordered(self._retries)
+
+
+class FullHistory(History):
+    """
+    Class to record every step. When the number of steps is known the arrays
+    are allocated once, otherwise they double in size as needed
+
+    Attributes
+    ----------
+    see History
+    """
+    def __init__(self, n_steps=None, store_perimeters=True):
+        # the initial position is recorded too
+        capacity = 1024 if n_steps is None else n_steps + 1
+        super().__init__(capacity, store_perimeters=store_perimeters)
+
+
+class RingHistory(History):
+    """
+    Class to record the last length steps in a ring buffer, so memory stays
+    constant however long the simulation runs
+
+    Attributes
+    ----------
+    see History
+    """
+    def __init__(self, length, store_perimeters=True):
+        super().__init__(length, ring=True, store_perimeters=store_perimeters)
+
+
+class DecimatedHistory(History):
+    """
+    Class to record every Nth step, from the initial position on. With
+    length, only the last length recorded steps are kept, in a ring buffer
+
+    Attributes
+    ----------
+    see History
+    """
+    def __init__(self, every, n_steps=None, length=None,
+                 store_perimeters=True):
+        if length is not None:
+            capacity, ring = length, True
+        elif n_steps is not None:
+            capacity, ring = n_steps//every + 1, False
+        else:
+            capacity, ring = 1024, False
+        super().__init__(capacity, every, ring, store_perimeters)
+
@@ -1,16 +1,304 @@
+import argparse
+import csv
 import h5py
 import numpy as np
-import os
+from cache import ResultsCache, CACHE_FILE
+from collision import ellipse_gap
 from datetime import datetime
-import sys
-from tqdm import tqdm
+from reader import find_simulations, read_poses
+
+
+# number of timepoints whose pairwise distances are computed at once
+CHUNK_SIZE = 256
+# number of mouse pairs whose exact distance is computed at once
+GAP_CHUNK_SIZE = 4096
+# number of timepoints read from a file at once when scoring it
+POSE_CHUNK_SIZE = 16384
+# columns of the tidy threshold table
+TABLE_COLUMNS = ('file', 'group', 'n_mice', 'mouse', 'threshold_mm',
+                 'interaction_fraction')
+
+
+def mouse_pairs(n_mice):
+    """
+    pairs of distinct mice, in the column order used for pair results
+
+    Inputs
+    ------
+    n_mice: (int) how many mice were simulated
+
+    Returns
+    -------
+    first, second: (np arrays of ints) the two mice of each pair, first <
+                   second
+    """
+    return np.triu_indices(n_mice, k=1)
+
+
+def perimeter_distance(perimeter_1, perimeter_2):
+    """
+    minimum distance between two sets of perimeter points, over all point
+    pairs at once
+
+    Inputs
+    ------
+    perimeter_1: (np array of shape ..., 2, perimeter_resolution) x and y
+                 rows of the first perimeter(s)
+    perimeter_2: (np array of shape ..., 2, perimeter_resolution) x and y
+                 rows of the second perimeter(s)
+
+    Returns
+    -------
+    (np array of shape ...) minimum point to point distance
+    """
+    dx = perimeter_1[..., 0, :, None] - perimeter_2[..., 0, None, :]
+    dy = perimeter_1[..., 1, :, None] - perimeter_2[..., 1, None, :]
+
+    return np.sqrt((dx**2 + dy**2).min(axis=(-2, -1)))
+
+
+def pair_distances(perimeter_history, chunk_size=CHUNK_SIZE):
+    """
+    minimum perimeter to perimeter distance of every pair of mice at every
+    timepoint. The file is processed chunk_size timepoints at a time, each
+    chunk in one broadcast operation per pair
+
+    Inputs
+    ------
+    perimeter_history: (np array, h5py dataset or reader.PerimeterReader of
+                        shape n_timepoints,n_mice*2,perimeter_resolution)
+                        each mouse's perimeter at each timepoint
+    chunk_size: (int) number of timepoints processed at once
+
+    Returns
+    -------
+    distances: (np array of shape n_timepoints, n_pairs) distance between the
+               mice of each pair of mouse_pairs
+    """
+    n_timepoints, n_rows, _ = perimeter_history.shape
+    first, second = mouse_pairs(n_rows//2)
+    distances = np.empty((n_timepoints, first.size))
+
+    for start in range(0, n_timepoints, chunk_size):
+        perimeters = np.asarray(perimeter_history[start:start+chunk_size])
+        # (chunk, n_mice, 2, perimeter_resolution)
+        perimeters = perimeters.reshape(perimeters.shape[0], -1, 2,
+                                        perimeters.shape[-1])
+        for pair, (i, j) in enumerate(zip(first, second)):
+            distances[start:start+chunk_size, pair] = perimeter_distance(
+                perimeters[:, i], perimeters[:, j])
+
+    return distances
+
+
+def pair_gaps(poses, major_axis, minor_axis, max_distance=np.inf,
+              chunk_size=GAP_CHUNK_SIZE):
+    """
+    exact minimum distance between the ellipses of every pair of mice at
+    every timepoint, in two stages. A vectorized center distance test first
+    culls the pairs that are certainly farther apart than max_distance, then
+    the exact ellipse to ellipse distance is computed for the others only
+
+    Inputs
+    ------
+    poses: (np array of shape n_timepoints, n_mice, 3) x, y and rotation
+           angle of each mouse, see reader.read_poses
+    major_axis: (float or np array of shape n_mice) major axis of ellipse
+                representing mice (mm)
+    minor_axis: (float or np array of shape n_mice) minor axis of ellipse
+                representing mice (mm)
+    max_distance: (float) distance beyond which pairs are not measured
+    chunk_size: (int) number of pairs measured at once
+
+    Returns
+    -------
+    gaps: (np array of shape n_timepoints, n_pairs) distance between the mice
+          of each pair of mouse_pairs, 0 when they touch, np.inf when farther
+          apart than max_distance
+    """
+    n_mice = poses.shape[1]
+    first, second = mouse_pairs(n_mice)
+    pose_1, pose_2 = poses[:, first], poses[:, second]
+    major_axis = np.broadcast_to(np.asarray(major_axis, dtype=float), n_mice)
+    minor_axis = np.broadcast_to(np.asarray(minor_axis, dtype=float), n_mice)
+
+    # stage one: the outlines are at least the center distance minus the
+    # two semi-major axes apart
+    center_distance = np.hypot(pose_2[..., 0] - pose_1[..., 0],
+                               pose_2[..., 1] - pose_1[..., 1])
+    reach = (major_axis[first] + major_axis[second])/2
+    in_range = center_distance - reach < max_distance
+
+    # stage two: exact distance of the pairs in range
+    gaps = np.full(in_range.shape, np.inf)
+    pose_1, pose_2 = pose_1[in_range], pose_2[in_range]
+    major_1 = np.broadcast_to(major_axis[first], in_range.shape)[in_range]
+    minor_1 = np.broadcast_to(minor_axis[first], in_range.shape)[in_range]
+    major_2 = np.broadcast_to(major_axis[second], in_range.shape)[in_range]
+    minor_2 = np.broadcast_to(minor_axis[second], in_range.shape)[in_range]
+
+    measured = np.empty(pose_1.shape[0])
+    for start in range(0, measured.size, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        measured[chunk] = ellipse_gap(
+            pose_1[chunk, 0], pose_1[chunk, 1], major_1[chunk],
+            minor_1[chunk], pose_1[chunk, 2], pose_2[chunk, 0],
+            pose_2[chunk, 1], major_2[chunk], minor_2[chunk],
+            pose_2[chunk, 2])
+
+    gaps[in_range] = np.where(measured < max_distance, measured, np.inf)
+    return gaps
+
+
+def interaction_distances(group, max_distance=np.inf, index=slice(None)):
+    """
+    per pair distance time series of a simulation file, see pair_gaps. The
+    distances can be compared to any threshold up to max_distance without
+    repeating the geometry
+
+    Inputs
+    ------
+    group: (h5py.File or h5py.Group) a simulation file or replicate group
+    max_distance: (float) distance beyond which pairs are not measured
+    index: (slice) timepoints to measure, all of them by default
+
+    Returns
+    -------
+    gaps: (np array of shape n_timepoints, n_pairs) distance between the mice
+          of each pair of mouse_pairs
+    """
+    attrs = group['center_history'].attrs
+    return pair_gaps(read_poses(group, index), attrs['major_axis'],
+                     attrs['minor_axis'], max_distance)
+
+
+def mouse_interactions(pair_interacting, n_mice):
+    """
+    whether each mouse interacts with any other mouse, from pair results
+
+    Inputs
+    ------
+    pair_interacting: (np array of bools of shape n_timepoints, n_pairs)
+                      whether the mice of each pair are interacting
+    n_mice: (int) how many mice were simulated
+
+    Returns
+    -------
+    interacting: (np array of bools of shape n_timepoints, n_mice)
+    """
+    first, second = mouse_pairs(n_mice)
+    interacting = np.zeros((pair_interacting.shape[0], n_mice), dtype=bool)
+
+    for pair, (i, j) in enumerate(zip(first, second)):
+        interacting[:, i] |= pair_interacting[:, pair]
+        interacting[:, j] |= pair_interacting[:, pair]
+
+    return interacting
+
+
+def mouse_distances(gaps, n_mice):
+    """
+    distance from each mouse to its nearest other mouse at each timepoint
+
+    Inputs
+    ------
+    gaps: (np array of shape n_timepoints, n_pairs) distance between the mice
+          of each pair of mouse_pairs
+    n_mice: (int) how many mice were simulated
+
+    Returns
+    -------
+    distances: (np array of shape n_timepoints, n_mice) np.inf for a mouse
+               alone in the arena
+    """
+    first, second = mouse_pairs(n_mice)
+    distances = np.full((gaps.shape[0], n_mice), np.inf)
+
+    for pair, (i, j) in enumerate(zip(first, second)):
+        np.minimum(distances[:, i], gaps[:, pair], out=distances[:, i])
+        np.minimum(distances[:, j], gaps[:, pair], out=distances[:, j])
+
+    return distances
+
+
+def threshold_counts(distances, thresholds):
+    """
+    number of timepoints each mouse is interacting, for many thresholds at
+    once. The distances of each mouse are sorted once, then the number of
+    timepoints below every threshold is read off with a binary search
+
+    Inputs
+    ------
+    distances: (np array of shape n_timepoints, n_mice) distance from each
+               mouse to its nearest other mouse, see mouse_distances
+    thresholds: (array of floats) distance thresholds in mm below which we
+                consider the mice to be interacting
+
+    Returns
+    -------
+    counts: (np array of ints of shape n_mice, n_thresholds)
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    distances = np.sort(distances, axis=0)
+
+    return np.stack([np.searchsorted(column, thresholds, side='left')
+                     for column in distances.T])
+
+
+def interaction_fractions(distances, thresholds):
+    """
+    fraction of time each mouse is interacting, for many thresholds at once,
+    see threshold_counts
+
+    Inputs
+    ------
+    distances: (np array of shape n_timepoints, n_mice) distance from each
+               mouse to its nearest other mouse, see mouse_distances
+    thresholds: (array of floats) distance thresholds in mm below which we
+                consider the mice to be interacting
+
+    Returns
+    -------
+    fractions: (np array of shape n_mice, n_thresholds)
+    """
+    return threshold_counts(distances, thresholds)/distances.shape[0]
+
+
+def score_group(group, thresholds, chunk_size=POSE_CHUNK_SIZE):
+    """
+    fraction of time each mouse of a simulation is interacting, for many
+    thresholds. The file is read chunk_size timepoints at a time and only
+    the counts are kept, so memory does not depend on the file length
+
+    Inputs
+    ------
+    group: (h5py.File or h5py.Group) a simulation file or replicate group
+    thresholds: (array of floats) distance thresholds in mm below which we
+                consider the mice to be interacting
+    chunk_size: (int) number of timepoints read at once
+
+    Returns
+    -------
+    fractions: (np array of shape n_mice, n_thresholds)
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    n_mice = int(group['center_history'].attrs['n_mice'])
+    n_timepoints = group['center_history'].shape[0]
+
+    counts = np.zeros((n_mice, thresholds.size), dtype=np.int64)
+    for start in range(0, n_timepoints, chunk_size):
+        gaps = interaction_distances(group, thresholds.max(),
+                                     slice(start, start + chunk_size))
+        counts += threshold_counts(mouse_distances(gaps, n_mice), thresholds)
+
+    return counts/n_timepoints
 
 
 def is_interacting(reference_mouse_positions, other_mice_positions, threshold,
                    n_other_mice, major_axis):
     """
     determine if a mouse is interacting with any other mouse at a given
-    timepoint. Ineffiecient solution
+    timepoint
 
     Inputs
     ------
@@ -20,31 +308,23 @@ def is_interacting(reference_mouse_positions, other_mice_positions, threshold,
     threshold: (int) distance threshold in mm below which we consider the mice
                to be interacting
     n_other_mice: (int) how many other mice are in the arena
-    major_axis: (int) length of major axis in mm
+    major_axis: (int) length of major axis in mm, not needed by the
+                vectorized test and kept for compatibility
 
     Returns
     -------
     interacting: (bool) whether the given mouse is interacting with any other
                  mouse at the given timepoint
     """
-    interacting = False
-
-    for mouse in range(n_other_mice):
-        mouse *= 2
-        for i in range(reference_mouse_positions.shape[1]):
-            for j in range(other_mice_positions.shape[1]):
-                distance = np.linalg.norm(
-                    [(reference_mouse_positions[0][i]
-                     - other_mice_positions[mouse][j]),
-                     (reference_mouse_positions[1][i]
-                     - other_mice_positions[mouse+1][j])]
-                )
-                if distance < threshold:
-                    return True
-                elif distance > (2*major_axis + 2*threshold):
-                    return False
+    if not n_other_mice:
+        return False
 
-    return interacting
+    other_mice_positions = np.asarray(other_mice_positions).reshape(
+        n_other_mice, 2, -1)
+    distances = perimeter_distance(
+        np.asarray(reference_mouse_positions), other_mice_positions)
+
+    return bool((distances < threshold).any())
 
 
 def measure_interactions(n_mice, perimeter_history, threshold, major_axis):
@@ -55,38 +335,171 @@ def measure_interactions(n_mice, perimeter_history, threshold, major_axis):
     Inputs
     ------
     n_mice: (int) how many mice were simulated
-    perimeter_history: (np array
-                        of shape n_timepoints,n_mice*2,perimeter_resolution)
+    perimeter_history: (np array, h5py dataset or reader.PerimeterReader of
+                        shape n_timepoints,n_mice*2,perimeter_resolution)
                         each mouse's perimeter at each timepoint
     threshold: (int) distance threshold in mm below which we consider the mice
                to be interacting
-    major_axis: (int) length of major axis in mm
+    major_axis: (int) length of major axis in mm, not needed by the
+                vectorized test and kept for compatibility
 
     Returns
     -------
     (np array of shape n_mice) the percent of time each mouse was interacting
     """
-    interacting = np.zeros((n_mice, perimeter_history.shape[0]))
+    distances = pair_distances(perimeter_history)
+    interacting = mouse_interactions(distances < threshold, n_mice)
 
+    return interacting.mean(axis=0)
+
+
+def simulation_files(sim_types=('2', '3')):
+    """
+    simulations in the current directory, grouped by number of mice. They
+    are found by the n_mice attr of their files, see
+    reader.find_simulations
+
+    Inputs
+    ------
+    sim_types: (tuple of str) numbers of mice to look for
+
+    Returns
+    -------
+    (dict) {sim_type: list of (filename, group name)}
+    """
+    return {sim_type: find_simulations('.', n_mice=int(sim_type))
+            for sim_type in sim_types}
+
+
+def score_file(filename, group_name, thresholds):
+    """
+    fraction of time each mouse of a simulation is interacting, see
+    score_group
+
+    Inputs
+    ------
+    filename: (str) simulation file
+    group_name: (str) simulation group in the file, '/' for the file itself
+    thresholds: (array of floats) distance thresholds in mm
+
+    Returns
+    -------
+    fractions: (np array of shape n_mice, n_thresholds)
+    """
+    with h5py.File(filename, 'r') as f:
+        return score_group(f[group_name], thresholds)
+
+
+def table_rows(filename, group_name, thresholds, fractions):
+    """
+    tidy rows of interaction fractions of one simulation
+
+    Inputs
+    ------
+    filename: (str) simulation file
+    group_name: (str) simulation group in the file
+    thresholds: (array of floats) distance thresholds in mm
+    fractions: (np array of shape n_mice, n_thresholds) fraction of time
+               each mouse is interacting
+
+    Returns
+    -------
+    rows: (list of dicts) one row per mouse and threshold, with keys
+          TABLE_COLUMNS
+    """
+    n_mice = fractions.shape[0]
+
+    rows = []
     for mouse in range(n_mice):
-        # since there is an x and y col for each mouse
-        mouse_by2 = mouse*2
+        for threshold, fraction in zip(thresholds, fractions[mouse]):
+            rows.append({'file': filename,
+                         'group': group_name,
+                         'n_mice': n_mice,
+                         'mouse': mouse,
+                         'threshold_mm': float(threshold),
+                         'interaction_fraction': float(fraction)})
 
-        for timepoint in tqdm(range(perimeter_history.shape[0])):
-            interacting[mouse, timepoint] = is_interacting(
-                perimeter_history[timepoint, mouse_by2:mouse_by2+2, :],
-                np.delete(
-                    perimeter_history[timepoint, :, :],
-                    [mouse_by2, mouse_by2+1],
-                    axis=0),
-                threshold,
-                n_mice-1,
-                major_axis)
+    return rows
 
-    return interacting.sum(axis=1) / interacting.shape[1]
 
+def score_simulation(filename, group_name, thresholds, cache=None):
+    """
+    tidy rows of interaction fractions of one simulation. With a cache, only
+    the thresholds it does not hold are scored
 
-def main(threshold):
+    Inputs
+    ------
+    filename: (str) simulation file
+    group_name: (str) simulation group in the file, '/' for the file itself
+    thresholds: (array of floats) distance thresholds in mm
+    cache: (cache.ResultsCache) results of previous runs, None to score
+           everything
+
+    Returns
+    -------
+    rows: (list of dicts) one row per mouse and threshold, with keys
+          TABLE_COLUMNS
+    """
+    if cache is None:
+        fractions = score_file(filename, group_name, thresholds)
+    else:
+        missing = cache.missing(filename, group_name, thresholds)
+        if missing.size:
+            cache.put(filename, group_name, missing,
+                      score_file(filename, group_name, missing))
+        fractions = cache.fractions(filename, group_name, thresholds)
+
+    return table_rows(filename, group_name, thresholds, fractions)
+
+
+def score_thresholds(simulations, thresholds, cache=None):
+    """
+    interaction fraction of every mouse of every simulation for every
+    threshold. Distances are computed once per timepoint, up to the largest
+    threshold, and all thresholds are scored from them in one pass
+
+    Inputs
+    ------
+    simulations: (list of (str, str)) filename and group name of each
+                 simulation, see reader.find_simulations
+    thresholds: (array of floats) distance thresholds in mm below which we
+                consider the mice to be interacting
+    cache: (cache.ResultsCache) results of previous runs, None to score
+           everything
+
+    Returns
+    -------
+    rows: (list of dicts) one row per simulation, mouse and threshold, with
+          keys TABLE_COLUMNS
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+
+    rows = []
+    for filename, group_name in simulations:
+        rows.extend(score_simulation(filename, group_name, thresholds, cache))
+
+    if cache is not None:
+        cache.save()
+
+    return rows
+
+
+def write_table(rows, out_file):
+    """
+    write a tidy table of results, one row per line, as csv
+
+    Inputs
+    ------
+    rows: (list of dicts) rows with keys TABLE_COLUMNS
+    out_file: (str) csv file to write
+    """
+    with open(out_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(threshold, cache_file=None):
     """
     main function to compute mouse interaction time for each simulation.
     Results are saved to a txt file in the current directory
@@ -95,9 +508,11 @@ def main(threshold):
     ------
     threshold: (int) distance threshold in mm below which we consider the mice
                to be interacting
+    cache_file: (str) cache of results of previous runs, e.g. CACHE_FILE,
+                so only new or changed simulations are scored. None, the
+                default, to score everything without writing a cache
     """
-    files = os.listdir()
-    sim_types = ['2', '3']
+    cache = None if cache_file is None else ResultsCache(cache_file)
 
     # build filename
     str_datetime = datetime.now().strftime('%m%d%Y_%H%M%S')
@@ -106,30 +521,76 @@ def main(threshold):
         f.write('Simulation results\n')
         f.write(f'distance threshold {threshold} mm\n')
 
-    for sim_type in sim_types:
+    for sim_type, files in simulation_files().items():
         with open(out_file, 'a') as f:
             f.write(f'{sim_type} mice\n')
 
-        for f in files:
-            if f[0] == sim_type:
-                print(f)
-                with h5py.File(f, 'r') as f:
-                    center_history_dataset = f.get('center_history')
-                    n_mice = center_history_dataset.attrs['n_mice']
-                    major_axis = center_history_dataset.attrs['major_axis']
-                    perimeter_history = f.get('perimeter_history')
-                    perimeter_history_np = np.array(perimeter_history)
+        for filename, group_name in files:
+            print(filename)
+            # calculate interaction %, only pairs within threshold are
+            # measured
+            rows = score_simulation(filename, group_name, [threshold], cache)
+            percent_interaction = [row['interaction_fraction']
+                                   for row in rows]
+
+            # append data to txt file
+            with open(out_file, 'a') as f:
+                f.write(' '.join(str(i) for i in percent_interaction))
+                f.write('\n')
 
-                # calculate interaction %
-                percent_interaction = measure_interactions(
-                    n_mice, perimeter_history_np, threshold, major_axis)
+    if cache is not None:
+        cache.save()
 
-                # append data to txt file
-                with open(out_file, 'a') as f:
-                    f.write(' '.join(str(i) for i in percent_interaction))
-                    f.write('\n')
+
+def main_thresholds(thresholds, out_file=None, cache_file=None):
+    """
+    compute mouse interaction time for each simulation at many thresholds,
+    for threshold sensitivity curves. Results are saved to a csv file in
+    the current directory, one row per file, mouse and threshold
+
+    Inputs
+    ------
+    thresholds: (array of floats) distance thresholds in mm
+    out_file: (str) csv file to write, defaults to a timestamped name
+    cache_file: (str) cache of results of previous runs, e.g. CACHE_FILE.
+                None, the default, to score everything without writing a
+                cache
+
+    Returns
+    -------
+    out_file: (str) the file that was written
+    """
+    if out_file is None:
+        str_datetime = datetime.now().strftime('%m%d%Y_%H%M%S')
+        out_file = f'sim_thresholds_{str_datetime}.csv'
+
+    simulations = [simulation for files in simulation_files().values()
+                   for simulation in files]
+    cache = None if cache_file is None else ResultsCache(cache_file)
+    write_table(score_thresholds(simulations, thresholds, cache), out_file)
+
+    return out_file
 
 
 if __name__ == "__main__":
-    threshold = int(sys.argv[1])  # mm
-    main(threshold)
+    parser = argparse.ArgumentParser(
+        description='score mouse interactions of the simulations in the '
+                    'current directory')
+    parser.add_argument('threshold', nargs='?', type=int,
+                        help='distance threshold in mm')
+    parser.add_argument('--thresholds', nargs='+', type=float,
+                        help='score many thresholds in one pass, written '
+                             'as a csv table')
+    parser.add_argument('--out', help='csv file for --thresholds')
+    parser.add_argument('--cache', nargs='?', const=CACHE_FILE,
+                        help=f'reuse and update the results of previous '
+                             f'runs kept in this file, {CACHE_FILE} if no '
+                             f'file is given')
+    args = parser.parse_args()
+
+    if args.thresholds:
+        main_thresholds(args.thresholds, args.out, args.cache)
+    elif args.threshold is not None:
+        main(args.threshold, args.cache)
+    else:
+        parser.error('give a threshold or --thresholds')
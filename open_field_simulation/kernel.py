@@ -0,0 +1,461 @@
+from engine import starting_positions
+import math
+from motion import GaussianMotion
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# whether the compiled kernel is available. numba is optional, without it the
+# kernel runs as plain python, see KernelSimulation
+HAVE_NUMBA = numba is not None
+# number of steps run per kernel call
+STEP_BLOCK = 4096
+
+
+def jit(function):
+    """
+    compile a function with numba when it is installed, otherwise return it
+    unchanged
+
+    Inputs
+    ------
+    function: (callable) function written in the numba subset of python
+
+    Returns
+    -------
+    (callable) the compiled or original function
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True, fastmath=False)(function)
+
+
+@jit
+def _half_extents(major_axis, minor_axis, cos, sin):
+    """
+    half width and half height of the bounding box of a rotated ellipse, see
+    collision.half_extents
+    """
+    a, b = major_axis/2, minor_axis/2
+    return (math.sqrt((a*cos)**2 + (b*sin)**2),
+            math.sqrt((a*sin)**2 + (b*cos)**2))
+
+
+@jit
+def _inside(x, y, half_width, half_height, width, height):
+    """
+    whether an ellipse with the given half extents lies inside the arena,
+    see collision.in_rectangle
+    """
+    return (x - half_width > 0 and x + half_width < width
+            and y - half_height > 0 and y + half_height < height)
+
+
+@jit
+def _step_fraction(x, y, dx, dy, half_width, half_height, width, height):
+    """
+    largest fraction of a displacement that keeps an ellipse inside the
+    arena, 1 when there is none, see collision.max_step_fraction
+    """
+    lower, upper = 0.0, 1.0
+    for position, step, half, size in ((x, dx, half_width, width),
+                                       (y, dy, half_height, height)):
+        if step != 0:
+            bound_1 = (half - position)/step
+            bound_2 = (size - half - position)/step
+            lower = max(lower, min(bound_1, bound_2))
+            upper = min(upper, max(bound_1, bound_2))
+        elif not half < position < size - half:
+            return 1.0
+
+    if upper < 1:
+        upper *= 1 - 1e-9
+    return upper if lower < upper and upper > 0 else 1.0
+
+
+@jit
+def _overlap(x_1, y_1, major_1, minor_1, angle_1, x_2, y_2, major_2, minor_2,
+             angle_2):
+    """
+    exact overlap test of two ellipses, see collision.ellipses_overlap
+    """
+    dx, dy = x_2 - x_1, y_2 - y_1
+    distance_sq = dx*dx + dy*dy
+    if distance_sq >= ((major_1 + major_2)/2)**2:
+        return False
+
+    cos_1, sin_1 = math.cos(angle_1), math.sin(angle_1)
+    cos_2, sin_2 = math.cos(angle_2), math.sin(angle_2)
+    half_width_1, half_height_1 = _half_extents(major_1, minor_1, cos_1,
+                                                sin_1)
+    half_width_2, half_height_2 = _half_extents(major_2, minor_2, cos_2,
+                                                sin_2)
+    if (abs(dx) >= half_width_1 + half_width_2
+            or abs(dy) >= half_height_1 + half_height_2):
+        return False
+    if distance_sq < ((minor_1 + minor_2)/2)**2:
+        return True
+
+    # shape matrices and the Perram-Wertheim contact polynomial, see
+    # collision.contact_polynomial
+    a2, b2 = (major_1/2)**2, (minor_1/2)**2
+    xx = a2*cos_1**2 + b2*sin_1**2
+    xy = (a2 - b2)*cos_1*sin_1
+    yy = a2*sin_1**2 + b2*cos_1**2
+    a2, b2 = (major_2/2)**2, (minor_2/2)**2
+    dxx = a2*cos_2**2 + b2*sin_2**2 - xx
+    dxy = (a2 - b2)*cos_2*sin_2 - xy
+    dyy = a2*sin_2**2 + b2*cos_2**2 - yy
+
+    d0 = xx*yy - xy**2
+    d1 = xx*dyy + dxx*yy - 2*xy*dxy
+    d2 = dxx*dyy - dxy**2
+    n0 = yy*dx**2 - 2*xy*dx*dy + xx*dy**2
+    n1 = dyy*dx**2 - 2*dxy*dx*dy + dxx*dy**2
+    c0, c1, c2, c3 = d0, d1 - n0, d2 + n0 - n1, n1
+
+    # separated when P is non-positive at a turning point in (0, 1), see
+    # collision.separated
+    a, b, c = 3*c3, 2*c2, c1
+    discriminant = b*b - 4*a*c
+    if discriminant < 0:
+        return True
+    q = -0.5*(b + math.copysign(math.sqrt(discriminant), b))
+    for numerator, denominator in ((q, a), (c, q)):
+        if denominator == 0:
+            continue
+        t = numerator/denominator
+        if 0 < t < 1 and c0 + t*(c1 + t*(c2 + t*c3)) <= 0:
+            return False
+    return True
+
+
+@jit
+def _valid(mouse, x, y, angle, cos, sin, centers, angles, axes, width,
+           height):
+    """
+    whether a mouse may move to a pose: inside the arena and not overlapping
+    any other mouse, see core.Environment.valid_move
+    """
+    half_width, half_height = _half_extents(axes[mouse, 0], axes[mouse, 1],
+                                            cos, sin)
+    if not _inside(x, y, half_width, half_height, width, height):
+        return False
+
+    for other in range(centers.shape[0]):
+        if other != mouse and _overlap(
+                x, y, axes[mouse, 0], axes[mouse, 1], angle,
+                centers[other, 0], centers[other, 1], axes[other, 0],
+                axes[other, 1], angles[other]):
+            return False
+    return True
+
+
+@jit
+def _draw(table, normal):
+    """
+    value of a tabulated distribution at the probability of a standard
+    normal value, so tables are drawn from the same stream as gaussians, see
+    motion.InverseCDF
+    """
+    position = 0.5*math.erfc(-normal/math.sqrt(2))*(table.size - 1)
+    i = min(int(position), table.size - 2)
+    return table[i] + (position - i)*(table[i + 1] - table[i])
+
+
+@jit
+def _propose(mouse, uniform_angle, normal, uniform, centers, previous, axes,
+             avg_speed, speed_std, turn_std, tables, duration, clip_to_walls,
+             width, height):
+    """
+    propose a move of one mouse, see core.Mouse.propose_move. Consumes one
+    normal for the speed and one normal or uniform for the angle. Speeds and
+    turns come from tables when they are not empty
+
+    Returns
+    -------
+    x, y, angle: (floats) proposed pose
+    """
+    if tables.shape[1]:
+        distance = _draw(tables[0], normal[0])*duration
+    else:
+        distance = (avg_speed + speed_std*normal[0])*duration
+    x, y = centers[mouse, 0], centers[mouse, 1]
+    if uniform_angle:
+        angle = 2*math.pi*uniform[0]
+    else:
+        heading = math.atan2(previous[mouse, 1] - y, previous[mouse, 0] - x)
+        if tables.shape[1]:
+            angle = heading + _draw(tables[1], normal[1])
+        else:
+            angle = heading + turn_std*normal[1]
+
+    cos, sin = math.cos(angle), math.sin(angle)
+    dx, dy = distance*cos, distance*sin
+    if clip_to_walls:
+        half_width, half_height = _half_extents(
+            axes[mouse, 0], axes[mouse, 1], cos, sin)
+        if not _inside(x + dx, y + dy, half_width, half_height, width,
+                       height):
+            fraction = _step_fraction(x, y, dx, dy, half_width, half_height,
+                                      width, height)
+            dx, dy = fraction*dx, fraction*dy
+
+    return x + dx, y + dy, angle
+
+
+@jit
+def run_steps(n_steps, centers, previous, angles, axes, moved, width, height,
+              avg_speed, speed_std, turn_std, tables, duration, clip_to_walls,
+              n_candidates, max_retries, normals, uniforms, poses, retries,
+              stay_put):
+    """
+    run the whole propose, validate and commit loop of every mouse for a
+    block of steps, with the same rules as core.Mouse.move. Random numbers
+    are taken from the given buffers; the loop stops early, between steps,
+    when they could run out, so the caller can refill them
+
+    Inputs
+    ------
+    n_steps: (int) number of steps to run
+    centers, previous: (np arrays of shape n_mice, 2) current center and the
+                       center before the last move, updated in place
+    angles: (np array of shape n_mice) rotation angles, updated in place
+    axes: (np array of shape n_mice, 2) major and minor axes (mm)
+    moved: (np array of bools of shape n_mice) whether each mouse has moved
+           yet, updated in place
+    width, height: (float) size of the arena in mm
+    avg_speed, speed_std: (float) speed distribution (mm/ms)
+    turn_std: (float) spread of the rotation angle around the heading
+              direction (radians)
+    tables: (np array of shape 2, n_quantiles) quantiles of speeds and turns
+            of a motion.EmpiricalMotion, or of shape 2, 0 to draw gaussians
+    duration: (float) duration of a step in ms
+    clip_to_walls: (bool) shorten moves at the wall rather than resample
+    n_candidates: (int) moves tested per batch after a rejection
+    max_retries: (int) rejected moves before a mouse stays put
+    normals, uniforms: (np arrays of floats) standard normal and uniform
+                       [0, 1) random numbers
+    poses: (np array of shape n_steps, n_mice, 3) filled with the pose of
+           each mouse after each step
+    retries: (np array of shape n_steps, n_mice) filled with the number of
+             rejected moves of each mouse at each step
+    stay_put: (np array of shape n_mice) steps without a valid move, updated
+              in place
+
+    Returns
+    -------
+    n_done, n_normals, n_uniforms: (ints) steps run and random numbers used
+    """
+    n_mice = centers.shape[0]
+    n_batches = (max_retries + n_candidates - 1)//n_candidates
+    # random numbers one step may need in the worst case
+    worst = n_mice*(2 + n_batches*n_candidates)
+    i_normal, i_uniform = 0, 0
+
+    for step in range(n_steps):
+        if (normals.size - i_normal < worst
+                or uniforms.size - i_uniform < worst):
+            return step, i_normal, i_uniform
+
+        for mouse in range(n_mice):
+            x, y = centers[mouse, 0], centers[mouse, 1]
+            # after staying put there is no heading direction
+            uniform_angle = (not moved[mouse] or (previous[mouse, 0] == x
+                                                  and previous[mouse, 1] == y))
+            new_x, new_y, angle = _propose(
+                mouse, uniform_angle, normals[i_normal:i_normal+2],
+                uniforms[i_uniform:i_uniform+1], centers, previous, axes,
+                avg_speed, speed_std, turn_std, tables, duration,
+                clip_to_walls, width, height)
+            i_normal += 2
+            i_uniform += uniform_angle
+
+            n_rejected = 0
+            valid = _valid(mouse, new_x, new_y, angle, math.cos(angle),
+                           math.sin(angle), centers, angles, axes, width,
+                           height)
+            if not valid:
+                n_rejected = 1
+                tested = 0
+                while tested < max_retries and not valid:
+                    for _ in range(n_candidates):
+                        new_x, new_y, angle = _propose(
+                            mouse, True, normals[i_normal:i_normal+1],
+                            uniforms[i_uniform:i_uniform+1], centers,
+                            previous, axes, avg_speed, speed_std, turn_std,
+                            tables, duration, clip_to_walls, width, height)
+                        i_normal += 1
+                        i_uniform += 1
+                        if _valid(mouse, new_x, new_y, angle,
+                                  math.cos(angle), math.sin(angle), centers,
+                                  angles, axes, width, height):
+                            valid = True
+                            break
+                        n_rejected += 1
+                    tested += n_candidates
+
+            if not valid:
+                # the current pose is always valid, as other mice only move
+                # where they do not overlap this one
+                new_x, new_y, angle = x, y, angles[mouse]
+                stay_put[mouse] += 1
+
+            previous[mouse, 0], previous[mouse, 1] = x, y
+            centers[mouse, 0], centers[mouse, 1] = new_x, new_y
+            angles[mouse] = angle
+            moved[mouse] = True
+
+            poses[step, mouse, 0] = new_x
+            poses[step, mouse, 1] = new_y
+            poses[step, mouse, 2] = angle
+            retries[step, mouse] = n_rejected
+
+    return n_steps, i_normal, i_uniform
+
+
+class KernelSimulation:
+    """
+    Class to run the simulation of main.main for all mice at once in
+    run_steps. numba is optional: when it is installed run_steps is
+    compiled, otherwise the same kernel runs as plain python on scalars.
+    Interpreted, it only saves the numpy calls core.Mouse.move makes for
+    single mice, and runs about 5 to 8 times faster than the python engine
+    for 1 to 8 mice rather than at compiled speed. benchmark.py reports the
+    speedup of the build it runs on. It follows the rules of Mouse.move but
+    draws random numbers in a different order, so it matches the Python
+    engine statistically rather than sample by sample
+
+    Attributes
+    ----------
+    n_mice: (int) number of mice
+    width, height: (float) size of the arena in mm
+    avg_speed, speed_std: (float) speed distribution (mm/ms)
+    turn_std: (float) spread of the rotation angle around the heading
+              direction (radians)
+    motion: (GaussianMotion or EmpiricalMotion) speeds and turns, see
+            motion.py. Defaults to a GaussianMotion with avg_speed,
+            speed_std and turn_std, which are otherwise taken from it
+    axes: (np array of shape n_mice, 2) major and minor axis of each mouse
+          (mm)
+    clip_to_walls: (bool) shorten moves at the wall rather than resample
+    n_candidates: (int) moves tested per batch after a rejection
+    max_retries: (int) rejected moves before a mouse stays put
+    rng: (np.random.Generator) random number generator
+    centers: (np array of shape n_mice, 2) current center of each mouse
+    angles: (np array of shape n_mice) current rotation angle of each mouse
+    stay_put_count: (np array of shape n_mice) steps without a valid move
+
+    Methods
+    -------
+    pose()
+        current pose of every mouse
+    run(n_steps, movement_duration)
+        run a block of steps
+    """
+    def __init__(self, n_mice, width, height, avg_speed, speed_std,
+                 major_axis, minor_axis, rng=None, clip_to_walls=True,
+                 n_candidates=16, max_retries=256, turn_std=math.pi/4,
+                 motion=None):
+        if rng is None:
+            rng = np.random.default_rng()
+        if motion is None:
+            motion = GaussianMotion(avg_speed, speed_std, turn_std)
+
+        self.n_mice = n_mice
+        self.width = width
+        self.height = height
+        self.motion = motion
+        self.avg_speed = motion.avg_speed
+        self.speed_std = motion.speed_std
+        self.turn_std = motion.turn_std
+        self._tables = np.array([motion.speed_table, motion.turn_table],
+                                dtype=float).reshape(2, -1)
+        self.axes = np.tile([float(major_axis), float(minor_axis)],
+                            (n_mice, 1))
+        self.clip_to_walls = clip_to_walls
+        self.n_candidates = n_candidates
+        self.max_retries = max_retries
+        self.rng = rng
+
+        # mice start as in core.Mouse.initialize_position
+        x, y = starting_positions(n_mice, width, height, major_axis)
+        self.centers = np.column_stack((x, y)).astype(float)
+        self.angles = 2*math.pi*rng.random(n_mice)
+        self.stay_put_count = np.zeros(n_mice, dtype=np.int64)
+        self._previous = self.centers.copy()
+        self._moved = np.zeros(n_mice, dtype=bool)
+        self._normals = np.empty(0)
+        self._uniforms = np.empty(0)
+
+    def pose(self):
+        """
+        current pose of every mouse
+
+        Returns
+        -------
+        (np array of shape n_mice, 3) x, y and rotation angle of each mouse
+        """
+        return np.column_stack((self.centers, self.angles))
+
+    def _refill(self, n_steps):
+        """
+        top up the random numbers, keeping the ones not used yet, so they
+        last n_steps steps without rejections plus one worst case step
+
+        Inputs
+        ------
+        n_steps: (int) number of steps the buffers should last
+        """
+        n_batches = -(-self.max_retries//self.n_candidates)
+        worst = self.n_mice*(2 + n_batches*self.n_candidates)
+        size = 2*self.n_mice*n_steps + worst
+
+        if self._normals.size < size:
+            self._normals = np.concatenate((self._normals,
+                                            self.rng.standard_normal(
+                                                size - self._normals.size)))
+        if self._uniforms.size < size:
+            self._uniforms = np.concatenate((self._uniforms, self.rng.random(
+                size - self._uniforms.size)))
+
+    def run(self, n_steps, movement_duration):
+        """
+        run a block of steps
+
+        Inputs
+        ------
+        n_steps: (int) number of steps to run
+        movement_duration: (float) duration of a step in ms
+
+        Returns
+        -------
+        poses: (np array of shape n_steps, n_mice, 3) pose of each mouse
+               after each step
+        retries: (np array of shape n_steps, n_mice) rejected moves of each
+                 mouse at each step
+        """
+        poses = np.empty((n_steps, self.n_mice, 3))
+        retries = np.empty((n_steps, self.n_mice), dtype=np.int32)
+
+        done = 0
+        while done < n_steps:
+            self._refill(n_steps - done)
+            n_done, n_normals, n_uniforms = run_steps(
+                n_steps - done, self.centers, self._previous, self.angles,
+                self.axes, self._moved, float(self.width),
+                float(self.height), float(self.avg_speed),
+                float(self.speed_std), float(self.turn_std), self._tables,
+                float(movement_duration),
+                self.clip_to_walls, self.n_candidates, self.max_retries,
+                self._normals, self._uniforms, poses[done:],
+                retries[done:], self.stay_put_count)
+            self._normals = self._normals[n_normals:]
+            self._uniforms = self._uniforms[n_uniforms:]
+            done += n_done
+
+        return poses, retries
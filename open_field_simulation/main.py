@@ -1,71 +1,63 @@
 from core import Environment, Mouse
 from datetime import datetime
+from geometry import (cached_template, place_rotated, place_template,
+                      rotated_templates, PERIMETER_STEP)
+from history import DecimatedHistory
 import h5py
+from kernel import KernelSimulation, STEP_BLOCK
+import math
+from metrics import InteractionMetrics
+from profiling import Profiler
 import numpy as np
 from tqdm import tqdm
+from writer import StreamingWriter, CHUNK_SIZE
 
 
-def main(N_MICE):
+ENV_WIDTH = 250  # mm
+ENV_HEIGHT = 180  # mm
+AVG_SPEED = 0.09  # mm/ms
+SPEED_STD = 0.06  # mm/ms
+TURN_STD = math.pi/4  # radians
+MAJOR_AXIS = 60  # mm
+MINOR_AXIS = 30  # mm
+
+
+def get_simulation_length_min(N_MICE):
     """
-    function runs the simulation. Data are stored in a h5 file in the current
-    directory
+    simulated time for a given number of mice
 
     Inputs
     ------
     N_MICE: (int) the number of mice to simulate
 
+    Returns
+    -------
+    simulation_length_min: (int) simulation length in minutes
     """
-    ENV_WIDTH = 250  # mm
-    ENV_HEIGHT = 180  # mm
-    AVG_SPEED = 0.09  # mm/ms
-    SPEED_STD = 0.06  # mm/ms
-    MAJOR_AXIS = 60  # mm
-    MINOR_AXIS = 30  # mm
-
-    env = Environment(ENV_WIDTH, ENV_HEIGHT)
-    mice = [Mouse(env, N_MICE, i, avg_speed=AVG_SPEED,
-                  speed_std=SPEED_STD, major_axis=MAJOR_AXIS,
-                  minor_axis=MINOR_AXIS) for i in range(N_MICE)]
-
-    # duration is chosen so movements are on avg 1/5 of body length
-    movement_duration = (1/5)*(MAJOR_AXIS/mice[0].avg_speed)
-
     if N_MICE == 2:
-        simulation_length_min = 5
+        return 5
     elif N_MICE == 3:
-        simulation_length_min = 10
+        return 10
     else:
-        simulation_length_min = 1
-
-    simulation_length_ms = int(simulation_length_min*60*1000)
-    simulation_length_ms = int(simulation_length_ms/movement_duration)
-
-    # this loop runs the simulation
-    for i in tqdm(range(simulation_length_ms)):
-        # duration here is in ms
-        for mouse in mice:
-            mouse.move(movement_duration=movement_duration)
+        return 1
 
-    # initialize arrays to store the data
-    x_center_history, _, x_perimeter_history, _ = mice[0].get_position_history()
-    center_history = np.zeros((len(x_center_history), N_MICE*2))
-    perimeter_history = np.zeros(
-        (len(x_perimeter_history), N_MICE*2, len(x_perimeter_history[0])))
 
-    for i, mouse in enumerate(mice):
-        # because there is an x and y column for each mouse
-        i *= 2
-        x_center_history, y_center_history, x_perimeter_history, y_perimeter_history = mouse.get_position_history()
-
-        center_history[:, i] = x_center_history
-        center_history[:, i+1] = y_center_history
+def build_filename(N_MICE, simulation_length_min, suffix=''):
+    """
+    build the output filename of a simulation. The timestamp has
+    microsecond resolution, so back-to-back runs get different names
 
-        for timepoint in range(len(x_perimeter_history)):
-            perimeter_history[timepoint, i, :] = x_perimeter_history[timepoint]
-            perimeter_history[timepoint, i+1, :] = y_perimeter_history[timepoint]
+    Inputs
+    ------
+    N_MICE: (int) the number of mice simulated
+    simulation_length_min: (int) simulation length in minutes
+    suffix: (str) appended after the timestamp
 
-    # build filename
-    str_datetime = datetime.now().strftime('%m%d%Y_%H%M%S')
+    Returns
+    -------
+    filename: (str)
+    """
+    str_datetime = datetime.now().strftime('%m%d%Y_%H%M%S_%f')
     if N_MICE == 1:
         filename = (f'{N_MICE}mouse_{simulation_length_min}'
                     f'min_{str_datetime}')
@@ -73,21 +65,289 @@ def main(N_MICE):
         filename = (f'{N_MICE}mice_{simulation_length_min}'
                     f'min_{str_datetime}')
 
-    # save data to h5 file
-    with h5py.File(filename, 'w') as f:
-        positions = f.create_dataset('center_history', center_history.shape,
-                                     dtype=float, data=center_history)
-        f.create_dataset('perimeter_history',
-                         perimeter_history.shape,
-                         dtype=float, data=perimeter_history)
-        positions.attrs['env_width'] = ENV_WIDTH
-        positions.attrs['env_height'] = ENV_HEIGHT
+    return filename + suffix
+
+
+def main(N_MICE, env_width=ENV_WIDTH, env_height=ENV_HEIGHT,
+         avg_speed=AVG_SPEED, speed_std=SPEED_STD, major_axis=MAJOR_AXIS,
+         minor_axis=MINOR_AXIS, simulation_length_min=None, seed=None,
+         clip_to_walls=True, n_candidates=16, max_retries=256, filename=None,
+         progress=True, chunk_size=CHUNK_SIZE, compression='gzip',
+         pose_dtype=np.float64, store_perimeters=False,
+         metrics_thresholds=None, profile=False,
+         perimeter_step=PERIMETER_STEP, angle_bins=None, engine='python',
+         stimulation=None, turn_std=TURN_STD, motion=None, decimate=1):
+    """
+    function runs the simulation. Data are streamed to a h5 file in the
+    current directory in chunks, so memory does not grow with the simulation
+    length. The pose (x, y, rotation angle) of each mouse is stored at each
+    timepoint, perimeters are rebuilt from it with reader.read_perimeters
+
+    Inputs
+    ------
+    N_MICE: (int) the number of mice to simulate
+    env_width: (int) width of arena in mm
+    env_height: (int) height of arena in mm
+    avg_speed: (float) mouse average speed (mm/ms)
+    speed_std: (float) mouse speed standard deviation (mm/ms)
+    major_axis: (float) major axis of ellipse representing mouse (mm)
+    minor_axis: (float) minor axis of ellipse representing mouse (mm)
+    simulation_length_min: (float) simulated time in minutes, defaults to the
+                           length used for N_MICE
+    seed: (int or np.random.SeedSequence) seed of the run, fresh entropy is
+          drawn when not given. Recorded in the h5 attrs either way
+    clip_to_walls: (bool) whether moves that would cross a wall are shortened
+                   to stop at the wall rather than resampled
+    n_candidates: (int) number of moves tested at once after a rejection
+    max_retries: (int) maximum number of rejected moves in a step before a
+                 mouse stays put
+    filename: (str) output file, defaults to a timestamped name. An existing
+              file is never overwritten, a FileExistsError is raised instead
+    progress: (bool) whether to show a progress bar
+    chunk_size: (int) number of timepoints buffered before each write
+    compression: (str or None) h5py compression filter of the datasets
+    pose_dtype: (np dtype) data type of pose_history, e.g. np.float32 to
+                halve its size
+    store_perimeters: (bool) also store every perimeter point in
+                      perimeter_history, as older files did
+    metrics_thresholds: (array of floats) distance thresholds in mm for
+                        which interaction metrics are accumulated while the
+                        simulation runs and written to a metrics group, see
+                        metrics.InteractionMetrics. None to skip them
+    profile: (bool) time the phases of each step and count move outcomes,
+             written to a profile group, see profiling.Profiler
+    perimeter_step: (float) angular step between perimeter points in
+                    radians, recorded for rebuilding perimeters
+    angle_bins: (int or None) build perimeters from templates pre-rotated to
+                this many quantized angles rather than rotating them, see
+                geometry.place_rotated. Only stored perimeters are affected
+    engine: (str) 'python' to move each Mouse in turn, or 'kernel' to run
+            blocks of steps of all mice in kernel.run_steps, compiled with
+            numba when it is installed and otherwise only a few times faster
+            than 'python', see kernel.KernelSimulation. The kernel follows
+            the same rules but draws random numbers in another order, so
+            runs match the python engine statistically, not sample by
+            sample
+    stimulation: (stimulation.Stimulator or None) closed-loop stimulation
+                 policy run on the poses of every timepoint, with its
+                 epochs and decision timings written to a stimulation group
+    turn_std: (float) standard deviation of the rotation angle around the
+              heading direction (radians), e.g. fitted to tracking data
+              with tracking.fit_motion
+    motion: (motion.GaussianMotion or motion.EmpiricalMotion or None) draws
+            the speeds and turns of the mice, e.g. an EmpiricalMotion of
+            tracked speeds and turns. Its avg_speed, speed_std and turn_std
+            replace the arguments, and it is written to a motion group.
+            None for gaussians with the arguments
+    decimate: (int) store every decimate-th timepoint, from the initial
+              position on, so long runs take decimate times less disk.
+              Metrics and stimulation still see every timepoint, and
+              retry_history holds the rejected moves of the step reaching
+              each stored timepoint
+
+    Returns
+    -------
+    filename: (str) the file that was written
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    if motion is not None:
+        avg_speed = motion.avg_speed
+        speed_std = motion.speed_std
+        turn_std = motion.turn_std
+
+    metrics = None
+    if metrics_thresholds is not None:
+        metrics = InteractionMetrics(metrics_thresholds)
+
+    if engine not in ('python', 'kernel'):
+        raise ValueError(f'unknown engine {engine!r}')
+    if decimate < 1:
+        raise ValueError('decimate must be at least 1')
+
+    profiler = Profiler(enabled=profile)
+    rng = np.random.default_rng(seed)
+
+    if engine == 'kernel':
+        sim = KernelSimulation(N_MICE, env_width, env_height, avg_speed,
+                               speed_std, major_axis, minor_axis, rng=rng,
+                               clip_to_walls=clip_to_walls,
+                               n_candidates=n_candidates,
+                               max_retries=max_retries, turn_std=turn_std,
+                               motion=motion)
+        if angle_bins is None:
+            template = cached_template(major_axis, minor_axis, perimeter_step)
+        else:
+            template = rotated_templates(major_axis, minor_axis,
+                                         perimeter_step, angle_bins)
+        n_points = template.shape[-1]
+    else:
+        env = Environment(env_width, env_height, rng=rng, metrics=metrics,
+                          profiler=profiler, perimeter_step=perimeter_step,
+                          angle_bins=angle_bins)
+        # positions are streamed to the file, the mice only keep the retry
+        # count of the last stored timepoint
+        mice = [Mouse(env, N_MICE, i, avg_speed=avg_speed,
+                      speed_std=speed_std, major_axis=major_axis,
+                      minor_axis=minor_axis, clip_to_walls=clip_to_walls,
+                      n_candidates=n_candidates, max_retries=max_retries,
+                      history=DecimatedHistory(decimate, length=1,
+                                               store_perimeters=False),
+                      turn_std=turn_std, motion=motion)
+                for i in range(N_MICE)]
+        rows = [mouse.index for mouse in mice]
+        n_points = env.engine.n_points
+
+    # duration is chosen so movements are on avg 1/5 of body length
+    movement_duration = (1/5)*(major_axis/avg_speed)
+
+    if simulation_length_min is None:
+        simulation_length_min = get_simulation_length_min(N_MICE)
+
+    simulation_length_ms = int(simulation_length_min*60*1000)
+    simulation_length_ms = int(simulation_length_ms/movement_duration)
+
+    # build filename
+    if filename is None:
+        filename = build_filename(N_MICE, simulation_length_min)
+
+    # save data to h5 file as the simulation runs, failing rather than
+    # overwriting an existing file
+    with h5py.File(filename, 'x') as f:
+        writer = StreamingWriter(f, chunk_size=chunk_size,
+                                 compression=compression)
+        positions = writer.create_dataset('center_history', (N_MICE*2,))
+        poses = writer.create_dataset('pose_history', (N_MICE, 3),
+                                      dtype=pose_dtype)
+        if store_perimeters:
+            perimeters = writer.create_dataset(
+                'perimeter_history', (N_MICE*2, n_points))
+            if angle_bins is not None:
+                perimeters.attrs['angle_bins'] = angle_bins
+        retries = writer.create_dataset('retry_history', (N_MICE,),
+                                        dtype=np.int32)
+
+        positions.attrs['env_width'] = env_width
+        positions.attrs['env_height'] = env_height
         positions.attrs['n_mice'] = N_MICE
         positions.attrs['simulation_length_min'] = simulation_length_min
-        positions.attrs['avg_speed'] = AVG_SPEED
-        positions.attrs['speed_std'] = SPEED_STD
-        positions.attrs['major_axis'] = MAJOR_AXIS
-        positions.attrs['minor_axis'] = MINOR_AXIS
+        positions.attrs['avg_speed'] = avg_speed
+        positions.attrs['speed_std'] = speed_std
+        positions.attrs['turn_std'] = turn_std
+        positions.attrs['major_axis'] = major_axis
+        positions.attrs['minor_axis'] = minor_axis
+        positions.attrs['clip_to_walls'] = clip_to_walls
+        positions.attrs['engine'] = engine
+        positions.attrs['decimate'] = decimate
+        # entropy may not fit in 64 bits, so it is stored as a string
+        positions.attrs['seed'] = str(seed.entropy)
+        positions.attrs['spawn_key'] = np.array(seed.spawn_key, dtype=np.int64)
+        poses.attrs['columns'] = 'x, y, rotation_angle'
+        poses.attrs['perimeter_step'] = perimeter_step
+        retries.attrs['n_candidates'] = n_candidates
+        retries.attrs['max_retries'] = max_retries
+
+        def write_pose(pose, perimeter_x, perimeter_y):
+            # because there is an x and y row for each mouse
+            writer.append('center_history', pose[:, :2].ravel())
+            writer.append('pose_history', pose)
+            if store_perimeters:
+                writer.append('perimeter_history', np.stack(
+                    (perimeter_x, perimeter_y), axis=1).reshape(N_MICE*2, -1))
+
+        def stimulate(pose, axes):
+            if stimulation is not None:
+                with profiler.phase('stimulation'):
+                    stimulation.update(pose[:, :2], pose[:, 2], axes)
+
+        if stimulation is not None:
+            stimulation.start(N_MICE, movement_duration)
+
+        if engine == 'kernel':
+            def write_kernel_pose(pose, stored=True):
+                perimeter_x = perimeter_y = None
+                if stored and store_perimeters:
+                    place = (place_template if angle_bins is None
+                             else place_rotated)
+                    perimeter_x, perimeter_y = place(
+                        template, pose[:, 0], pose[:, 1], pose[:, 2])
+                if stored:
+                    write_pose(pose, perimeter_x, perimeter_y)
+                if metrics is not None:
+                    metrics.update(pose[:, :2], pose[:, 2], sim.axes)
+                stimulate(pose, sim.axes)
+
+            # the first timepoint is the initial position
+            write_kernel_pose(sim.pose())
+
+            # this loop runs the simulation a block of steps at a time
+            with tqdm(total=simulation_length_ms,
+                      disable=not progress) as progress_bar:
+                for start in range(0, simulation_length_ms, STEP_BLOCK):
+                    n_steps = min(STEP_BLOCK, simulation_length_ms - start)
+                    with profiler.phase('step'):
+                        pose_block, retry_block = sim.run(
+                            n_steps, movement_duration)
+
+                    with profiler.phase('write'):
+                        for timepoint, pose, retry_row in zip(
+                                range(start + 1, start + n_steps + 1),
+                                pose_block, retry_block):
+                            # only every decimate-th timepoint is stored
+                            stored = timepoint % decimate == 0
+                            write_kernel_pose(pose, stored)
+                            if stored:
+                                writer.append('retry_history', retry_row)
+                    progress_bar.update(n_steps)
+
+            stay_put_count = sim.stay_put_count
+        else:
+            def write_positions(stored=True):
+                pose = np.column_stack((env.engine.centers[rows],
+                                        env.engine.angles[rows]))
+                if stored:
+                    write_pose(pose, env.engine.perimeter_x[rows],
+                               env.engine.perimeter_y[rows])
+                env.update_metrics()
+                stimulate(pose, env.engine.axes[rows])
+
+            # the first timepoint is the initial position
+            write_positions()
+
+            # this loop runs the simulation
+            for i in tqdm(range(simulation_length_ms), disable=not progress):
+                # duration here is in ms
+                with profiler.phase('step'):
+                    for mouse in mice:
+                        mouse.move(movement_duration=movement_duration)
+
+                with profiler.phase('write'):
+                    # only every decimate-th timepoint is stored
+                    stored = (i + 1) % decimate == 0
+                    write_positions(stored)
+                    if stored:
+                        # number of rejected moves of each mouse at this step
+                        writer.append('retry_history',
+                                      [mouse.retry_history[-1]
+                                       for mouse in mice])
+
+            stay_put_count = [mouse.stay_put_count for mouse in mice]
+
+        writer.flush()
+        retries.attrs['stay_put_count'] = np.array(stay_put_count,
+                                                   dtype=np.int64)
+
+        if metrics is not None:
+            metrics.write(f, step_ms=movement_duration)
+        if stimulation is not None:
+            stimulation.write(f)
+        if motion is not None:
+            motion.write(f)
+        if profile:
+            profiler.write(f)
+
+    return filename
 
 
 if __name__ == "__main__":
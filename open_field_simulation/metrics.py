@@ -0,0 +1,236 @@
+from interactions import mouse_distances, mouse_pairs, pair_gaps
+import numpy as np
+
+
+# number of timepoints buffered before their distances are computed. Large
+# buffers spread the fixed cost of each gap computation over many pairs
+BUFFER_SIZE = 2048
+
+
+class InteractionMetrics:
+    """
+    Class to accumulate interaction metrics while a simulation runs, so they
+    are available without storing and rescoring the positions. The pose of
+    every mouse is buffered at each timepoint and the exact ellipse gaps of
+    a full buffer are computed at once with interactions.pair_gaps, so
+    memory does not grow with the simulation length
+
+    Attributes
+    ----------
+    thresholds: (np array of floats) distance thresholds in mm below which
+                mice are interacting
+    bin_width: (float) width of the distance histogram bins in mm
+    max_distance: (float) upper edge of the distance histogram, distances
+                  beyond it are counted in a last overflow bin
+    n_timepoints: (int) number of timepoints recorded so far
+    interaction_steps: (np array of shape n_mice, n_thresholds) timepoints
+                       each mouse was interacting with any other mouse
+    pair_interaction_steps: (np array of shape n_pairs, n_thresholds)
+                            timepoints each pair of mice was interacting
+    bout_count: (np array of shape n_pairs, n_thresholds) number of contact
+                bouts, runs of consecutive interacting timepoints, of each
+                pair
+    bout_durations: (list of (pair, threshold index, timepoints)) duration
+                    of every finished bout
+    distance_histogram: (np array of shape n_pairs, n_bins + 1) timepoints
+                        at each distance for each pair
+
+    Methods
+    -------
+    update(centers, angles, axes)
+        record the poses of the mice at one timepoint
+    flush()
+        compute the metrics of the buffered timepoints
+    finalize()
+        flush and close the bouts still running
+    write(group)
+        write the metrics as small datasets
+    """
+    def __init__(self, thresholds=(10,), bin_width=1.0, max_distance=50.0,
+                 buffer_size=BUFFER_SIZE):
+        self.thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+        self.bin_width = bin_width
+        self.max_distance = max(max_distance, self.thresholds.max())
+        self.buffer_size = buffer_size
+        self.n_timepoints = 0
+        self.bout_durations = []
+
+        # sized on the first update, once the number of mice is known
+        self._poses = None
+        self._axes = None
+        self._n_buffered = 0
+
+    def _allocate(self, n_mice):
+        """
+        allocate the buffer and accumulators for n_mice mice
+
+        Inputs
+        ------
+        n_mice: (int) number of mice in the environment
+        """
+        n_pairs = mouse_pairs(n_mice)[0].size
+        n_thresholds = self.thresholds.size
+        n_bins = int(np.ceil(self.max_distance/self.bin_width))
+
+        self._poses = np.empty((self.buffer_size, n_mice, 3))
+        self.interaction_steps = np.zeros((n_mice, n_thresholds), np.int64)
+        self.pair_interaction_steps = np.zeros((n_pairs, n_thresholds),
+                                               np.int64)
+        self.bout_count = np.zeros((n_pairs, n_thresholds), np.int64)
+        self.distance_histogram = np.zeros((n_pairs, n_bins + 1), np.int64)
+        # length of the bout running at the end of the last flush
+        self._running = np.zeros((n_pairs, n_thresholds), np.int64)
+
+    def update(self, centers, angles, axes):
+        """
+        record the poses of the mice at one timepoint
+
+        Inputs
+        ------
+        centers: (np array of shape n_mice, 2) center of each mouse
+        angles: (np array of shape n_mice) rotation angle of each mouse
+        axes: (np array of shape n_mice, 2) major and minor axis of each
+              mouse (mm)
+        """
+        if self._poses is None:
+            self._allocate(centers.shape[0])
+        self._axes = axes
+
+        self._poses[self._n_buffered, :, :2] = centers
+        self._poses[self._n_buffered, :, 2] = angles
+        self._n_buffered += 1
+
+        if self._n_buffered == self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        compute the metrics of the buffered timepoints and empty the buffer
+        """
+        if not self._n_buffered:
+            return
+
+        n_mice = self._poses.shape[1]
+        gaps = pair_gaps(self._poses[:self._n_buffered], self._axes[:, 0],
+                         self._axes[:, 1], self.max_distance)
+        self.n_timepoints += self._n_buffered
+        self._n_buffered = 0
+
+        # (timepoints, n_thresholds) for mice and (timepoints, n_pairs,
+        # n_thresholds) for pairs
+        mouse_interacting = (mouse_distances(gaps, n_mice)[..., None]
+                             < self.thresholds)
+        pair_interacting = gaps[..., None] < self.thresholds
+        self.interaction_steps += mouse_interacting.sum(axis=0)
+        self.pair_interaction_steps += pair_interacting.sum(axis=0)
+
+        # gaps beyond max_distance, which may be inf, go to the overflow bin
+        overflow = self.distance_histogram.shape[1] - 1
+        bins = np.minimum(gaps, self.max_distance)//self.bin_width
+        bins = np.where(gaps < self.max_distance, bins, overflow).astype(int)
+        for pair in range(gaps.shape[1]):
+            self.distance_histogram[pair] += np.bincount(
+                bins[:, pair], minlength=overflow + 1)
+
+            for k in range(self.thresholds.size):
+                self._count_bouts(pair, k, pair_interacting[:, pair, k])
+
+    def _count_bouts(self, pair, k, interacting):
+        """
+        find the bouts of one pair and threshold in the flushed timepoints.
+        A bout running at the start continues the one running at the end of
+        the previous flush, and one running at the end is kept open
+
+        Inputs
+        ------
+        pair: (int) index of the pair
+        k: (int) index of the threshold
+        interacting: (np array of bools) whether the pair is interacting at
+                     each flushed timepoint
+        """
+        edges = np.flatnonzero(np.diff(np.concatenate(
+            ([False], interacting, [False])).astype(np.int8)))
+        starts, ends = edges[::2], edges[1::2]
+        lengths = ends - starts
+        running = self._running[pair, k]
+
+        if running:
+            if lengths.size and starts[0] == 0:
+                lengths[0] += running
+            else:
+                self._close_bout(pair, k, running)
+
+        if lengths.size and ends[-1] == interacting.size:
+            self._running[pair, k] = lengths[-1]
+            lengths = lengths[:-1]
+        else:
+            self._running[pair, k] = 0
+
+        for length in lengths:
+            self._close_bout(pair, k, length)
+
+    def _close_bout(self, pair, k, length):
+        """
+        record a finished bout
+
+        Inputs
+        ------
+        pair: (int) index of the pair
+        k: (int) index of the threshold
+        length: (int) duration of the bout in timepoints
+        """
+        self.bout_count[pair, k] += 1
+        self.bout_durations.append((pair, k, int(length)))
+
+    def finalize(self):
+        """
+        flush the buffer and close the bouts still running at the end of the
+        simulation
+        """
+        self.flush()
+        if self._poses is None:
+            return
+
+        for pair, k in zip(*np.nonzero(self._running)):
+            self._close_bout(pair, k, self._running[pair, k])
+        self._running[:] = 0
+
+    def write(self, group, step_ms=None):
+        """
+        write the metrics to a metrics group of an h5 file, as small datasets
+
+        Inputs
+        ------
+        group: (h5py.File or h5py.Group) where the metrics group is created
+        step_ms: (float) duration of a timepoint in ms, stored so bout
+                 durations can be converted to time
+        """
+        self.finalize()
+        metrics = group.create_group('metrics')
+
+        first, second = mouse_pairs(self.interaction_steps.shape[0])
+        metrics.attrs['n_timepoints'] = self.n_timepoints
+        metrics.attrs['bin_width'] = self.bin_width
+        metrics.attrs['max_distance'] = self.max_distance
+        if step_ms is not None:
+            metrics.attrs['step_ms'] = step_ms
+
+        metrics.create_dataset('thresholds', data=self.thresholds)
+        metrics.create_dataset('pairs', data=np.column_stack((first, second)))
+        metrics.create_dataset('interaction_steps',
+                               data=self.interaction_steps)
+        metrics.create_dataset(
+            'interaction_fraction',
+            data=self.interaction_steps/max(self.n_timepoints, 1))
+        metrics.create_dataset('pair_interaction_steps',
+                               data=self.pair_interaction_steps)
+        metrics.create_dataset('bout_count', data=self.bout_count)
+        # one row per bout: pair, threshold index and duration in timepoints
+        metrics.create_dataset(
+            'bout_durations',
+            data=np.array(self.bout_durations, dtype=np.int64).reshape(-1, 3))
+        metrics.create_dataset('distance_histogram',
+                               data=self.distance_histogram)
+        metrics.create_dataset(
+            'histogram_edges',
+            data=np.arange(self.distance_histogram.shape[1])*self.bin_width)
@@ -0,0 +1,230 @@
+import math
+import numpy as np
+
+
+# number of quantiles in an inverse CDF table
+TABLE_SIZE = 1024
+
+
+def heading_turns(turns):
+    """
+    turns measured as the change of direction between consecutive moves,
+    expressed relative to the heading direction of
+    core.Mouse.get_heading_direction, which points from the current center
+    back to the previous one. A mouse going straight on turns by pi
+
+    Inputs
+    ------
+    turns: (np array of floats) changes of direction (radians)
+
+    Returns
+    -------
+    (np array of floats) rotations relative to the heading direction, in
+    [-pi, pi) (radians)
+    """
+    return (turns + 2*math.pi) % (2*math.pi) - math.pi
+
+
+def wrapped_normal_std(angles):
+    """
+    standard deviation of the gaussian around 0 which, wrapped to the
+    circle, has the mean cosine of the angles, exp(-std**2/2). Angles
+    without a positive mean cosine are as spread as a uniform distribution,
+    which gives a large finite std
+
+    Inputs
+    ------
+    angles: (np array of floats) radians
+
+    Returns
+    -------
+    (float) radians
+    """
+    mean_cosine = max(float(np.cos(angles).mean()), np.finfo(float).tiny)
+    return math.sqrt(-2*math.log(mean_cosine))
+
+
+class InverseCDF:
+    """
+    Class to draw from an empirical distribution by inverse transform
+    sampling. The quantiles of the samples are tabulated once, then each
+    draw maps a uniform value to a position in the table and interpolates
+    between the two nearest quantiles, a constant number of operations
+    whatever the number of samples. Draws are batched by passing arrays
+
+    Attributes
+    ----------
+    table: (np array of floats) quantiles at table_size evenly spaced
+           probabilities from 0 to 1
+    mean: (float) mean of the samples
+
+    Methods
+    -------
+    lookup(u)
+        values at probabilities u
+    """
+    def __init__(self, samples, table_size=TABLE_SIZE):
+        samples = np.asarray(samples, dtype=float).ravel()
+        if samples.size == 0:
+            raise ValueError('an empirical distribution needs samples')
+        if table_size < 2:
+            raise ValueError('table_size must be at least 2')
+
+        self.table = np.quantile(samples, np.linspace(0, 1, table_size))
+        self.mean = float(samples.mean())
+        self._slopes = np.diff(self.table)
+        self._last = table_size - 2
+
+    def lookup(self, u):
+        """
+        values of the distribution at given probabilities
+
+        Inputs
+        ------
+        u: (float or np array of floats) probabilities in [0, 1)
+
+        Returns
+        -------
+        (float or np array of floats) values, of the shape of u
+        """
+        position = u*(self._last + 1)
+        if isinstance(position, float):
+            i = min(int(position), self._last)
+            return float(self.table[i] + (position - i)*self._slopes[i])
+
+        i = np.minimum(position.astype(np.intp), self._last)
+        return self.table[i] + (position - i)*self._slopes[i]
+
+
+class GaussianMotion:
+    """
+    Class to draw speeds from a gaussian and turns from a gaussian around
+    the heading direction, the motion of the original simulation. Speeds may
+    be negative, which moves the mouse backwards
+
+    Attributes
+    ----------
+    avg_speed: (float) mean speed (mm/ms)
+    speed_std: (float) speed standard deviation (mm/ms)
+    turn_std: (float) standard deviation of the rotation angle around the
+              heading direction (radians)
+    speed_table, turn_table: (np array) empty, speeds and turns are not
+                             tabulated
+
+    Methods
+    -------
+    speed(sampler, size)
+        draw speeds
+    turn(sampler, size)
+        draw rotations relative to the heading direction
+    write(group)
+        write the model to an h5 group
+    """
+    name = 'gaussian'
+
+    def __init__(self, avg_speed=0.09, speed_std=0.06, turn_std=math.pi/4):
+        self.avg_speed = avg_speed
+        self.speed_std = speed_std
+        self.turn_std = turn_std
+        self.speed_table = np.empty(0)
+        self.turn_table = np.empty(0)
+
+    def speed(self, sampler, size=None):
+        """
+        draw speeds
+
+        Inputs
+        ------
+        sampler: (BlockSampler) source of random numbers
+        size: (int) number of samples, None for a single float
+
+        Returns
+        -------
+        (float or np array of floats) mm/ms
+        """
+        return self.avg_speed + self.speed_std*sampler.standard_normal(size)
+
+    def turn(self, sampler, size=None):
+        """
+        draw rotations relative to the heading direction of
+        core.Mouse.get_heading_direction
+
+        Inputs
+        ------
+        sampler: (BlockSampler) source of random numbers
+        size: (int) number of samples, None for a single float
+
+        Returns
+        -------
+        (float or np array of floats) radians
+        """
+        return self.turn_std*sampler.standard_normal(size)
+
+    def write(self, group):
+        """
+        write the model to a motion group of an h5 file
+
+        Inputs
+        ------
+        group: (h5py.File or h5py.Group) where the motion group is created
+        """
+        motion = group.create_group('motion')
+        motion.attrs['model'] = self.name
+        motion.attrs['avg_speed'] = self.avg_speed
+        motion.attrs['speed_std'] = self.speed_std
+        motion.attrs['turn_std'] = self.turn_std
+
+
+class EmpiricalMotion(GaussianMotion):
+    """
+    Class to draw speeds and turns from empirical distributions, e.g. those
+    measured by tracking.fit_motion, through InverseCDF tables. Each draw
+    takes one uniform value and a table lookup, so it costs about as much as
+    a gaussian draw. Turns are measured as the change of direction between
+    consecutive moves and tabulated relative to the heading direction, see
+    heading_turns
+
+    Attributes
+    ----------
+    speeds: (InverseCDF) distribution of speeds (mm/ms)
+    turns: (InverseCDF) distribution of rotations relative to the heading
+           direction (radians)
+    avg_speed, speed_std: (float) mean and standard deviation of the speeds
+    turn_std: (float) turn_std of the GaussianMotion whose turns have the
+              same mean cosine around the heading direction (radians)
+    speed_table, turn_table: (np array) quantiles of speeds and turns
+
+    Methods
+    -------
+    see GaussianMotion
+    """
+    name = 'empirical'
+
+    def __init__(self, speeds, turns, table_size=TABLE_SIZE):
+        speeds = np.asarray(speeds, dtype=float)
+        turns = heading_turns(np.asarray(turns, dtype=float))
+        super().__init__(float(speeds.mean()), float(speeds.std()),
+                         wrapped_normal_std(turns))
+
+        self.speeds = InverseCDF(speeds, table_size)
+        self.turns = InverseCDF(turns, table_size)
+        self.speed_table = self.speeds.table
+        self.turn_table = self.turns.table
+
+    def speed(self, sampler, size=None):
+        return self.speeds.lookup(sampler.random(size))
+
+    def turn(self, sampler, size=None):
+        return self.turns.lookup(sampler.random(size))
+
+    def write(self, group):
+        """
+        write the model and its tables to a motion group of an h5 file
+
+        Inputs
+        ------
+        group: (h5py.File or h5py.Group) where the motion group is created
+        """
+        super().write(group)
+        group['motion'].create_dataset('speed_table', data=self.speed_table)
+        group['motion'].create_dataset('turn_table', data=self.turn_table)
@@ -0,0 +1,168 @@
+from collections import Counter
+from contextlib import nullcontext
+import h5py
+import numpy as np
+import time
+
+
+class PhaseTimer:
+    """
+    Class to time one phase of the simulation. Entering and leaving it adds
+    the elapsed time and one call to the phase in its profiler
+
+    Attributes
+    ----------
+    profiler: (Profiler) profiler the time is added to
+    name: (str) name of the phase
+    """
+    __slots__ = ('profiler', 'name', '_start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.times[self.name] += time.perf_counter() - self._start
+        self.profiler.calls[self.name] += 1
+        return False
+
+
+class Profiler:
+    """
+    Class to record where the time of a simulation goes: cumulative time and
+    number of calls of named phases, event counters and histograms of
+    integer values. Phases may be nested, e.g. the sampling done while
+    resampling a move counts in both phases. A disabled profiler records
+    nothing and its phases are a shared empty context manager, so leaving
+    the instrumentation in the simulation costs almost nothing
+
+    Attributes
+    ----------
+    enabled: (bool) whether anything is recorded
+    times: (Counter) {phase: seconds} cumulative time of each phase
+    calls: (Counter) {phase: int} number of calls of each phase
+    counters: (Counter) {name: int} number of each counted event
+    histograms: (dict) {name: Counter} number of times each value was
+                recorded
+
+    Methods
+    -------
+    phase(name)
+        context manager timing a phase
+    count(name, n)
+        add to an event counter
+    record(name, value)
+        add a value to a histogram
+    summary()
+        phases sorted by cumulative time
+    write(group)
+        write the profile to an h5 group
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.times = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+        self.histograms = {}
+        self._timers = {}
+        self._disabled = nullcontext()
+
+    def phase(self, name):
+        """
+        context manager timing a phase, e.g.
+            with profiler.phase('collision_check'):
+                ...
+
+        Inputs
+        ------
+        name: (str) name of the phase
+
+        Returns
+        -------
+        (PhaseTimer or nullcontext) timer of the phase, an empty context
+        manager when disabled
+        """
+        if not self.enabled:
+            return self._disabled
+
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = PhaseTimer(self, name)
+        return timer
+
+    def count(self, name, n=1):
+        """
+        add to an event counter
+
+        Inputs
+        ------
+        name: (str) name of the counter
+        n: (int) number of events
+        """
+        if self.enabled:
+            self.counters[name] += int(n)
+
+    def record(self, name, value):
+        """
+        add one value to a histogram
+
+        Inputs
+        ------
+        name: (str) name of the histogram
+        value: (int) value to count
+        """
+        if self.enabled:
+            self.histograms.setdefault(name, Counter())[int(value)] += 1
+
+    def summary(self):
+        """
+        phases sorted by cumulative time
+
+        Returns
+        -------
+        (list of (str, float, int)) name, seconds and calls of each phase
+        """
+        return [(name, seconds, self.calls[name])
+                for name, seconds in self.times.most_common()]
+
+    def write(self, group, name='profile'):
+        """
+        write the profile to a new group next to the simulation output. Phase
+        names, times and calls are parallel datasets, counters are attrs and
+        each histogram is a (value, count) dataset
+
+        Inputs
+        ------
+        group: (h5py.File or h5py.Group) where the profile group is created
+        name: (str) name of the profile group
+        """
+        profile = group.create_group(name)
+        phases = self.summary()
+
+        profile.create_dataset(
+            'phases', data=np.array([phase for phase, _, _ in phases],
+                                    dtype=object),
+            dtype=h5py.string_dtype())
+        profile.create_dataset(
+            'total_s', data=np.array([seconds for _, seconds, _ in phases]))
+        profile.create_dataset(
+            'calls', data=np.array([calls for _, _, calls in phases],
+                                   dtype=np.int64))
+
+        for counter, n in self.counters.items():
+            profile.attrs[counter] = n
+
+        for histogram, counts in self.histograms.items():
+            values = sorted(counts)
+            profile.create_dataset(
+                histogram, data=np.array([(value, counts[value])
+                                          for value in values],
+                                         dtype=np.int64).reshape(-1, 2))
+
+
+# shared disabled profiler, used when profiling is off
+DISABLED = Profiler(enabled=False)
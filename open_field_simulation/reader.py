@@ -0,0 +1,203 @@
+from geometry import cached_template, place_template, PERIMETER_STEP
+import h5py
+import numpy as np
+import os
+
+
+class PerimeterReader:
+    """
+    Class to read mouse perimeters from the pose_history of a simulation
+    file. Perimeters are not stored, they are rebuilt from the centers and
+    rotation angles when indexed, in one vectorized operation per read.
+    Indexing along time returns arrays in the perimeter_history layout of
+    main.main, so a reader can be used wherever that dataset was
+
+    Attributes
+    ----------
+    poses: (h5py.Dataset of shape n_timepoints, n_mice, 3) x, y and rotation
+           angle of each mouse at each timepoint
+    template: (np array of shape 2, n_points) mouse perimeter at the origin
+    shape: (tuple of ints) n_timepoints, n_mice*2, n_points
+    dtype: (np dtype) data type of the rebuilt perimeters
+
+    Methods
+    -------
+    chunks(chunk_size)
+        iterate over the perimeters a chunk of timepoints at a time
+    """
+    def __init__(self, group):
+        self.poses = group['pose_history']
+        attrs = group['center_history'].attrs
+        step = self.poses.attrs.get('perimeter_step', PERIMETER_STEP)
+
+        self.template = cached_template(
+            attrs['major_axis'], attrs['minor_axis'], step)
+        n_timepoints, n_mice, _ = self.poses.shape
+        self.shape = (n_timepoints, n_mice*2, self.template.shape[1])
+        self.dtype = np.dtype(float)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        """
+        perimeters at the given timepoint(s). Only the first axis is read
+        from the file, the remaining indices are applied to the result
+
+        Inputs
+        ------
+        index: (int, slice or tuple) index into the perimeter_history layout
+
+        Returns
+        -------
+        (np array of shape ..., n_mice*2, n_points) x and y row for each mouse
+        """
+        if not isinstance(index, tuple):
+            index = (index,)
+
+        poses = np.asarray(self.poses[index[0]], dtype=float)
+        perimeter_x, perimeter_y = place_template(
+            self.template, poses[..., 0], poses[..., 1], poses[..., 2])
+
+        # interleave x and y rows as in perimeter_history
+        perimeters = np.stack((perimeter_x, perimeter_y), axis=-2)
+        perimeters = perimeters.reshape(
+            perimeters.shape[:-3] + (-1, self.shape[2]))
+
+        # the remaining indices apply to the mouse and point axes
+        time_axes = (slice(None),)*(perimeters.ndim - 2)
+        return perimeters[time_axes + index[1:]]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def chunks(self, chunk_size=256):
+        """
+        iterate over the perimeters a chunk of timepoints at a time, so a
+        whole simulation never has to be held in memory
+
+        Inputs
+        ------
+        chunk_size: (int) number of timepoints per chunk
+
+        Returns
+        -------
+        (generator of (int, np array)) first timepoint of each chunk and the
+        perimeters of its timepoints
+        """
+        for start in range(0, self.shape[0], chunk_size):
+            yield start, self[start:start+chunk_size]
+
+
+def read_perimeters(group):
+    """
+    mouse perimeters of a simulation file, in the perimeter_history layout.
+    Files written with store_perimeters keep the dataset, others are rebuilt
+    lazily from their poses
+
+    Inputs
+    ------
+    group: (h5py.File or h5py.Group) a simulation file or replicate group
+
+    Returns
+    -------
+    (h5py.Dataset or PerimeterReader) perimeters of shape n_timepoints,
+    n_mice*2, n_points, both read by indexing along time
+    """
+    if 'perimeter_history' in group:
+        return group['perimeter_history']
+    return PerimeterReader(group)
+
+
+def read_poses(group, index=slice(None)):
+    """
+    pose (x, y, rotation angle) of each mouse at each timepoint. Files
+    without pose_history get it from their centers and the first perimeter
+    point, which lies on the major axis
+
+    Inputs
+    ------
+    group: (h5py.File or h5py.Group) a simulation file or replicate group
+    index: (slice) timepoints to read, all of them by default
+
+    Returns
+    -------
+    poses: (np array of shape n_timepoints, n_mice, 3)
+    """
+    if 'pose_history' in group:
+        return np.asarray(group['pose_history'][index], dtype=float)
+
+    centers = np.asarray(group['center_history'][index], dtype=float)
+    centers = centers.reshape(centers.shape[0], -1, 2)
+    first_point = np.asarray(group['perimeter_history'][index, :, 0])
+    first_point = first_point.reshape(centers.shape)
+    offset = first_point - centers
+
+    angles = np.arctan2(offset[..., 1], offset[..., 0])
+    return np.concatenate((centers, angles[..., None]), axis=2)
+
+
+def simulation_groups(f):
+    """
+    simulations stored in an h5 file: the file itself, as written by
+    main.main, or each of its replicate groups, as written by a combined
+    batch.run_batch
+
+    Inputs
+    ------
+    f: (h5py.File) an open h5 file
+
+    Returns
+    -------
+    (list of (str, h5py.Group)) name and group of each simulation
+    """
+    if 'center_history' in f:
+        return [('/', f)]
+
+    return [(name, group) for name, group in f.items()
+            if isinstance(group, h5py.Group) and 'center_history' in group]
+
+
+def find_simulations(directory='.', recursive=False, **attrs):
+    """
+    find simulations by their h5 attrs rather than their filename. Every h5
+    file is opened and its simulations kept if the attrs of their
+    center_history match. Files still being written by a sweep are skipped
+
+    Inputs
+    ------
+    directory: (str) directory to search
+    recursive: (bool) also search the subdirectories
+    attrs: required attr values, e.g. n_mice=3, or lists of accepted
+           values, e.g. n_mice=[2, 3]
+
+    Returns
+    -------
+    simulations: (list of (str, str)) filename and group name of each
+                 simulation found, in sorted order
+    """
+    simulations = []
+
+    for root, subdirectories, files in os.walk(directory):
+        subdirectories.sort()
+        if not recursive:
+            subdirectories.clear()
+
+        for name in sorted(files):
+            filename = os.path.join(root, name)
+            if name.endswith('.partial') or not h5py.is_hdf5(filename):
+                continue
+
+            try:
+                with h5py.File(filename, 'r') as f:
+                    for group_name, group in simulation_groups(f):
+                        found = group['center_history'].attrs
+                        if all(key in found and np.isin(
+                                found[key], np.atleast_1d(value)).all()
+                               for key, value in attrs.items()):
+                            simulations.append((filename, group_name))
+            except OSError:
+                # unreadable, e.g. still open for writing elsewhere
+                continue
+
+    return simulations
@@ -0,0 +1,228 @@
+import numpy as np
+
+
+# number of values pre-drawn from the generator at a time
+BLOCK_SIZE = 4096
+
+
+class BlockSampler:
+    """
+    Class to draw random numbers from a Generator in large blocks. Values are
+    handed out one at a time (or a few at a time) and the blocks are refilled
+    lazily, so the generator is called once every block_size samples
+
+    Attributes
+    ----------
+    rng: (np.random.Generator) generator the blocks are drawn from
+    block_size: (int) number of values drawn per refill
+
+    Methods
+    -------
+    standard_normal(size)
+        samples from a standard normal distribution
+    random(size)
+        samples from a uniform distribution over [0, 1)
+    """
+    def __init__(self, rng, block_size=BLOCK_SIZE):
+        self.rng = rng
+        self.block_size = block_size
+        self._blocks = {'standard_normal': np.empty(0), 'random': np.empty(0)}
+        self._index = {'standard_normal': 0, 'random': 0}
+
+    def _take(self, distribution, size):
+        """
+        take values from the block of the given distribution, refilling it
+        when it runs out
+
+        Inputs
+        ------
+        distribution: (str) name of the Generator method to draw from
+        size: (int or None) number of values, None for a single float
+
+        Returns
+        -------
+        (float or np array of floats)
+        """
+        n = 1 if size is None else size
+        block = self._blocks[distribution]
+        index = self._index[distribution]
+
+        if index + n > block.size:
+            fresh = getattr(self.rng, distribution)(max(self.block_size, n))
+            block = np.concatenate((block[index:], fresh))
+            self._blocks[distribution] = block
+            index = 0
+
+        self._index[distribution] = index + n
+        if size is None:
+            return float(block[index])
+        return block[index:index+n]
+
+    def standard_normal(self, size=None):
+        """
+        samples from a standard normal distribution
+
+        Inputs
+        ------
+        size: (int) number of samples, None for a single float
+
+        Returns
+        -------
+        (float or np array of floats)
+        """
+        return self._take('standard_normal', size)
+
+    def random(self, size=None):
+        """
+        samples from a uniform distribution over [0, 1)
+
+        Inputs
+        ------
+        size: (int) number of samples, None for a single float
+
+        Returns
+        -------
+        (float or np array of floats)
+        """
+        return self._take('random', size)
+
+
+class ReplicateSampler:
+    """
+    Class to draw random numbers for many independent replicates at once.
+    Each replicate has its own Generator, whose values are pre-drawn into
+    one row of an (R, block_size) block per distribution. A draw for any
+    set of replicates is one indexing of the block, and a row is only
+    refilled, from its own generator, when it runs out, so the values of a
+    replicate do not depend on the others
+
+    Attributes
+    ----------
+    rngs: (list of np.random.Generator) generator of each replicate
+    block_size: (int) number of values held per replicate and distribution
+
+    Methods
+    -------
+    draw(distribution, rows)
+        one value for each entry of rows, from the block of its replicate
+    select(rows)
+        BlockSampler-like view drawing for the given replicates
+    """
+    def __init__(self, rngs, block_size=BLOCK_SIZE):
+        self.rngs = list(rngs)
+        self.block_size = block_size
+        n = len(self.rngs)
+        self._blocks = {'standard_normal': np.empty((n, 0)),
+                        'random': np.empty((n, 0))}
+        self._index = {'standard_normal': np.zeros(n, dtype=np.intp),
+                       'random': np.zeros(n, dtype=np.intp)}
+
+    def _refill(self, distribution, replicates):
+        """
+        move the unused values of the given replicates to the start of their
+        rows and fill the rest from their generators. The block is widened to
+        block_size first if needed, refilling every replicate
+
+        Inputs
+        ------
+        distribution: (str) name of the Generator method to draw from
+        replicates: (np array of ints) rows to refill
+        """
+        block = self._blocks[distribution]
+        index = self._index[distribution]
+        filled = block.shape[1]
+        if filled < self.block_size:
+            replicates = range(len(self.rngs))
+            block = np.concatenate(
+                (block, np.empty((block.shape[0],
+                                  self.block_size - filled))), axis=1)
+            self._blocks[distribution] = block
+
+        width = block.shape[1]
+        for r in replicates:
+            left = filled - index[r]
+            block[r, :left] = block[r, index[r]:filled]
+            block[r, left:] = getattr(self.rngs[r], distribution)(width - left)
+            index[r] = 0
+
+    def draw(self, distribution, rows):
+        """
+        one value for each entry of rows, each from the block of its own
+        replicate
+
+        Inputs
+        ------
+        distribution: (str) 'standard_normal' or 'random'
+        rows: (np array of ints) sorted replicates, a replicate repeated n
+              times gets n values
+
+        Returns
+        -------
+        (np array of floats of shape rows)
+        """
+        counts = np.bincount(rows, minlength=len(self.rngs))
+        if counts.max(initial=0) > self.block_size:
+            self.block_size = int(counts.max())
+
+        index = self._index[distribution]
+        width = self._blocks[distribution].shape[1]
+        short = np.flatnonzero(index + counts > width)
+        if short.size or width < self.block_size:
+            self._refill(distribution, short)
+
+        columns = index[rows]
+        if counts.max(initial=0) > 1:
+            # position of each entry among the entries of its replicate
+            columns += np.arange(rows.size) - np.searchsorted(rows, rows)
+        values = self._blocks[distribution][rows, columns]
+        index += counts
+        return values
+
+    def select(self, rows):
+        """
+        BlockSampler-like view drawing for the given replicates, to pass to
+        the motion models
+
+        Inputs
+        ------
+        rows: (np array of ints) sorted replicates, see draw
+
+        Returns
+        -------
+        (SelectedReplicates)
+        """
+        return SelectedReplicates(self, rows)
+
+
+class SelectedReplicates:
+    """
+    Class to draw from a ReplicateSampler for fixed replicates, with the
+    methods of BlockSampler. Every draw returns one value per entry of rows
+
+    Attributes
+    ----------
+    sampler: (ReplicateSampler) sampler drawn from
+    rows: (np array of ints) sorted replicates
+
+    Methods
+    -------
+    standard_normal(size)
+        samples from a standard normal distribution
+    random(size)
+        samples from a uniform distribution over [0, 1)
+    """
+    def __init__(self, sampler, rows):
+        self.sampler = sampler
+        self.rows = rows
+
+    def _take(self, distribution, size):
+        if size != self.rows.size:
+            raise ValueError(f'{self.rows.size} values are drawn for the '
+                             f'selected replicates, not {size}')
+        return self.sampler.draw(distribution, self.rows)
+
+    def standard_normal(self, size):
+        return self._take('standard_normal', size)
+
+    def random(self, size):
+        return self._take('random', size)
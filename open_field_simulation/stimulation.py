@@ -0,0 +1,304 @@
+from array import array
+from collision import ellipses_within
+import math
+import numpy as np
+import time
+
+
+# defaults of NFC_Social.m: the host waits 150 ms for each write to the
+# device, whose low frequency channel runs at a 500 ms period and 50 % duty
+# cycle
+NFC_LATENCY_MS = 150
+NFC_PERIOD_MS = 500
+NFC_DUTY_CYCLE = 0.5
+
+
+class ProximityPolicy:
+    """
+    Class to stimulate a target mouse while it is within a threshold
+    distance of a partner mouse, the distance being the gap between their
+    ellipses as in interactions.pair_gaps. The threshold is tested with
+    collision.ellipses_within, which only measures the gap exactly when it
+    is very close to the threshold, so decisions stay fast
+
+    Attributes
+    ----------
+    target: (int) index of the stimulated mouse
+    partner: (int) index of the mouse whose proximity triggers stimulation
+    threshold: (float) distance in mm below which the target is stimulated
+    attrs: (dict) parameters of the policy, stored with the stimulation
+           epochs
+
+    Methods
+    -------
+    decide(centers, angles, axes)
+        which mice should be stimulated at one timepoint
+    """
+    def __init__(self, target=0, partner=1, threshold=10.0):
+        if target == partner:
+            raise ValueError('target and partner must be different mice')
+
+        self.target = target
+        self.partner = partner
+        self.threshold = threshold
+        self.attrs = {'policy': 'proximity', 'target': target,
+                      'partner': partner, 'threshold': threshold}
+
+    def decide(self, centers, angles, axes):
+        """
+        which mice should be stimulated at one timepoint
+
+        Inputs
+        ------
+        centers: (np array of shape n_mice, 2) center of each mouse
+        angles: (np array of shape n_mice) rotation angle of each mouse
+        axes: (np array of shape n_mice, 2) major and minor axis of each
+              mouse (mm)
+
+        Returns
+        -------
+        requested: (np array of bools of shape n_mice) whether each mouse
+                   should be stimulated
+        """
+        target, partner = self.target, self.partner
+        requested = np.zeros(centers.shape[0], dtype=bool)
+        requested[target] = ellipses_within(
+            centers[target, 0], centers[target, 1], axes[target, 0],
+            axes[target, 1], angles[target], centers[partner, 0],
+            centers[partner, 1], axes[partner, 0], axes[partner, 1],
+            angles[partner], self.threshold)
+        return requested
+
+
+def light_time(elapsed_ms, period_ms, duty_cycle):
+    """
+    time the light of a pulsed channel has been on since the channel was
+    switched on. Like the device firmware, each period starts with the light
+    on for duty_cycle of the period
+
+    Inputs
+    ------
+    elapsed_ms: (float or np array) time since the channel was switched on
+    period_ms: (float) period of the pulses
+    duty_cycle: (float) fraction of each period the light is on
+
+    Returns
+    -------
+    (float or np array) cumulative time the light was on, in ms
+    """
+    on_ms = duty_cycle*period_ms
+    periods, phase = np.divmod(elapsed_ms, period_ms)
+    return periods*on_ms + np.minimum(phase, on_ms)
+
+
+class Stimulator:
+    """
+    Class to run a closed-loop stimulation policy alongside the simulation
+    and account for the delays of the real system. At each timepoint the
+    policy decides from the poses which mice to stimulate. The time taken by
+    that decision is measured and checked against a deadline, and the
+    request reaches the device only after the modelled decision cost and
+    trigger latency, rounded up to whole timepoints. While stimulated, a
+    device pulses its light with the NFC period and duty cycle. Stimulation
+    does not change how the mice move
+
+    Attributes
+    ----------
+    policy: (object) policy with a decide(centers, angles, axes) method
+            returning which mice to stimulate, e.g. ProximityPolicy
+    latency_ms: (float) time for a request to reach the device, e.g. the NFC
+                write
+    decision_cost_ms: (float) modelled time of the decision on the target
+                      system, e.g. pose tracking, added to the measured time
+    period_ms: (float) period of the light pulses
+    duty_cycle: (float) fraction of each period the light is on
+    deadline_ms: (float) time allowed for each decision, the duration of a
+                 timepoint when None
+    step_ms: (float) duration of a timepoint, set by start
+    delay_steps: (int) timepoints between a decision and its effect
+    n_timepoints: (int) number of timepoints seen so far
+    active: (np array of bools) whether each mouse is being stimulated
+    epochs: (list of (mouse, start, end, light_ms)) finished stimulation
+            epochs, in timepoints with end excluded, and the time the light
+            was on during each
+    deadline_misses: (int) decisions that took longer than the deadline
+
+    Methods
+    -------
+    start(n_mice, step_ms)
+        prepare for a simulation
+    update(centers, angles, axes)
+        decide and deliver stimulation at one timepoint
+    finalize()
+        close the epochs still running
+    write(group)
+        write the epochs and decision timings to an h5 group
+    """
+    def __init__(self, policy, latency_ms=NFC_LATENCY_MS,
+                 decision_cost_ms=0.0, period_ms=NFC_PERIOD_MS,
+                 duty_cycle=NFC_DUTY_CYCLE, deadline_ms=None):
+        if not 0 <= duty_cycle <= 1:
+            raise ValueError('duty_cycle must be between 0 and 1')
+        if period_ms <= 0:
+            raise ValueError('period_ms must be positive')
+
+        self.policy = policy
+        self.latency_ms = latency_ms
+        self.decision_cost_ms = decision_cost_ms
+        self.period_ms = period_ms
+        self.duty_cycle = duty_cycle
+        self.deadline_ms = deadline_ms
+        self.step_ms = None
+        self._deadline_ms = deadline_ms
+
+    def start(self, n_mice, step_ms):
+        """
+        prepare for a simulation, discarding anything recorded before
+
+        Inputs
+        ------
+        n_mice: (int) number of mice simulated
+        step_ms: (float) duration of a timepoint in ms
+        """
+        self.step_ms = step_ms
+        self.deadline_ms = (step_ms if self._deadline_ms is None
+                            else self._deadline_ms)
+        self.delay_steps = math.ceil(
+            (self.decision_cost_ms + self.latency_ms)/step_ms)
+        self.n_timepoints = 0
+        self.active = np.zeros(n_mice, dtype=bool)
+        self.epochs = []
+        self.deadline_misses = 0
+
+        # requests waiting to reach the devices, a ring of delay_steps + 1
+        # timepoints so the request made delay_steps ago is delivered now
+        self._pending = np.zeros((self.delay_steps + 1, n_mice), dtype=bool)
+        self._onset = np.zeros(n_mice, dtype=np.int64)
+        self._light = np.zeros(n_mice)
+        self._decision_ms = array('d')
+
+    def update(self, centers, angles, axes):
+        """
+        decide which mice to stimulate at one timepoint and deliver the
+        requests made delay_steps timepoints ago. start must be called first
+
+        Inputs
+        ------
+        centers: (np array of shape n_mice, 2) center of each mouse
+        angles: (np array of shape n_mice) rotation angle of each mouse
+        axes: (np array of shape n_mice, 2) major and minor axis of each
+              mouse (mm)
+        """
+        t = self.n_timepoints
+        start = time.perf_counter()
+        requested = self.policy.decide(centers, angles, axes)
+        decision_ms = 1e3*(time.perf_counter() - start)
+        self._decision_ms.append(decision_ms)
+        if decision_ms + self.decision_cost_ms > self.deadline_ms:
+            self.deadline_misses += 1
+
+        # slots not written yet hold no request
+        n_slots = self._pending.shape[0]
+        self._pending[t % n_slots] = requested
+        delivered = self._pending[(t - self.delay_steps) % n_slots]
+
+        for mouse in np.flatnonzero(self.active & ~delivered):
+            self._close_epoch(mouse, t)
+        switched_on = delivered & ~self.active
+        self._onset[switched_on] = t
+        self._light[switched_on] = 0
+        self.active = delivered.copy()
+
+        # light on between this timepoint and the next
+        elapsed = (t - self._onset[self.active])*self.step_ms
+        self._light[self.active] += (
+            light_time(elapsed + self.step_ms, self.period_ms,
+                       self.duty_cycle)
+            - light_time(elapsed, self.period_ms, self.duty_cycle))
+        self.n_timepoints += 1
+
+    def _close_epoch(self, mouse, end):
+        """
+        record a finished stimulation epoch
+
+        Inputs
+        ------
+        mouse: (int) index of the stimulated mouse
+        end: (int) first timepoint without stimulation
+        """
+        self.epochs.append((int(mouse), int(self._onset[mouse]), int(end),
+                            float(self._light[mouse])))
+        self.active[mouse] = False
+
+    def finalize(self):
+        """
+        close the epochs still running at the end of the simulation
+        """
+        if self.step_ms is None:
+            return
+
+        for mouse in np.flatnonzero(self.active):
+            self._close_epoch(mouse, self.n_timepoints)
+
+    def decision_percentiles(self, q=(50, 99)):
+        """
+        percentiles of the measured decision times
+
+        Inputs
+        ------
+        q: (tuple of floats) percentiles to compute
+
+        Returns
+        -------
+        (np array of floats) decision time in ms at each percentile, nan
+        before any decision
+        """
+        if not len(self._decision_ms):
+            return np.full(len(q), np.nan)
+        return np.percentile(np.frombuffer(self._decision_ms), q)
+
+    def write(self, group):
+        """
+        write the stimulation epochs, the light delivered and the decision
+        timings to a stimulation group of an h5 file
+
+        Inputs
+        ------
+        group: (h5py.File or h5py.Group) where the stimulation group is
+               created
+        """
+        self.finalize()
+        stimulation = group.create_group('stimulation')
+
+        for name, value in self.policy.attrs.items():
+            stimulation.attrs[name] = value
+        stimulation.attrs['latency_ms'] = self.latency_ms
+        stimulation.attrs['decision_cost_ms'] = self.decision_cost_ms
+        stimulation.attrs['period_ms'] = self.period_ms
+        stimulation.attrs['duty_cycle'] = self.duty_cycle
+
+        if self.step_ms is None:
+            return
+        stimulation.attrs['step_ms'] = self.step_ms
+        stimulation.attrs['deadline_ms'] = self.deadline_ms
+        stimulation.attrs['delay_steps'] = self.delay_steps
+        stimulation.attrs['n_timepoints'] = self.n_timepoints
+        stimulation.attrs['deadline_misses'] = self.deadline_misses
+
+        p50, p99 = self.decision_percentiles()
+        stimulation.attrs['decision_ms_p50'] = p50
+        stimulation.attrs['decision_ms_p99'] = p99
+        # the policy meets its deadline when 99 % of the decisions do
+        stimulation.attrs['meets_deadline'] = bool(
+            p99 + self.decision_cost_ms <= self.deadline_ms)
+
+        # one row per epoch: mouse, first and last + 1 stimulated timepoints
+        stimulation.create_dataset(
+            'epochs', data=np.array([epoch[:3] for epoch in self.epochs],
+                                    dtype=np.int64).reshape(-1, 3))
+        stimulation.create_dataset(
+            'epoch_light_ms',
+            data=np.array([epoch[3] for epoch in self.epochs], dtype=float))
+        stimulation.create_dataset(
+            'decision_ms',
+            data=np.frombuffer(self._decision_ms).astype(np.float32))
@@ -0,0 +1,443 @@
+from array import array
+import argparse
+import asyncio
+from collision import ellipses_within
+import h5py
+import inspect
+from interactions import mouse_interactions, mouse_pairs
+import json
+import numpy as np
+from reader import read_poses
+import time
+
+
+# camera rate of the tracker
+FRAME_RATE_HZ = 60
+# frames waiting to be evaluated before backpressure or drops start
+QUEUE_SIZE = 8
+# what to do with a new frame when the queue is full: wait for room, which
+# slows the source down, drop the oldest queued frame or drop the new one
+DROP_POLICIES = ('block', 'oldest', 'newest')
+# number of frames read from a file at once when replaying it
+REPLAY_CHUNK_SIZE = 1024
+# byte layout of the poses of a frame on a socket: x, y and rotation angle
+# of each mouse as little endian float64
+FRAME_DTYPE = np.dtype('<f8')
+
+
+class Frame:
+    """
+    Class to hold the poses of all mice at one camera frame
+
+    Attributes
+    ----------
+    index: (int) frame number in the stream
+    poses: (np array of shape n_mice, 3) x, y and rotation angle of each
+           mouse
+    captured: (float) time.perf_counter() when the frame was received, from
+              which its latency is measured
+    """
+    __slots__ = ('index', 'poses', 'captured')
+
+    def __init__(self, index, poses, captured):
+        self.index = index
+        self.poses = poses
+        self.captured = captured
+
+
+class Decision:
+    """
+    Class to hold the result of evaluating one frame
+
+    Attributes
+    ----------
+    index: (int) frame number in the stream
+    interacting: (np array of bools of shape n_mice, n_thresholds) whether
+                 each mouse is within each threshold of another mouse
+    trigger: (np array of bools of shape n_mice) which mice to stimulate
+    latency: (float) seconds from receiving the frame to the decision
+    """
+    __slots__ = ('index', 'interacting', 'trigger', 'latency')
+
+    def __init__(self, index, interacting, trigger, latency):
+        self.index = index
+        self.interacting = interacting
+        self.trigger = trigger
+        self.latency = latency
+
+
+class ReplaySource:
+    """
+    Class to replay the poses of a simulation file as a live stream, at a
+    fixed frame rate. Poses are read in chunks, so long files are not loaded
+    at once
+
+    Attributes
+    ----------
+    filename: (str) simulation file
+    group: (str) simulation group in the file, '/' for main.main files
+    rate_hz: (float or None) frame rate, None to replay as fast as possible
+    n_mice: (int) number of mice
+    major_axis, minor_axis: (float) axes of the mice (mm)
+    n_frames: (int) number of frames in the file
+
+    Methods
+    -------
+    frames()
+        asynchronous iterator over the frames
+    """
+    def __init__(self, filename, group='/', rate_hz=FRAME_RATE_HZ,
+                 chunk_size=REPLAY_CHUNK_SIZE):
+        self.filename = filename
+        self.group = group
+        self.rate_hz = rate_hz
+        self.chunk_size = chunk_size
+
+        with h5py.File(filename, 'r') as f:
+            attrs = f[group]['center_history'].attrs
+            self.n_mice = int(attrs['n_mice'])
+            self.major_axis = float(attrs['major_axis'])
+            self.minor_axis = float(attrs['minor_axis'])
+            self.n_frames = f[group]['center_history'].shape[0]
+
+    async def frames(self):
+        """
+        frames of the file, each released at its time in the stream like a
+        camera would. A frame held back by a full queue does not delay the
+        following ones beyond their own time
+
+        Returns
+        -------
+        (async iterator of Frame)
+        """
+        start = time.perf_counter()
+        with h5py.File(self.filename, 'r') as f:
+            group = f[self.group]
+            for chunk_start in range(0, self.n_frames, self.chunk_size):
+                poses = read_poses(group, slice(
+                    chunk_start, chunk_start + self.chunk_size))
+                for offset, pose in enumerate(poses):
+                    index = chunk_start + offset
+                    if self.rate_hz is None:
+                        await asyncio.sleep(0)
+                    else:
+                        due = start + index/self.rate_hz
+                        await asyncio.sleep(max(due - time.perf_counter(), 0))
+                    yield Frame(index, pose, time.perf_counter())
+
+
+class SocketSource:
+    """
+    Class to receive frames from a tracker over a local socket. Each frame
+    is the x, y and rotation angle of every mouse as FRAME_DTYPE values,
+    without any header. serve_poses is a stand-in for the tracker
+
+    Attributes
+    ----------
+    host, port: (str, int) address of the tracker
+    n_mice: (int) number of mice
+    major_axis, minor_axis: (float) axes of the mice (mm)
+
+    Methods
+    -------
+    frames()
+        asynchronous iterator over the frames
+    """
+    def __init__(self, host, port, n_mice, major_axis, minor_axis):
+        self.host = host
+        self.port = port
+        self.n_mice = n_mice
+        self.major_axis = major_axis
+        self.minor_axis = minor_axis
+
+    async def frames(self):
+        """
+        frames received until the tracker closes the connection
+
+        Returns
+        -------
+        (async iterator of Frame)
+        """
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        frame_bytes = self.n_mice*3*FRAME_DTYPE.itemsize
+        index = 0
+        try:
+            while True:
+                try:
+                    data = await reader.readexactly(frame_bytes)
+                except asyncio.IncompleteReadError:
+                    return
+                poses = np.frombuffer(data, FRAME_DTYPE).reshape(
+                    self.n_mice, 3)
+                yield Frame(index, poses, time.perf_counter())
+                index += 1
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+
+async def serve_poses(source, host='127.0.0.1', port=0):
+    """
+    stand-in for the tracker: a server sending the frames of a source to
+    each connection in the byte layout read by SocketSource. When the
+    client does not keep up, writes wait for the socket buffer to drain
+
+    Inputs
+    ------
+    source: (ReplaySource) where the frames come from
+    host: (str) address to listen on
+    port: (int) port to listen on, 0 for any free port
+
+    Returns
+    -------
+    server: (asyncio.Server) the running server, its port is
+            server.sockets[0].getsockname()[1]
+    """
+    async def send(reader, writer):
+        try:
+            async for frame in source.frames():
+                writer.write(np.ascontiguousarray(
+                    frame.poses, dtype=FRAME_DTYPE).tobytes())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(send, host, port)
+
+
+class InteractionServer:
+    """
+    Class to evaluate interactions on live pose frames. A producer task
+    takes frames from a source into a bounded queue and a consumer task
+    decides on each frame as soon as it can: whether every pair of mice is
+    within each threshold, with collision.ellipses_within, which mice are
+    interacting, as in interactions.score_group, and which mice to trigger.
+    When the queue is full the drop policy applies: 'block' waits for room,
+    which pushes back on the source, 'oldest' drops the oldest queued frame
+    to keep latency low and 'newest' drops the incoming frame
+
+    Attributes
+    ----------
+    source: (ReplaySource or SocketSource) where the frames come from
+    thresholds: (np array of floats) distance thresholds in mm
+    policy: (object or None) policy with a decide(centers, angles, axes)
+            method, e.g. stimulation.ProximityPolicy. By default mice are
+            triggered while interacting at the first threshold
+    drop_policy: (str) one of DROP_POLICIES
+    on_decision: (callable or None) called with each Decision, may be a
+                 coroutine function
+    n_received: (int) frames taken from the source
+    n_dropped: (int) frames dropped because the queue was full
+    n_decided: (int) frames evaluated
+    interaction_frames: (np array of shape n_mice, n_thresholds) frames
+                        each mouse was interacting
+
+    Methods
+    -------
+    evaluate(frame)
+        decide on one frame
+    run()
+        stream the source to the end
+    stats()
+        frame counts and latency percentiles
+    """
+    def __init__(self, source, thresholds=(10,), policy=None,
+                 queue_size=QUEUE_SIZE, drop_policy='oldest',
+                 on_decision=None):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f'drop_policy must be one of {DROP_POLICIES}')
+
+        self.source = source
+        self.thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+        self.policy = policy
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.on_decision = on_decision
+
+        n_mice = source.n_mice
+        self.axes = np.tile([source.major_axis, source.minor_axis],
+                            (n_mice, 1))
+        self._first, self._second = mouse_pairs(n_mice)
+        self.n_received = 0
+        self.n_dropped = 0
+        self.n_decided = 0
+        self.interaction_frames = np.zeros((n_mice, self.thresholds.size),
+                                           dtype=np.int64)
+        self._latency = array('d')
+
+    def evaluate(self, frame):
+        """
+        decide on one frame and add it to the running counts
+
+        Inputs
+        ------
+        frame: (Frame) poses of the mice
+
+        Returns
+        -------
+        (Decision) decision on the frame
+        """
+        poses, first, second = frame.poses, self._first, self._second
+        n_mice = poses.shape[0]
+
+        # (n_thresholds, n_pairs), each threshold tested on every pair at once
+        pair_interacting = np.array([ellipses_within(
+            poses[first, 0], poses[first, 1], self.axes[first, 0],
+            self.axes[first, 1], poses[first, 2], poses[second, 0],
+            poses[second, 1], self.axes[second, 0], self.axes[second, 1],
+            poses[second, 2], threshold) for threshold in self.thresholds],
+            dtype=bool).reshape(self.thresholds.size, first.size)
+        interacting = mouse_interactions(pair_interacting, n_mice).T
+        self.interaction_frames += interacting
+
+        if self.policy is None:
+            trigger = interacting[:, 0].copy()
+        else:
+            trigger = self.policy.decide(poses[:, :2], poses[:, 2],
+                                         self.axes)
+
+        latency = time.perf_counter() - frame.captured
+        self._latency.append(latency)
+        self.n_decided += 1
+        return Decision(frame.index, interacting, trigger, latency)
+
+    async def _produce(self, queue):
+        """
+        move the frames of the source to the queue, applying the drop policy
+        when it is full, then mark the end of the stream with None
+
+        Inputs
+        ------
+        queue: (asyncio.Queue) frames waiting to be evaluated
+        """
+        async for frame in self.source.frames():
+            self.n_received += 1
+            if not queue.full():
+                queue.put_nowait(frame)
+            elif self.drop_policy == 'block':
+                await queue.put(frame)
+            elif self.drop_policy == 'oldest':
+                queue.get_nowait()
+                queue.put_nowait(frame)
+                self.n_dropped += 1
+            else:
+                self.n_dropped += 1
+        await queue.put(None)
+
+    async def _consume(self, queue):
+        """
+        evaluate the queued frames until the end of the stream
+
+        Inputs
+        ------
+        queue: (asyncio.Queue) frames waiting to be evaluated
+        """
+        while True:
+            frame = await queue.get()
+            if frame is None:
+                return
+
+            decision = self.evaluate(frame)
+            if self.on_decision is not None:
+                result = self.on_decision(decision)
+                if inspect.isawaitable(result):
+                    await result
+            # let the producer take the frames that arrived meanwhile
+            await asyncio.sleep(0)
+
+    async def run(self):
+        """
+        stream the source to the end, evaluating every frame that is not
+        dropped
+
+        Returns
+        -------
+        (dict) see stats
+        """
+        queue = asyncio.Queue(self.queue_size)
+        await asyncio.gather(self._produce(queue), self._consume(queue))
+        return self.stats()
+
+    def stats(self):
+        """
+        frame counts, latency percentiles and interaction fractions of the
+        frames evaluated so far
+
+        Returns
+        -------
+        (dict) n_received, n_dropped, n_decided, latency_ms_p50,
+        latency_ms_p99, latency_ms_max and interaction_fraction (list of
+        shape n_mice, n_thresholds)
+        """
+        stats = {'n_received': self.n_received,
+                 'n_dropped': self.n_dropped,
+                 'n_decided': self.n_decided}
+
+        latency = np.frombuffer(self._latency) if self.n_decided else [np.nan]
+        p50, p99 = 1e3*np.percentile(latency, (50, 99))
+        stats['latency_ms_p50'] = float(p50)
+        stats['latency_ms_p99'] = float(p99)
+        stats['latency_ms_max'] = float(1e3*np.max(latency))
+        stats['interaction_fraction'] = (
+            self.interaction_frames/max(self.n_decided, 1)).tolist()
+        return stats
+
+
+async def stream_file(filename, thresholds=(10,), group='/',
+                      rate_hz=FRAME_RATE_HZ, socket=False, **kwargs):
+    """
+    evaluate the interactions of a simulation file replayed as a live
+    stream, either directly or through a local socket like a tracker
+
+    Inputs
+    ------
+    filename: (str) simulation file
+    thresholds: (array of floats) distance thresholds in mm
+    group: (str) simulation group in the file
+    rate_hz: (float or None) frame rate, None to replay as fast as possible
+    socket: (bool) send the frames through serve_poses and a SocketSource
+    kwargs: passed to InteractionServer, e.g. drop_policy
+
+    Returns
+    -------
+    (dict) see InteractionServer.stats
+    """
+    source = ReplaySource(filename, group, rate_hz)
+    if not socket:
+        return await InteractionServer(source, thresholds, **kwargs).run()
+
+    server = await serve_poses(source)
+    try:
+        port = server.sockets[0].getsockname()[1]
+        client = SocketSource('127.0.0.1', port, source.n_mice,
+                              source.major_axis, source.minor_axis)
+        return await InteractionServer(client, thresholds, **kwargs).run()
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='evaluate interactions on a simulation file replayed as '
+                    'a live pose stream')
+    parser.add_argument('filename', help='simulation file to replay')
+    parser.add_argument('--thresholds', nargs='+', type=float, default=[10],
+                        help='distance thresholds in mm')
+    parser.add_argument('--group', default='/', help='simulation group')
+    parser.add_argument('--rate', type=float, default=FRAME_RATE_HZ,
+                        help='frame rate in Hz, 0 for as fast as possible')
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE,
+                        help='frames waiting before drops or backpressure')
+    parser.add_argument('--drop', choices=DROP_POLICIES, default='oldest',
+                        help='what to do with frames when the queue is full')
+    parser.add_argument('--socket', action='store_true',
+                        help='send the frames through a local socket')
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(stream_file(
+        args.filename, args.thresholds, args.group, args.rate or None,
+        args.socket, queue_size=args.queue_size, drop_policy=args.drop)),
+        indent=2))
@@ -0,0 +1,163 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from main import main, ENV_WIDTH, ENV_HEIGHT, AVG_SPEED, SPEED_STD
+import itertools
+import json
+import logging
+import numpy as np
+import os
+import time
+import zlib
+from tqdm import tqdm
+
+
+MANIFEST = 'sweep_manifest.jsonl'
+
+logger = logging.getLogger(__name__)
+
+
+def build_tasks(n_mice, avg_speeds, speed_stds, arena_sizes, n_replicates,
+                seed, out_dir):
+    """
+    build the list of simulations in a sweep. Every parameter combination and
+    replicate gets its own child of the root SeedSequence, keyed by the task
+    name, so a task always gets the same seed however the sweep is extended
+    and whether or not other tasks are skipped
+
+    Inputs
+    ------
+    n_mice: (list of ints) numbers of mice to simulate
+    avg_speeds: (list of floats) mouse average speeds (mm/ms)
+    speed_stds: (list of floats) mouse speed standard deviations (mm/ms)
+    arena_sizes: (list of (width, height) tuples) arena sizes in mm
+    n_replicates: (int) replicates per parameter combination
+    seed: (int) root seed of the sweep
+    out_dir: (str) directory the output files are written to
+
+    Returns
+    -------
+    tasks: (list of dicts) keyword arguments of main.main for each task, plus
+           the task's 'seed_sequence'
+    """
+    combinations = itertools.product(
+        n_mice, avg_speeds, speed_stds, arena_sizes, range(n_replicates))
+
+    tasks = []
+    for N_MICE, avg_speed, speed_std, (width, height), replicate in \
+            combinations:
+        name = 'mouse' if N_MICE == 1 else 'mice'
+        filename = (f'{N_MICE}{name}_{width}x{height}mm_speed{avg_speed}'
+                    f'_std{speed_std}_r{replicate:03d}')
+        seed_sequence = np.random.SeedSequence(
+            seed, spawn_key=(zlib.crc32(filename.encode()),))
+        tasks.append({
+            'N_MICE': N_MICE,
+            'env_width': width,
+            'env_height': height,
+            'avg_speed': avg_speed,
+            'speed_std': speed_std,
+            'replicate': replicate,
+            'filename': os.path.join(out_dir, filename),
+            'seed_sequence': seed_sequence,
+        })
+
+    return tasks
+
+
+def run_task(task, metrics_thresholds=None):
+    """
+    run one simulation of a sweep. The file is written under a temporary name
+    and renamed once complete, so an interrupted task is never mistaken for
+    a finished one on resume
+
+    Inputs
+    ------
+    task: (dict) a task built by build_tasks
+    metrics_thresholds: (array of floats) thresholds of the interaction
+                        metrics computed during the run, see main.main
+
+    Returns
+    -------
+    record: (dict) parameters, seed and run time of the task
+    """
+    task = dict(task)
+    seed_sequence = task.pop('seed_sequence')
+    replicate = task.pop('replicate')
+    filename = task.pop('filename')
+    partial = filename + '.partial'
+    # main.main never overwrites a file, so the leftover of an interrupted
+    # run is removed first
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    start = time.perf_counter()
+    main(**task, seed=seed_sequence, filename=partial, progress=False,
+         metrics_thresholds=metrics_thresholds)
+    os.replace(partial, filename)
+
+    return {**task,
+            'replicate': replicate,
+            'filename': filename,
+            'seed_entropy': str(seed_sequence.entropy),
+            'spawn_key': list(seed_sequence.spawn_key),
+            'elapsed_s': time.perf_counter() - start}
+
+
+def sweep(n_mice=(1, 2, 3), avg_speeds=(AVG_SPEED,), speed_stds=(SPEED_STD,),
+          arena_sizes=((ENV_WIDTH, ENV_HEIGHT),), n_replicates=30, seed=0,
+          out_dir='.', max_workers=None, metrics_thresholds=None):
+    """
+    run every combination of the given parameters n_replicates times over a
+    process pool. Tasks whose output file already exists are skipped, and
+    each finished task is appended to a manifest in out_dir. The number of
+    skipped tasks is logged
+
+    Inputs
+    ------
+    n_mice: (list of ints) numbers of mice to simulate
+    avg_speeds: (list of floats) mouse average speeds (mm/ms)
+    speed_stds: (list of floats) mouse speed standard deviations (mm/ms)
+    arena_sizes: (list of (width, height) tuples) arena sizes in mm
+    n_replicates: (int) replicates per parameter combination
+    seed: (int) root seed of the sweep
+    out_dir: (str) directory the output files are written to
+    max_workers: (int) number of worker processes, defaults to all cores
+    metrics_thresholds: (array of floats) distance thresholds in mm of the
+                        interaction metrics computed during each run, so
+                        interactions need not be scored from the files
+                        afterwards
+
+    Returns
+    -------
+    records: (list of dicts) one record per task run in this call
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    tasks = build_tasks(n_mice, avg_speeds, speed_stds, arena_sizes,
+                        n_replicates, seed, out_dir)
+    pending = [task for task in tasks if not os.path.exists(task['filename'])]
+    logger.info('%d of %d simulations already done',
+                len(tasks) - len(pending), len(tasks))
+
+    records = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_task, task, metrics_thresholds)
+                   for task in pending]
+
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            record = future.result()
+            records.append(record)
+            with open(os.path.join(out_dir, MANIFEST), 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    return records
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    sweep(n_mice=(1, 2, 3),
+          avg_speeds=(0.06, 0.09, 0.12),
+          speed_stds=(0.03, 0.06),
+          arena_sizes=((250, 180), (500, 360)),
+          n_replicates=30,
+          seed=0,
+          out_dir='sweep')
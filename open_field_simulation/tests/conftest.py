@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# the simulation modules are imported by name, as the scripts themselves do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
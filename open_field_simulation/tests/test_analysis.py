@@ -0,0 +1,111 @@
+from analysis import analyze
+from batch import run_batch
+import csv
+import h5py
+from interactions import score_file
+from main import main
+import numpy as np
+import os
+import pytest
+from reader import find_simulations
+
+
+THRESHOLDS = [10.0, 50.0]
+
+
+@pytest.fixture(scope='module')
+def directory(tmp_path_factory):
+    """
+    a directory of short simulations: two files of 2 mice, a file of 3
+    mice in a subdirectory, a combined batch of 2 replicates of 2 mice, an
+    unfinished sweep file and a file that is not h5
+
+    Returns
+    -------
+    (str) the directory
+    """
+    root = tmp_path_factory.mktemp('simulations')
+    main(2, simulation_length_min=0.2, seed=0, filename=str(root/'a.h5'),
+         progress=False)
+    main(2, simulation_length_min=0.2, seed=1, filename=str(root/'b.h5'),
+         progress=False)
+    main(2, simulation_length_min=0.2, seed=2,
+         filename=str(root/'c.h5.partial'), progress=False)
+    os.makedirs(root/'sub')
+    main(3, simulation_length_min=0.2, seed=3,
+         filename=str(root/'sub'/'d.h5'), progress=False)
+
+    cwd = os.getcwd()
+    os.chdir(root/'sub')
+    try:
+        run_batch(2, 2, simulation_length_min=0.2, combined=True, seed=4,
+                  progress=False)
+    finally:
+        os.chdir(cwd)
+
+    with open(root/'notes.txt', 'w') as f:
+        f.write('not a simulation')
+    return str(root)
+
+
+def test_find_simulations_by_attrs(directory):
+    """
+    simulations are found by their attrs, whatever their filename, and
+    unfinished or non h5 files are skipped
+    """
+    top = find_simulations(directory)
+    assert top == [(os.path.join(directory, 'a.h5'), '/'),
+                   (os.path.join(directory, 'b.h5'), '/')]
+
+    every = find_simulations(directory, recursive=True)
+    assert len(every) == 5
+    batch = [(filename, group) for filename, group in every
+             if group != '/']
+    assert [group for _, group in batch] == ['replicate_000',
+                                             'replicate_001']
+
+    assert find_simulations(directory, recursive=True, n_mice=3) == [
+        (os.path.join(directory, 'sub', 'd.h5'), '/')]
+    assert len(find_simulations(directory, recursive=True,
+                                n_mice=[2, 3])) == 5
+    assert find_simulations(directory, recursive=True, n_mice=4) == []
+
+
+def test_analyze_matches_scoring(directory, tmp_path):
+    """
+    analyze scores every simulation found with the given attrs, in the
+    order found, and writes the same table as csv and h5
+    """
+    out_csv = str(tmp_path/'table.csv')
+    rows = analyze(directory, THRESHOLDS, out_csv, max_workers=2,
+                   cache_file=None, n_mice=2)
+
+    simulations = find_simulations(directory, recursive=True, n_mice=2)
+    assert len(simulations) == 4
+    expected = []
+    for filename, group_name in simulations:
+        fractions = score_file(filename, group_name, THRESHOLDS)
+        for mouse in range(2):
+            for threshold, fraction in zip(THRESHOLDS, fractions[mouse]):
+                expected.append((filename, group_name, mouse, threshold,
+                                 fraction))
+    assert [(row['file'], row['group'], row['mouse'], row['threshold_mm'],
+             row['interaction_fraction']) for row in rows] == expected
+    assert any(row['interaction_fraction'] > 0 for row in rows)
+
+    with open(out_csv, newline='') as f:
+        table = list(csv.DictReader(f))
+    assert len(table) == len(rows)
+    assert [float(row['interaction_fraction']) for row in table] == [
+        row['interaction_fraction'] for row in rows]
+
+    out_h5 = str(tmp_path/'table.h5')
+    analyze(directory, THRESHOLDS, out_h5, max_workers=2, cache_file=None,
+            n_mice=2)
+    with h5py.File(out_h5, 'r') as f:
+        results = f['results'][:]
+    np.testing.assert_array_equal(
+        results['interaction_fraction'],
+        [row['interaction_fraction'] for row in rows])
+    assert [group.decode() for group in results['group']] == [
+        row['group'] for row in rows]
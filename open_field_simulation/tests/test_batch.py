@@ -0,0 +1,82 @@
+from batch import BatchSimulation, run_batch
+import h5py
+from main import MAJOR_AXIS, AVG_SPEED
+import numpy as np
+import pytest
+from sampling import ReplicateSampler
+
+
+# duration of a step, as in main.main
+MOVEMENT_DURATION = (1/5)*(MAJOR_AXIS/AVG_SPEED)
+N_STEPS = 200
+
+
+@pytest.mark.parametrize('distribution', ['random', 'standard_normal'])
+def test_replicate_sampler_follows_each_generator(distribution):
+    """
+    whatever replicates are drawn for, and however often each one is
+    repeated, every replicate gets the values of its own generator in order
+    """
+    n_replicates = 5
+    sampler = ReplicateSampler([np.random.default_rng(r)
+                                for r in range(n_replicates)], block_size=7)
+    rng = np.random.default_rng(100)
+
+    drawn = [[] for _ in range(n_replicates)]
+    for _ in range(300):
+        rows = np.sort(rng.integers(0, n_replicates, rng.integers(0, 30)))
+        # more values than block_size for a single replicate
+        if rng.random() < 0.05:
+            rows = np.full(20, rows[0] if rows.size else 0)
+        for r, value in zip(rows, sampler.draw(distribution, rows)):
+            drawn[r].append(value)
+
+    for r, values in enumerate(drawn):
+        expected = getattr(np.random.default_rng(r), distribution)(
+            len(values))
+        np.testing.assert_array_equal(values, expected)
+
+
+def test_replicates_do_not_depend_on_batch_size():
+    """
+    replicate r follows the same trajectory whatever the number of
+    replicates it is run with
+    """
+    small = BatchSimulation(2, 3, seed=0)
+    large = BatchSimulation(6, 3, seed=0)
+    for _ in range(N_STEPS):
+        small.step(MOVEMENT_DURATION)
+        large.step(MOVEMENT_DURATION)
+
+    np.testing.assert_array_equal(small.centers, large.centers[:2])
+    np.testing.assert_array_equal(small.angles, large.angles[:2])
+    assert not np.array_equal(large.centers[0], large.centers[1])
+
+
+def test_run_batch_configuration(tmp_path, monkeypatch):
+    """
+    run_batch takes the arena, speeds, body and length of main.main
+    """
+    monkeypatch.chdir(tmp_path)
+    filenames = run_batch(2, 2, env_width=400, env_height=300,
+                          avg_speed=0.12, speed_std=0.03, major_axis=50,
+                          minor_axis=20, simulation_length_min=0.1, seed=1,
+                          progress=False)
+
+    n_timepoints = int(int(0.1*60*1000)/((1/5)*(50/0.12))) + 1
+    assert len(filenames) == 2
+    for filename in filenames:
+        with h5py.File(filename, 'r') as f:
+            poses = f['pose_history'][:]
+            attrs = f['center_history'].attrs
+            assert attrs['env_width'] == 400
+            assert attrs['env_height'] == 300
+            assert attrs['avg_speed'] == 0.12
+            assert attrs['speed_std'] == 0.03
+            assert attrs['major_axis'] == 50
+            assert attrs['minor_axis'] == 20
+            assert attrs['simulation_length_min'] == 0.1
+
+        assert poses.shape == (n_timepoints, 2, 3)
+        assert (poses[..., 0] > 0).all() and (poses[..., 0] < 400).all()
+        assert (poses[..., 1] > 0).all() and (poses[..., 1] < 300).all()
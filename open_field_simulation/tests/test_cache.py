@@ -0,0 +1,152 @@
+import cache
+from cache import ResultsCache
+import h5py
+import interactions
+from interactions import main_thresholds, score_file, score_simulation
+from main import main
+import numpy as np
+import os
+import pytest
+import shutil
+
+
+THRESHOLDS = [10.0, 50.0]
+
+
+@pytest.fixture(scope='module')
+def simulations(tmp_path_factory):
+    """
+    two short runs of 2 mice whose mice interact, with different seeds
+
+    Returns
+    -------
+    (list of str) the two files
+    """
+    directory = tmp_path_factory.mktemp('cache')
+    return [main(2, simulation_length_min=0.2, seed=seed,
+                 filename=str(directory/f'{seed}.h5'), progress=False)
+            for seed in (1, 2)]
+
+
+@pytest.fixture
+def scored(monkeypatch):
+    """
+    record of the thresholds interactions.score_file is called with
+
+    Returns
+    -------
+    (list of lists of floats) thresholds of each call
+    """
+    calls = []
+
+    def counting_score_file(filename, group_name, thresholds):
+        calls.append(list(thresholds))
+        return score_file(filename, group_name, thresholds)
+
+    monkeypatch.setattr(interactions, 'score_file', counting_score_file)
+    return calls
+
+
+def fractions(rows):
+    """
+    interaction fraction column of tidy rows
+    """
+    return [row['interaction_fraction'] for row in rows]
+
+
+def test_cache_hits(simulations, scored, tmp_path):
+    """
+    cached results are reused from the saved cache, and only new thresholds
+    are scored
+    """
+    filename = simulations[0]
+    cache_file = str(tmp_path/'cache.json')
+    results = ResultsCache(cache_file)
+    rows = score_simulation(filename, '/', THRESHOLDS, results)
+    results.save()
+    assert scored == [THRESHOLDS]
+    assert any(fraction > 0 for fraction in fractions(rows))
+
+    reloaded = ResultsCache(cache_file)
+    assert score_simulation(filename, '/', THRESHOLDS, reloaded) == rows
+    assert scored == [THRESHOLDS]
+
+    extended = score_simulation(filename, '/', THRESHOLDS + [20.0], reloaded)
+    assert scored == [THRESHOLDS, [20.0]]
+    assert fractions(extended) == fractions(
+        score_simulation(filename, '/', THRESHOLDS + [20.0]))
+
+
+def test_changed_file_is_scored_again(simulations, scored, tmp_path):
+    """
+    a file replaced by another simulation under the same name is a miss
+    """
+    filename = str(tmp_path/'run.h5')
+    shutil.copyfile(simulations[0], filename)
+    results = ResultsCache(str(tmp_path/'cache.json'))
+    first = score_simulation(filename, '/', THRESHOLDS, results)
+
+    shutil.copyfile(simulations[1], filename)
+    second = score_simulation(filename, '/', THRESHOLDS, results)
+    assert scored == [THRESHOLDS, THRESHOLDS]
+    assert fractions(second) == fractions(
+        score_simulation(simulations[1], '/', THRESHOLDS))
+    assert fractions(second) != fractions(first)
+
+
+def test_changed_axes_are_scored_again(simulations, scored, tmp_path,
+                                       monkeypatch):
+    """
+    the body axes are part of the key, even when the content hash is the
+    same
+    """
+    filename = str(tmp_path/'run.h5')
+    shutil.copyfile(simulations[0], filename)
+    monkeypatch.setattr(ResultsCache, 'hash', lambda self, filename: 'same')
+    results = ResultsCache(str(tmp_path/'cache.json'))
+    score_simulation(filename, '/', THRESHOLDS, results)
+
+    with h5py.File(filename, 'r+') as f:
+        attrs = f['center_history'].attrs
+        attrs['major_axis'] = attrs['major_axis'] + 1
+    score_simulation(filename, '/', THRESHOLDS, results)
+    assert scored == [THRESHOLDS, THRESHOLDS]
+    assert len(results.results) == 2*len(THRESHOLDS)
+
+
+def test_new_code_version_drops_results(simulations, scored, tmp_path,
+                                        monkeypatch):
+    """
+    results saved by another version of the scoring code are dropped, the
+    file hashes are kept
+    """
+    cache_file = str(tmp_path/'cache.json')
+    results = ResultsCache(cache_file)
+    score_simulation(simulations[0], '/', THRESHOLDS, results)
+    results.save()
+
+    monkeypatch.setattr(cache, 'code_version', lambda: 'other')
+    reloaded = ResultsCache(cache_file)
+    assert reloaded.results == {}
+    assert reloaded.hashes == results.hashes
+    score_simulation(simulations[0], '/', THRESHOLDS, reloaded)
+    assert scored == [THRESHOLDS, THRESHOLDS]
+
+
+def test_no_cache_by_default(simulations, tmp_path, monkeypatch):
+    """
+    scoring the simulations of the current directory writes no cache unless
+    one is asked for
+    """
+    monkeypatch.chdir(tmp_path)
+    shutil.copyfile(simulations[0], tmp_path/'run.h5')
+
+    out_file = main_thresholds(THRESHOLDS, 'table.csv')
+    assert sorted(os.listdir(tmp_path)) == ['run.h5', 'table.csv']
+
+    main_thresholds(THRESHOLDS, 'cached.csv', cache_file='cache.json')
+    assert os.path.exists(tmp_path/'cache.json')
+    with open(out_file) as f, open(tmp_path/'cached.csv') as g:
+        assert f.read() == g.read()
+    assert not np.isnan(ResultsCache('cache.json').fractions(
+        'run.h5', '/', THRESHOLDS)).any()
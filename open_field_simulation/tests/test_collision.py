@@ -0,0 +1,215 @@
+from collision import (contact_polynomial, ellipse_gap, ellipses_overlap,
+                       ellipses_within, point_ellipse_distance, separated,
+                       shape_matrix)
+from geometry import ellipse_template
+import numpy as np
+import pytest
+
+
+MAJOR_AXIS = 60  # mm
+MINOR_AXIS = 30  # mm
+# angular step of the dense perimeters the exact tests are checked against
+DENSE_STEP = 2*np.pi/4096
+
+
+def perimeter(x, y, major_axis, minor_axis, rotation_angle):
+    """
+    densely sampled perimeter of a rotated ellipse
+
+    Returns
+    -------
+    (np array of shape 2, n_points) x and y points along perimeter
+    """
+    template = ellipse_template(major_axis, minor_axis, DENSE_STEP)
+    cos, sin = np.cos(rotation_angle), np.sin(rotation_angle)
+    return np.array([x + cos*template[0] - sin*template[1],
+                     y + sin*template[0] + cos*template[1]])
+
+
+def implicit(points, x, y, major_axis, minor_axis, rotation_angle):
+    """
+    value of the ellipse equation at points, negative inside the ellipse
+    """
+    dx, dy = points[0] - x, points[1] - y
+    cos, sin = np.cos(rotation_angle), np.sin(rotation_angle)
+    u, v = dx*cos + dy*sin, dy*cos - dx*sin
+    return (u/(major_axis/2))**2 + (v/(minor_axis/2))**2 - 1
+
+
+def random_pairs(n, seed, spread=80):
+    """
+    random pairs of mouse ellipses around the origin, in the argument order
+    of ellipses_overlap
+    """
+    rng = np.random.default_rng(seed)
+    x_2, y_2 = rng.uniform(-spread, spread, (2, n))
+    angle_1, angle_2 = rng.uniform(0, 2*np.pi, (2, n))
+    return [(0.0, 0.0, MAJOR_AXIS, MINOR_AXIS, angle_1[i],
+             x_2[i], y_2[i], MAJOR_AXIS, MINOR_AXIS, angle_2[i])
+            for i in range(n)]
+
+
+def depth(pair):
+    """
+    how far the dense perimeter of either ellipse of a pair reaches inside
+    the other, as the lowest value of the other's equation. Negative for
+    overlapping pairs
+    """
+    first, second = pair[:5], pair[5:]
+    return min(implicit(perimeter(*first), *second).min(),
+               implicit(perimeter(*second), *first).min())
+
+
+def brute_force_gap(pair):
+    """
+    minimum distance between the dense perimeters of a pair, only comparing
+    points near the closest ones. Negative for overlapping pairs
+    """
+    reached = depth(pair)
+    if reached < 0:
+        return reached
+    perimeter_1, perimeter_2 = perimeter(*pair[:5]), perimeter(*pair[5:])
+    # the closest points lie on the facing sides, the quarter of each
+    # perimeter nearest the other center
+    near_1 = np.argsort(np.hypot(*(perimeter_1.T - pair[5:7]).T))[:1024]
+    near_2 = np.argsort(np.hypot(*(perimeter_2.T - pair[0:2]).T))[:1024]
+    return np.hypot(perimeter_1[0, near_1][:, None] - perimeter_2[0, near_2],
+                    perimeter_1[1, near_1][:, None]
+                    - perimeter_2[1, near_2]).min()
+
+
+def test_overlap_matches_dense_perimeters():
+    """
+    random rotated pairs overlap exactly when their dense perimeters do,
+    pairs closer to touching than the sampling resolves are skipped
+    """
+    n_checked = 0
+    for pair in random_pairs(400, seed=0):
+        reference = depth(pair)
+        if abs(reference) < 1e-3:
+            continue
+        assert bool(ellipses_overlap(*pair)) == (reference < 0), pair
+        n_checked += 1
+    assert n_checked > 300
+
+
+def test_overlap_is_symmetric_and_broadcasts():
+    """
+    swapping the ellipses does not change the result, and arrays of pairs
+    give the same results as single pairs
+    """
+    pairs = np.array(random_pairs(500, seed=1), dtype=float).T
+    overlap = ellipses_overlap(*pairs)
+    assert overlap.shape == (500,)
+    assert np.array_equal(overlap, ellipses_overlap(*pairs[5:], *pairs[:5]))
+    assert [bool(ellipses_overlap(*pair)) for pair in pairs.T] == \
+        overlap.tolist()
+
+
+@pytest.mark.parametrize('x_2, angle_2', [
+    (MAJOR_AXIS, 0.0),  # tip to tip
+    (MAJOR_AXIS/2 + MINOR_AXIS/2, np.pi/2),  # tip to side
+])
+def test_touching(x_2, angle_2):
+    """
+    ellipses that only touch do not overlap, and overlap once pushed
+    together, whatever the rotation of the pair
+    """
+    assert not ellipses_overlap(0.0, 0.0, MAJOR_AXIS, MINOR_AXIS, 0.0,
+                                x_2, 0.0, MAJOR_AXIS, MINOR_AXIS, angle_2)
+    for angle in (0.0, 0.3, 2.0, 4.5):
+        # rotating the whole pair around the first center, where touching
+        # is only resolved up to rounding
+        x, y = x_2*np.cos(angle), x_2*np.sin(angle)
+        first = (0.0, 0.0, MAJOR_AXIS, MINOR_AXIS, angle)
+        scale = 1 - 1e-6
+        assert ellipses_overlap(*first, scale*x, scale*y, MAJOR_AXIS,
+                                MINOR_AXIS, angle + angle_2)
+        scale = 1 + 1e-6
+        assert not ellipses_overlap(*first, scale*x, scale*y, MAJOR_AXIS,
+                                    MINOR_AXIS, angle + angle_2)
+        gap = ellipse_gap(*first, scale*x, scale*y, MAJOR_AXIS, MINOR_AXIS,
+                          angle + angle_2)
+        assert gap == pytest.approx(1e-6*x_2, abs=1e-6)
+
+
+def test_nested():
+    """
+    an ellipse inside another overlaps it in either order, with no gap
+    """
+    outer = (3.0, -2.0, MAJOR_AXIS, MINOR_AXIS, 0.7)
+    inner = (4.0, -1.5, 20.0, 8.0, 2.1)
+    assert implicit(perimeter(*inner), *outer).max() < 0
+    assert ellipses_overlap(*outer, *inner)
+    assert ellipses_overlap(*inner, *outer)
+    assert ellipse_gap(*outer, *inner) == 0
+    assert ellipses_within(*inner, *outer, 1.0)
+
+
+def test_contact_polynomial_of_circles():
+    """
+    for circles the contact function test reduces to comparing the center
+    distance with the sum of the radii
+    """
+    radius_1, radius_2 = 10.0, 4.0
+    distance = np.linspace(1, 27, 261)
+    shape_1 = shape_matrix(2*radius_1, 2*radius_1, 0.0)
+    shape_2 = shape_matrix(2*radius_2, 2*radius_2, 0.0)
+    is_separated = separated(*contact_polynomial(
+        distance, np.zeros_like(distance), shape_1, shape_2))
+    resolved = np.abs(distance - (radius_1 + radius_2)) > 1e-9
+    assert np.array_equal(is_separated[resolved],
+                          distance[resolved] > radius_1 + radius_2)
+
+
+@pytest.mark.parametrize('major_axis, minor_axis', [
+    (MAJOR_AXIS, MINOR_AXIS), (60, 60), (60, 6)])
+def test_point_ellipse_distance(major_axis, minor_axis):
+    """
+    distances from points to an ellipse match the closest point of its dense
+    perimeter, and points inside get 0
+    """
+    rng = np.random.default_rng(2)
+    x, y = rng.uniform(-80, 80, (2, 2000))
+    a, b = major_axis/2, minor_axis/2
+    distance = point_ellipse_distance(x, y, a, b)
+
+    # up to rounding for points on the outline
+    inside = (x/a)**2 + (y/b)**2 <= 1
+    assert np.all(distance[inside] < 1e-12)
+
+    outline = perimeter(0, 0, major_axis, minor_axis, 0)
+    reference = np.hypot(x[:, None] - outline[0],
+                         y[:, None] - outline[1]).min(axis=1)
+    # the dense perimeter only overestimates, by at most half its spacing
+    assert np.all(distance[~inside] <= reference[~inside] + 1e-9)
+    assert np.all(reference[~inside] - distance[~inside] < a*DENSE_STEP/2)
+    assert np.median(reference[~inside] - distance[~inside]) < 1e-4
+
+
+def test_gap_matches_dense_perimeters():
+    """
+    gaps between random rotated pairs match the dense perimeters, and
+    overlapping pairs have no gap
+    """
+    pairs = random_pairs(150, seed=3, spread=100)
+    gaps = ellipse_gap(*np.array(pairs, dtype=float).T)
+    for pair, gap in zip(pairs, gaps):
+        reference = brute_force_gap(pair)
+        if reference < 0:
+            assert gap == 0
+        else:
+            assert gap <= reference + 1e-9
+            assert gap == pytest.approx(reference, abs=1e-3)
+
+
+@pytest.mark.parametrize('distance', [0.5, 5.0, 20.0])
+def test_within_matches_gap(distance):
+    """
+    the bounded threshold test agrees with the exact gap
+    """
+    pairs = np.array(random_pairs(600, seed=4, spread=100), dtype=float).T
+    gaps = ellipse_gap(*pairs)
+    within = ellipses_within(*pairs, distance)
+    resolved = np.abs(gaps - distance) > 1e-6
+    assert np.array_equal(within[resolved], gaps[resolved] < distance)
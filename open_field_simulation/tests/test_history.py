@@ -0,0 +1,122 @@
+from batch import run_batch
+import h5py
+from history import DecimatedHistory, FullHistory, RingHistory
+from main import main
+import numpy as np
+import pytest
+
+
+# stored timepoints are 0, DECIMATE, 2*DECIMATE, ...
+DECIMATE = 4
+SIMULATION_LENGTH_MIN = 0.2
+# a metrics threshold, so metrics see every timepoint of a decimated run
+THRESHOLDS = [20.0]
+
+
+def read_run(filename, group_name='/'):
+    """
+    datasets of a simulation file as arrays
+    """
+    with h5py.File(filename, 'r') as f:
+        group = f[group_name]
+        run = {name: group[name][:] for name in ('center_history',
+                                                 'pose_history',
+                                                 'perimeter_history',
+                                                 'retry_history')
+               if name in group}
+        run['decimate'] = group['center_history'].attrs['decimate']
+        if 'metrics' in group:
+            run['metrics'] = group['metrics']['interaction_steps'][:]
+        return run
+
+
+def assert_decimated(full, decimated):
+    """
+    a decimated run keeps every DECIMATE-th timepoint of the full run, with
+    the retries of the step reaching it
+    """
+    assert full['decimate'] == 1
+    assert decimated['decimate'] == DECIMATE
+    for name in ('center_history', 'pose_history', 'perimeter_history'):
+        if name in full:
+            np.testing.assert_array_equal(decimated[name],
+                                          full[name][::DECIMATE])
+    # retry row k is the step reaching timepoint k + 1
+    np.testing.assert_array_equal(
+        decimated['retry_history'],
+        full['retry_history'][DECIMATE - 1::DECIMATE])
+
+
+@pytest.mark.parametrize('engine', ['python', 'kernel'])
+def test_main_keeps_every_nth_pose(tmp_path, engine):
+    """
+    main with decimate runs the same simulation and stores every Nth
+    timepoint, from the initial position on
+    """
+    runs = [read_run(main(2, simulation_length_min=SIMULATION_LENGTH_MIN,
+                          seed=0, filename=str(tmp_path/f'{decimate}.h5'),
+                          progress=False, store_perimeters=True,
+                          metrics_thresholds=THRESHOLDS, engine=engine,
+                          decimate=decimate))
+            for decimate in (1, DECIMATE)]
+
+    full, decimated = runs
+    n_timepoints = full['pose_history'].shape[0]
+    assert decimated['pose_history'].shape[0] == -(-n_timepoints//DECIMATE)
+    assert_decimated(full, decimated)
+    np.testing.assert_array_equal(decimated['metrics'], full['metrics'])
+
+
+def test_run_batch_keeps_every_nth_pose(tmp_path, monkeypatch):
+    """
+    run_batch with decimate stores every Nth timepoint of each replicate
+    """
+    monkeypatch.chdir(tmp_path)
+    full = run_batch(2, 2, simulation_length_min=SIMULATION_LENGTH_MIN,
+                     combined=True, seed=0, progress=False,
+                     store_perimeters=True)
+    decimated = run_batch(2, 2, simulation_length_min=SIMULATION_LENGTH_MIN,
+                          combined=True, seed=0, progress=False,
+                          store_perimeters=True, decimate=DECIMATE)
+
+    for r in range(2):
+        group_name = f'replicate_{r:03d}'
+        assert_decimated(read_run(full[0], group_name),
+                         read_run(decimated[0], group_name))
+
+
+def test_decimate_must_be_positive(tmp_path):
+    """
+    decimating by less than one timepoint is an error
+    """
+    with pytest.raises(ValueError):
+        main(2, simulation_length_min=SIMULATION_LENGTH_MIN,
+             filename=str(tmp_path/'run.h5'), progress=False, decimate=0)
+
+
+def test_history_policies():
+    """
+    the full, ring and decimated policies keep the steps they promise
+    """
+    histories = [FullHistory(10), FullHistory(), RingHistory(3),
+                 DecimatedHistory(3), DecimatedHistory(3, n_steps=10),
+                 DecimatedHistory(3, length=2)]
+    for step in range(11):
+        for history in histories:
+            history.append(step, -step, np.full(4, step), np.full(4, -step),
+                           n_rejected=step)
+
+    full, _, ring, _, preallocated, decimated_ring = histories
+    expected = [list(range(11)), list(range(11)), [8, 9, 10], [0, 3, 6, 9],
+                [0, 3, 6, 9], [6, 9]]
+    for history, steps in zip(histories, expected):
+        np.testing.assert_array_equal(history.steps, steps)
+        np.testing.assert_array_equal(history.x_center, steps)
+        np.testing.assert_array_equal(history.y_center, np.negative(steps))
+        np.testing.assert_array_equal(history.retries, steps)
+        np.testing.assert_array_equal(history.x_perimeter[:, 0], steps)
+        assert history.n_steps == 11
+
+    # preallocated arrays are not grown, and rings never are
+    assert full.capacity == 11 and preallocated.capacity == 4
+    assert ring.capacity == 3 and decimated_ring.capacity == 2
@@ -0,0 +1,131 @@
+from core import Environment, Mouse
+from history import RingHistory
+from kernel import KernelSimulation
+from main import (ENV_WIDTH, ENV_HEIGHT, AVG_SPEED, SPEED_STD, TURN_STD,
+                  MAJOR_AXIS, MINOR_AXIS)
+from motion import EmpiricalMotion
+import numpy as np
+import pytest
+
+
+# duration of a step, as in main.main
+MOVEMENT_DURATION = (1/5)*(MAJOR_AXIS/AVG_SPEED)
+N_MICE = 3
+N_STEPS = 2000
+SEEDS = range(4)
+# largest Kolmogorov-Smirnov distance accepted between the engines. Runs of
+# one engine with other seeds differ by about 0.01, and a kernel turning
+# with pi/3 instead of pi/4 by 0.06
+MAX_KS_DISTANCE = 0.025
+# largest relative difference accepted between the mean retry counts. A
+# kernel turning with pi/3 instead of pi/4 differs by 12 %
+MAX_RETRY_DIFFERENCE = 0.1
+
+
+def python_run(seed, motion=None):
+    """
+    poses and retries of the Environment and Mouse engine of main.main
+
+    Returns
+    -------
+    poses: (np array of shape N_STEPS, N_MICE, 3) pose after each step
+    retries: (np array of shape N_STEPS, N_MICE) rejected moves at each step
+    """
+    env = Environment(ENV_WIDTH, ENV_HEIGHT, rng=np.random.default_rng(seed))
+    mice = [Mouse(env, N_MICE, i,
+                  history=RingHistory(1, store_perimeters=False),
+                  motion=motion)
+            for i in range(N_MICE)]
+    rows = [mouse.index for mouse in mice]
+
+    poses = np.empty((N_STEPS, N_MICE, 3))
+    retries = np.empty((N_STEPS, N_MICE), dtype=np.int64)
+    for step in range(N_STEPS):
+        for mouse in mice:
+            mouse.move(movement_duration=MOVEMENT_DURATION)
+        poses[step, :, :2] = env.engine.centers[rows]
+        poses[step, :, 2] = env.engine.angles[rows]
+        retries[step] = [mouse.retry_history[-1] for mouse in mice]
+
+    return poses, retries
+
+
+def kernel_run(seed, motion=None):
+    """
+    poses and retries of KernelSimulation, see python_run
+    """
+    sim = KernelSimulation(N_MICE, ENV_WIDTH, ENV_HEIGHT, AVG_SPEED,
+                           SPEED_STD, MAJOR_AXIS, MINOR_AXIS,
+                           rng=np.random.default_rng(seed),
+                           turn_std=TURN_STD, motion=motion)
+    return sim.run(N_STEPS, MOVEMENT_DURATION)
+
+
+def movement_statistics(runs):
+    """
+    step lengths, turns between consecutive moves and retry counts of every
+    mouse over several runs
+
+    Returns
+    -------
+    step_lengths, turns, retries: (np arrays) pooled samples
+    """
+    step_lengths, turns, retries = [], [], []
+    for poses, run_retries in runs:
+        moves = np.diff(poses[..., :2], axis=0)
+        length = np.hypot(moves[..., 0], moves[..., 1])
+        direction = np.arctan2(moves[..., 1], moves[..., 0])
+        # mice that stayed put have no direction
+        moved = (length[1:] > 0) & (length[:-1] > 0)
+        turn = np.angle(np.exp(1j*(direction[1:] - direction[:-1])))
+
+        step_lengths.append(length.ravel())
+        turns.append(turn[moved])
+        retries.append(run_retries.ravel())
+
+    return [np.concatenate(samples)
+            for samples in (step_lengths, turns, retries)]
+
+
+def ks_distance(a, b):
+    """
+    two sample Kolmogorov-Smirnov distance, the largest difference between
+    the empirical distribution functions
+    """
+    values = np.union1d(a, b)
+    cdf_a = np.searchsorted(np.sort(a), values, 'right')/a.size
+    cdf_b = np.searchsorted(np.sort(b), values, 'right')/b.size
+    return np.abs(cdf_a - cdf_b).max()
+
+
+def empirical_motion():
+    """
+    skewed speed and turn distributions, as measured from tracking
+    """
+    rng = np.random.default_rng(100)
+    speeds = rng.gamma(2.0, AVG_SPEED/2, 5000)
+    turns = np.pi + rng.laplace(0, 0.5, 5000)
+    return EmpiricalMotion(speeds, turns)
+
+
+@pytest.mark.parametrize('motion', [None, empirical_motion()],
+                         ids=['gaussian', 'empirical'])
+def test_kernel_matches_python_engine(motion):
+    """
+    the step kernel draws random numbers in its own order, so its runs are
+    compared with the Python engine by the distributions of step lengths,
+    turns and retries
+    """
+    python_stats = movement_statistics(
+        [python_run(seed, motion) for seed in SEEDS])
+    kernel_stats = movement_statistics(
+        [kernel_run(seed, motion) for seed in SEEDS])
+
+    for name, python_sample, kernel_sample in zip(
+            ('step length', 'turn', 'retries'), python_stats, kernel_stats):
+        distance = ks_distance(python_sample, kernel_sample)
+        assert distance < MAX_KS_DISTANCE, (name, distance)
+
+    python_retries, kernel_retries = python_stats[2], kernel_stats[2]
+    assert abs(kernel_retries.mean()/python_retries.mean() - 1) < \
+        MAX_RETRY_DIFFERENCE
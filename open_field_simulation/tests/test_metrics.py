@@ -0,0 +1,107 @@
+import h5py
+from interactions import interaction_distances, score_group
+from main import main
+from metrics import InteractionMetrics, BUFFER_SIZE
+import numpy as np
+import pytest
+from reader import read_poses
+
+
+THRESHOLDS = [5.0, 20.0]
+# long enough for more than one full buffer, about 450 timepoints a minute
+SIMULATION_LENGTH_MIN = 5
+# timepoints fed one at a time to buffers of different sizes
+N_FED = 400
+
+
+@pytest.fixture(scope='module')
+def simulation(tmp_path_factory):
+    """
+    a run of 3 mice recording its metrics over more timepoints than a buffer
+
+    Returns
+    -------
+    (str) the file
+    """
+    directory = tmp_path_factory.mktemp('metrics')
+    return main(3, simulation_length_min=SIMULATION_LENGTH_MIN, seed=0,
+                filename=str(directory/'run.h5'), progress=False,
+                metrics_thresholds=THRESHOLDS)
+
+
+def bouts(interacting):
+    """
+    durations of the runs of consecutive interacting timepoints
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(
+        ([False], interacting, [False])).astype(np.int8)))
+    return (edges[1::2] - edges[::2]).tolist()
+
+
+def test_metrics_match_scoring(simulation):
+    """
+    metrics accumulated while the simulation runs match the scores of the
+    stored poses
+    """
+    with h5py.File(simulation, 'r') as f:
+        metrics = f['metrics']
+        n_timepoints = f['pose_history'].shape[0]
+        assert n_timepoints > BUFFER_SIZE
+        assert n_timepoints % BUFFER_SIZE
+        assert metrics.attrs['n_timepoints'] == n_timepoints
+
+        fractions = score_group(f, THRESHOLDS)
+        np.testing.assert_allclose(metrics['interaction_fraction'][:],
+                                   fractions)
+        assert (fractions > 0).all()
+
+        gaps = interaction_distances(f, metrics.attrs['max_distance'])
+        pair_interacting = gaps[..., None] < THRESHOLDS
+        np.testing.assert_array_equal(metrics['pair_interaction_steps'][:],
+                                      pair_interacting.sum(axis=0))
+
+        durations = metrics['bout_durations'][:]
+        for pair in range(gaps.shape[1]):
+            for k in range(len(THRESHOLDS)):
+                expected = bouts(pair_interacting[:, pair, k])
+                recorded = durations[(durations[:, 0] == pair)
+                                     & (durations[:, 1] == k), 2]
+                assert sorted(recorded.tolist()) == sorted(expected)
+                assert metrics['bout_count'][pair, k] == len(expected)
+
+        histogram = metrics['distance_histogram'][:]
+        assert (histogram.sum(axis=1) == n_timepoints).all()
+        np.testing.assert_array_equal(
+            histogram[:, :-1].sum(axis=1),
+            (gaps < metrics.attrs['max_distance']).sum(axis=0))
+
+
+@pytest.mark.parametrize('buffer_size', [1, 7, 64])
+def test_metrics_do_not_depend_on_buffer_size(simulation, buffer_size):
+    """
+    bouts running across a flush are joined, so any buffer size gives the
+    metrics of a single buffer
+    """
+    with h5py.File(simulation, 'r') as f:
+        poses = read_poses(f, slice(N_FED))
+        attrs = f['center_history'].attrs
+        axes = np.tile([attrs['major_axis'], attrs['minor_axis']],
+                       (poses.shape[1], 1)).astype(float)
+
+    results = []
+    for size in (buffer_size, poses.shape[0]):
+        metrics = InteractionMetrics(THRESHOLDS, buffer_size=size)
+        for pose in poses:
+            metrics.update(pose[:, :2], pose[:, 2], axes)
+        metrics.finalize()
+        results.append(metrics)
+
+    buffered, whole = results
+    assert buffered.n_timepoints == whole.n_timepoints == poses.shape[0]
+    np.testing.assert_array_equal(buffered.interaction_steps,
+                                  whole.interaction_steps)
+    np.testing.assert_array_equal(buffered.bout_count, whole.bout_count)
+    np.testing.assert_array_equal(buffered.distance_histogram,
+                                  whole.distance_histogram)
+    assert whole.bout_count.any()
+    assert sorted(buffered.bout_durations) == sorted(whole.bout_durations)
@@ -0,0 +1,94 @@
+import h5py
+from main import main
+import numpy as np
+import pytest
+from reader import PerimeterReader, read_perimeters, read_poses
+
+
+CHUNK_SIZE = 16
+
+
+@pytest.fixture(scope='module')
+def simulation(tmp_path_factory):
+    """
+    a short run storing its perimeters, and a copy in the older format
+    without pose_history
+
+    Returns
+    -------
+    new, old: (str) the run and its copy
+    """
+    directory = tmp_path_factory.mktemp('reader')
+    new = main(3, simulation_length_min=0.2, seed=0,
+               filename=str(directory/'new.h5'), progress=False,
+               chunk_size=CHUNK_SIZE, store_perimeters=True)
+
+    old = str(directory/'old.h5')
+    with h5py.File(new, 'r') as source, h5py.File(old, 'w') as copy:
+        for name in ('center_history', 'perimeter_history',
+                     'retry_history'):
+            source.copy(name, copy)
+    return new, old
+
+
+def test_read_poses_of_old_files(simulation):
+    """
+    files without pose_history get their poses from the centers and the
+    first perimeter point
+    """
+    new, old = simulation
+    with h5py.File(new, 'r') as f:
+        poses = read_poses(f)
+        partial = read_poses(f, slice(5, 20))
+    with h5py.File(old, 'r') as f:
+        assert 'pose_history' not in f
+        rebuilt = read_poses(f)
+        rebuilt_partial = read_poses(f, slice(5, 20))
+
+    np.testing.assert_array_equal(rebuilt[..., :2], poses[..., :2])
+    # the rebuilt angles are wrapped to (-pi, pi]
+    turn = np.angle(np.exp(1j*(rebuilt[..., 2] - poses[..., 2])))
+    np.testing.assert_allclose(turn, 0, atol=1e-9)
+    np.testing.assert_array_equal(rebuilt_partial, rebuilt[5:20])
+    np.testing.assert_array_equal(partial, poses[5:20])
+
+
+def test_perimeters_rebuilt_from_poses(simulation):
+    """
+    perimeters rebuilt from pose_history match the stored ones, whole, by
+    index and chunk by chunk
+    """
+    new, _ = simulation
+    with h5py.File(new, 'r') as f:
+        stored = f['perimeter_history'][:]
+        # files with perimeter_history return the dataset itself
+        assert isinstance(read_perimeters(f), h5py.Dataset)
+
+        reader = PerimeterReader(f)
+        assert reader.shape == stored.shape
+        assert len(reader) == stored.shape[0]
+        np.testing.assert_allclose(np.asarray(reader), stored, atol=1e-9)
+        np.testing.assert_allclose(reader[7], stored[7], atol=1e-9)
+        np.testing.assert_allclose(reader[3:9, 2:4, ::5],
+                                   stored[3:9, 2:4, ::5], atol=1e-9)
+
+        chunks = list(reader.chunks(CHUNK_SIZE))
+        assert [start for start, _ in chunks] == list(
+            range(0, stored.shape[0], CHUNK_SIZE))
+        np.testing.assert_allclose(
+            np.concatenate([chunk for _, chunk in chunks]), stored,
+            atol=1e-9)
+
+
+def test_read_perimeters_without_stored_perimeters(tmp_path):
+    """
+    files written without store_perimeters are read through a
+    PerimeterReader
+    """
+    filename = main(2, simulation_length_min=0.05, seed=1,
+                    filename=str(tmp_path/'run.h5'), progress=False)
+    with h5py.File(filename, 'r') as f:
+        assert 'perimeter_history' not in f
+        perimeters = read_perimeters(f)
+        assert isinstance(perimeters, PerimeterReader)
+        assert perimeters[:].shape == perimeters.shape
@@ -0,0 +1,192 @@
+import h5py
+from interactions import interaction_distances
+from main import main
+import numpy as np
+import pytest
+import stimulation
+from stimulation import ProximityPolicy, Stimulator
+
+
+N_MICE = 2
+STEP_MS = 100.0
+
+
+class ScriptedPolicy:
+    """
+    Class to request stimulation on a fixed schedule, advancing a fake clock
+    by the decision time of each timepoint
+
+    Attributes
+    ----------
+    requests: (np array of bools of shape n_timepoints, n_mice) mice to
+              stimulate at each timepoint
+    decision_ms: (list of floats) time taken by each decision
+    clock: (float) fake perf_counter time in seconds
+    attrs: (dict) parameters of the policy
+
+    Methods
+    -------
+    decide(centers, angles, axes)
+        the scheduled requests of the next timepoint
+    perf_counter()
+        the fake clock
+    """
+    def __init__(self, requests, decision_ms=None):
+        self.requests = np.asarray(requests, dtype=bool)
+        if decision_ms is None:
+            decision_ms = np.zeros(self.requests.shape[0])
+        self.decision_ms = list(decision_ms)
+        self.clock = 0.0
+        self.attrs = {'policy': 'scripted'}
+        self._t = 0
+
+    def decide(self, centers, angles, axes):
+        self.clock += self.decision_ms[self._t]/1e3
+        self._t += 1
+        return self.requests[self._t - 1]
+
+    def perf_counter(self):
+        return self.clock
+
+
+def schedule(n_timepoints, *epochs):
+    """
+    requests of mice over timepoints
+
+    Inputs
+    ------
+    n_timepoints: (int) length of the schedule
+    epochs: (tuples of mouse, start, end) requested timepoints of a mouse,
+            end excluded
+
+    Returns
+    -------
+    (np array of bools of shape n_timepoints, N_MICE)
+    """
+    requests = np.zeros((n_timepoints, N_MICE), dtype=bool)
+    for mouse, start, end in epochs:
+        requests[start:end, mouse] = True
+    return requests
+
+
+def run(stimulator, monkeypatch):
+    """
+    feed every timepoint of a scripted policy to a stimulator
+
+    Returns
+    -------
+    stimulator: (Stimulator) the stimulator, finalized
+    """
+    policy = stimulator.policy
+    monkeypatch.setattr(stimulation, 'time', policy)
+    stimulator.start(N_MICE, STEP_MS)
+    for _ in range(policy.requests.shape[0]):
+        stimulator.update(np.zeros((N_MICE, 2)), np.zeros(N_MICE),
+                          np.ones((N_MICE, 2)))
+    stimulator.finalize()
+    return stimulator
+
+
+@pytest.mark.parametrize('latency_ms, decision_cost_ms, delay_steps',
+                         [(0, 0, 0), (100, 0, 1), (150, 0, 2), (150, 50, 2),
+                          (150, 60, 3)])
+def test_delay_rounds_up_to_timepoints(latency_ms, decision_cost_ms,
+                                       delay_steps):
+    """
+    requests take effect after the decision cost and latency, rounded up to
+    whole timepoints
+    """
+    stimulator = Stimulator(ScriptedPolicy(schedule(1)), latency_ms,
+                            decision_cost_ms)
+    stimulator.start(N_MICE, STEP_MS)
+    assert stimulator.delay_steps == delay_steps
+
+
+def test_latency_shifts_epochs(monkeypatch):
+    """
+    epochs start and end delay_steps after their requests, epochs still
+    running at the end are closed, and the light restarts with each epoch
+    """
+    requests = schedule(12, (0, 0, 3), (0, 5, 10), (1, 8, 12))
+    stimulator = run(Stimulator(ScriptedPolicy(requests), latency_ms=150,
+                                period_ms=500, duty_cycle=0.5), monkeypatch)
+
+    # 2 timepoints of delay; 300, 500 and 200 ms of stimulation with the
+    # light on for the first 250 ms of each 500 ms period
+    assert stimulator.delay_steps == 2
+    expected = [(0, 2, 5, 250.0), (0, 7, 12, 250.0), (1, 10, 12, 200.0)]
+    assert sorted(stimulator.epochs) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('period_ms, duty_cycle, n_timepoints, light_ms',
+                         [(500, 0.5, 12, 700.0), (300, 0.2, 10, 240.0),
+                          (250, 0.5, 10, 500.0), (500, 0.0, 10, 0.0),
+                          (500, 1.0, 10, 1000.0)])
+def test_duty_cycle(monkeypatch, period_ms, duty_cycle, n_timepoints,
+                    light_ms):
+    """
+    the light is on for duty_cycle of every period from the epoch start
+    """
+    requests = schedule(n_timepoints, (0, 0, n_timepoints))
+    stimulator = run(Stimulator(ScriptedPolicy(requests), latency_ms=0,
+                                period_ms=period_ms, duty_cycle=duty_cycle),
+                     monkeypatch)
+
+    assert stimulator.epochs == [(0, 0, n_timepoints, pytest.approx(
+        light_ms))]
+
+
+@pytest.mark.parametrize('deadline_ms, decision_cost_ms, misses, meets',
+                         [(None, 0, 2, False), (None, 60, 3, False),
+                          (250, 0, 0, True), (250, 60, 1, False)])
+def test_deadline(monkeypatch, tmp_path, deadline_ms, decision_cost_ms,
+                  misses, meets):
+    """
+    decisions whose measured time plus decision cost exceed the deadline,
+    a timepoint by default, are counted, and the deadline is met when 99 %
+    of the decisions meet it
+    """
+    decision_ms = [10, 50, 120, 30, 200]
+    stimulator = run(Stimulator(ScriptedPolicy(schedule(5), decision_ms),
+                                latency_ms=0,
+                                decision_cost_ms=decision_cost_ms,
+                                deadline_ms=deadline_ms), monkeypatch)
+    assert stimulator.deadline_misses == misses
+
+    with h5py.File(tmp_path/'stimulation.h5', 'w') as f:
+        stimulator.write(f)
+        attrs = f['stimulation'].attrs
+        assert attrs['policy'] == 'scripted'
+        assert attrs['deadline_misses'] == misses
+        assert attrs['meets_deadline'] == meets
+        np.testing.assert_allclose(f['stimulation']['decision_ms'][:],
+                                   decision_ms, rtol=1e-6)
+        assert f['stimulation']['epochs'].shape == (0, 3)
+
+
+def test_proximity_epochs_follow_the_poses(tmp_path):
+    """
+    in a simulation, the proximity policy stimulates its target over the
+    runs of timepoints it is within the threshold of its partner, shifted
+    by delay_steps
+    """
+    threshold = 20.0
+    stimulator = Stimulator(ProximityPolicy(threshold=threshold))
+    filename = main(2, simulation_length_min=0.5, seed=0,
+                    filename=str(tmp_path/'run.h5'), progress=False,
+                    stimulation=stimulator)
+
+    with h5py.File(filename, 'r') as f:
+        close = interaction_distances(f, threshold)[:, 0] < threshold
+        epochs = f['stimulation']['epochs'][:]
+        delay_steps = f['stimulation'].attrs['delay_steps']
+
+    n_timepoints = close.size
+    delivered = np.zeros(n_timepoints, dtype=bool)
+    delivered[delay_steps:] = close[:n_timepoints - delay_steps]
+    edges = np.flatnonzero(np.diff(np.concatenate(
+        ([False], delivered, [False])).astype(np.int8)))
+
+    assert len(edges)
+    np.testing.assert_array_equal(epochs[:, 0], 0)
+    np.testing.assert_array_equal(epochs[:, 1:], edges.reshape(-1, 2))
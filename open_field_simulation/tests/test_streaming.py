@@ -0,0 +1,129 @@
+import asyncio
+import h5py
+from interactions import (interaction_distances, mouse_distances,
+                          score_group)
+from main import main
+import numpy as np
+import pytest
+from reader import read_poses
+from streaming import Frame, InteractionServer, stream_file
+import time
+
+
+THRESHOLDS = [5.0, 20.0]
+QUEUE_SIZE = 4
+
+
+class BurstSource:
+    """
+    Class to deliver every frame of a simulation at once, without letting
+    the consumer run in between, so the queue overflows deterministically
+
+    Attributes
+    ----------
+    poses: (np array of shape n_frames, n_mice, 3) poses of each frame
+    n_mice: (int) number of mice
+    major_axis, minor_axis: (float) axes of the mice (mm)
+
+    Methods
+    -------
+    frames()
+        asynchronous iterator over the frames
+    """
+    def __init__(self, filename):
+        with h5py.File(filename, 'r') as f:
+            self.poses = read_poses(f)
+            attrs = f['center_history'].attrs
+            self.n_mice = int(attrs['n_mice'])
+            self.major_axis = float(attrs['major_axis'])
+            self.minor_axis = float(attrs['minor_axis'])
+
+    async def frames(self):
+        for index, pose in enumerate(self.poses):
+            yield Frame(index, pose, time.perf_counter())
+
+
+@pytest.fixture(scope='module')
+def simulation(tmp_path_factory):
+    """
+    a short run of 3 mice
+
+    Returns
+    -------
+    (str) the file
+    """
+    directory = tmp_path_factory.mktemp('streaming')
+    return main(3, simulation_length_min=0.5, seed=0,
+                filename=str(directory/'run.h5'), progress=False)
+
+
+def frame_fractions(filename, indices):
+    """
+    fraction of the given frames each mouse is interacting, from the exact
+    gaps of interactions.interaction_distances
+
+    Returns
+    -------
+    (np array of shape n_mice, n_thresholds)
+    """
+    with h5py.File(filename, 'r') as f:
+        gaps = interaction_distances(f, max(THRESHOLDS))
+        n_mice = int(f['center_history'].attrs['n_mice'])
+    distances = mouse_distances(gaps[indices], n_mice)
+    return (distances[..., None] < THRESHOLDS).mean(axis=0)
+
+
+@pytest.mark.parametrize('socket', [False, True])
+def test_stream_matches_scoring(simulation, socket):
+    """
+    a file replayed without drops gives the fractions of
+    interactions.score_group, directly or through a socket
+    """
+    stats = asyncio.run(stream_file(simulation, THRESHOLDS, rate_hz=None,
+                                    socket=socket, drop_policy='block',
+                                    queue_size=QUEUE_SIZE))
+
+    with h5py.File(simulation, 'r') as f:
+        n_frames = f['pose_history'].shape[0]
+        fractions = score_group(f, THRESHOLDS)
+    assert stats['n_received'] == stats['n_decided'] == n_frames
+    assert stats['n_dropped'] == 0
+    assert (fractions > 0).any()
+    np.testing.assert_allclose(stats['interaction_fraction'], fractions)
+
+
+@pytest.mark.parametrize('drop_policy', ['block', 'oldest', 'newest'])
+def test_drop_policies(simulation, drop_policy):
+    """
+    when frames arrive faster than they are evaluated, 'block' evaluates
+    them all, 'oldest' keeps the latest frames and 'newest' the first ones,
+    and the fractions are those of the frames evaluated
+    """
+    source = BurstSource(simulation)
+    n_frames = source.poses.shape[0]
+    decided = []
+
+    async def record(decision):
+        decided.append(decision.index)
+
+    server = InteractionServer(source, THRESHOLDS, queue_size=QUEUE_SIZE,
+                               drop_policy=drop_policy, on_decision=record)
+    stats = asyncio.run(server.run())
+
+    expected = {'block': list(range(n_frames)),
+                'oldest': list(range(n_frames - QUEUE_SIZE, n_frames)),
+                'newest': list(range(QUEUE_SIZE))}[drop_policy]
+    assert decided == expected
+    assert stats['n_received'] == n_frames
+    assert stats['n_decided'] == len(expected)
+    assert stats['n_dropped'] == n_frames - len(expected)
+    np.testing.assert_allclose(stats['interaction_fraction'],
+                               frame_fractions(simulation, expected))
+
+
+def test_unknown_drop_policy(simulation):
+    """
+    drop policies other than DROP_POLICIES are an error
+    """
+    with pytest.raises(ValueError):
+        InteractionServer(BurstSource(simulation), drop_policy='latest')
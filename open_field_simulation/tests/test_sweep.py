@@ -0,0 +1,100 @@
+import h5py
+import json
+import logging
+import numpy as np
+import os
+from sweep import build_tasks, sweep, MANIFEST
+import zlib
+
+
+# two one-mouse tasks, the shortest simulations main.main runs by default
+SWEEP = {'n_mice': (1,), 'n_replicates': 2, 'seed': 7, 'max_workers': 2}
+
+
+def read_poses(filename):
+    """
+    pose_history and seed attrs of a simulation file
+    """
+    with h5py.File(filename, 'r') as f:
+        attrs = f['center_history'].attrs
+        return (f['pose_history'][:], attrs['seed'],
+                tuple(attrs['spawn_key']))
+
+
+def test_task_seeds():
+    """
+    each task is seeded with a child of the root seed keyed by the crc32 of
+    its name, so its seed does not change when the sweep is extended
+    """
+    tasks = build_tasks((1, 2), (0.09,), (0.06,), ((250, 180),), 2, 7, 'out')
+    extended = build_tasks((1, 2, 3), (0.06, 0.09), (0.06,), ((250, 180),),
+                           3, 7, 'out')
+
+    for task in tasks:
+        name = os.path.basename(task['filename'])
+        seed_sequence = task['seed_sequence']
+        assert seed_sequence.entropy == 7
+        assert seed_sequence.spawn_key == (zlib.crc32(name.encode()),)
+
+        same = [other for other in extended
+                if other['filename'] == task['filename']]
+        assert len(same) == 1
+        assert (same[0]['seed_sequence'].generate_state(4)
+                == seed_sequence.generate_state(4)).all()
+
+    keys = [task['seed_sequence'].spawn_key for task in extended]
+    assert len(set(keys)) == len(keys)
+
+
+def test_sweep_is_deterministic(tmp_path):
+    """
+    the same sweep run twice writes the same simulations, and its replicates
+    differ
+    """
+    first = sweep(**SWEEP, out_dir=str(tmp_path/'first'))
+    second = sweep(**SWEEP, out_dir=str(tmp_path/'second'))
+    assert len(first) == len(second) == 2
+
+    for record in first:
+        name = os.path.basename(record['filename'])
+        poses, seed, spawn_key = read_poses(record['filename'])
+        again = read_poses(str(tmp_path/'second'/name))
+        np.testing.assert_array_equal(poses, again[0])
+        assert seed == '7'
+        assert spawn_key == (zlib.crc32(name.encode()),)
+
+    replicates = [read_poses(record['filename'])[0] for record in first]
+    assert not np.array_equal(*replicates)
+
+
+def test_sweep_resumes(tmp_path, caplog):
+    """
+    a rerun skips finished tasks, and reruns an interrupted task from
+    scratch, replacing its partial file with the complete one
+    """
+    out_dir = str(tmp_path)
+    records = sweep(**SWEEP, out_dir=out_dir)
+    finished, interrupted = sorted(record['filename'] for record in records)
+    expected = read_poses(interrupted)[0]
+    finished_mtime = os.path.getmtime(finished)
+
+    # an interrupted task leaves only its partial file
+    os.replace(interrupted, interrupted + '.partial')
+    with open(interrupted + '.partial', 'ab') as f:
+        f.write(b'truncated')
+
+    with caplog.at_level(logging.INFO, logger='sweep'):
+        rerun = sweep(**SWEEP, out_dir=out_dir)
+    assert '1 of 2 simulations already done' in caplog.text
+
+    assert [record['filename'] for record in rerun] == [interrupted]
+    assert not os.path.exists(interrupted + '.partial')
+    assert os.path.getmtime(finished) == finished_mtime
+    np.testing.assert_array_equal(read_poses(interrupted)[0], expected)
+
+    with open(os.path.join(out_dir, MANIFEST)) as f:
+        manifest = [json.loads(line) for line in f]
+    assert [record['filename'] for record in manifest].count(interrupted) == 2
+
+    # nothing is left to run
+    assert sweep(**SWEEP, out_dir=out_dir) == []
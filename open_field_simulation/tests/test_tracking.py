@@ -0,0 +1,237 @@
+from core import Environment, Mouse
+from history import RingHistory
+from main import AVG_SPEED, MAJOR_AXIS
+import numpy as np
+import os
+import pytest
+from scipy.io.matlab import loadmat, MatReadWarning, savemat
+import struct
+from tracking import (fit_motion, mcos_properties, read_mat_objects,
+                      workspace_cells, wrap_angle)
+import warnings
+
+
+# duration of a step, as in main.main
+MOVEMENT_DURATION = (1/5)*(MAJOR_AXIS/AVG_SPEED)
+# narrow speeds, so no speed is negative and moves the mouse backwards
+SPEED_STD = 0.02
+N_STEPS = 20000
+# far larger than the distance a mouse wanders in N_STEPS, so no move hits
+# a wall and gets a uniform turn
+ARENA_SIZE = 100000
+# head to back distance of the tracks (mm)
+BODY_LENGTH = 30
+# standard deviation of the changes of direction of a mouse keeping its
+# direction (radians)
+FORWARD_TURN_STD = 0.5
+# DeepLabCut tracks of the repository, MATLAB tables of each body part
+MAT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        '..', 'micebody_deeplabcut.mat')
+
+
+class SimulatedTracks:
+    """
+    Class to present the poses of a simulated mouse as DeepLabCutTracks,
+    with a head and back point on its major axis at each frame, in mm
+
+    Attributes
+    ----------
+    bodyparts: (tuple of str) names of the tracked body parts
+    n_frames: (int) number of frames
+
+    Methods
+    -------
+    part(name)
+        positions of one body part
+    """
+    def __init__(self, centers, angles):
+        axis = (BODY_LENGTH/2)*np.column_stack([np.cos(angles),
+                                                np.sin(angles)])
+        self._positions = {'Head': centers + axis, 'Back': centers - axis}
+        self.bodyparts = tuple(self._positions)
+        self.n_frames = len(centers)
+
+    def part(self, name):
+        return self._positions[name]
+
+
+def simulate(turn_std=None, motion=None, seed=0):
+    """
+    poses of one mouse of the Environment and Mouse engine of main.main,
+    one frame per step
+
+    Returns
+    -------
+    (SimulatedTracks) head and back of the mouse at each step
+    """
+    env = Environment(ARENA_SIZE, ARENA_SIZE,
+                      rng=np.random.default_rng(seed))
+    mouse = Mouse(env, 1, 0, avg_speed=AVG_SPEED, speed_std=SPEED_STD,
+                  turn_std=turn_std, motion=motion,
+                  history=RingHistory(1, store_perimeters=False))
+
+    centers = np.empty((N_STEPS, 2))
+    angles = np.empty(N_STEPS)
+    for step in range(N_STEPS):
+        mouse.move(movement_duration=MOVEMENT_DURATION)
+        centers[step] = env.engine.centers[mouse.index]
+        angles[step] = env.engine.angles[mouse.index]
+    return SimulatedTracks(centers, angles)
+
+
+def forward_tracks(seed=0):
+    """
+    tracks of a mouse keeping its direction, whose changes of direction
+    are gaussian around 0 rather than around the backward heading of
+    core.Mouse.get_heading_direction
+
+    Returns
+    -------
+    (SimulatedTracks) head and back of the mouse at each step
+    """
+    rng = np.random.default_rng(seed)
+    directions = np.cumsum(rng.normal(0, FORWARD_TURN_STD, N_STEPS - 1))
+    speeds = rng.normal(AVG_SPEED, SPEED_STD, N_STEPS - 1)
+    moves = (speeds*MOVEMENT_DURATION)[:, None]*np.column_stack(
+        [np.cos(directions), np.sin(directions)])
+    centers = np.concatenate([np.zeros((1, 2)), np.cumsum(moves, axis=0)])
+    angles = np.concatenate([directions[:1], directions])
+    return SimulatedTracks(centers, angles)
+
+
+@pytest.mark.parametrize('turn_std', [0.5, np.pi/4, 1.5])
+def test_fit_recovers_simulation_parameters(turn_std):
+    """
+    fitting the tracks of a simulated mouse gives back the parameters it
+    was simulated with, in the convention of main.main
+    """
+    fit = fit_motion(simulate(turn_std), frame_rate_hz=1000/MOVEMENT_DURATION,
+                     mm_per_pixel=1)
+
+    assert fit.step_ms == pytest.approx(MOVEMENT_DURATION)
+    assert fit.avg_speed == pytest.approx(AVG_SPEED, rel=0.01)
+    assert fit.speed_std == pytest.approx(SPEED_STD, rel=0.05)
+    assert fit.turn_std == pytest.approx(turn_std, abs=0.05)
+
+    assert fit.main_kwargs() == {'avg_speed': fit.avg_speed,
+                                 'speed_std': fit.speed_std}
+    assert fit.motion().turn_std == pytest.approx(fit.turn_std)
+
+
+def test_fit_follows_heading_convention():
+    """
+    turn_std is fitted around the backward heading the engine turns from,
+    so a mouse keeping its direction is not fitted the small turn_std that
+    would make a simulated mouse reverse at every step. The empirical
+    motion reproduces its turns
+    """
+    rate = 1000/MOVEMENT_DURATION
+    fit = fit_motion(forward_tracks(), frame_rate_hz=rate, mm_per_pixel=1)
+    forward_cosine = np.cos(fit.turns).mean()
+    assert forward_cosine == pytest.approx(np.exp(-FORWARD_TURN_STD**2/2),
+                                           abs=0.01)
+    # no gaussian around the backward heading keeps the direction, the
+    # closest is uniform
+    assert fit.turn_std > np.pi
+
+    refit = fit_motion(simulate(motion=fit.motion()), frame_rate_hz=rate,
+                       mm_per_pixel=1)
+    assert np.cos(refit.turns).mean() == pytest.approx(forward_cosine,
+                                                       abs=0.02)
+    assert abs(np.sin(wrap_angle(refit.turns)).mean()) < 0.02
+
+
+@pytest.fixture(scope='module')
+def workspace():
+    """
+    function workspace of MAT_FILE, which holds its MATLAB objects
+
+    Returns
+    -------
+    (bytes) the __function_workspace__ variable
+    """
+    if not os.path.exists(MAT_FILE):
+        pytest.skip('no DeepLabCut mat file')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', MatReadWarning)
+        return loadmat(MAT_FILE)['__function_workspace__'].tobytes()
+
+
+def patched(data, offset, *values):
+    """
+    copy of bytes with little endian uint32 values written at offset
+    """
+    data = bytearray(data)
+    struct.pack_into(f'<{len(values)}I', data, offset, *values)
+    return bytes(data)
+
+
+def test_read_mat_objects(workspace, tmp_path):
+    """
+    the tables of each body part are read with their properties, and files
+    without objects have none
+    """
+    tables = read_mat_objects(MAT_FILE)
+    assert sorted(tables) == ['Back', 'Head', 'Neck']
+    for table in tables.values():
+        assert {'data', 'varnames', 'nrows'} <= set(table)
+        x, y = np.ravel(table['data'])[:2]
+        assert np.size(x) == np.size(y) == int(np.ravel(table['nrows'])[0])
+
+    savemat(tmp_path/'plain.mat', {'x': np.arange(3)})
+    assert read_mat_objects(str(tmp_path/'plain.mat')) == {}
+
+
+# malformed copies of a function workspace and the error each raises
+MALFORMED_WORKSPACES = {
+    'truncated': (lambda data: data[:40], 'not a little endian'),
+    'big endian': (lambda data: data[:2] + b'MI' + data[4:],
+                   'not a little endian'),
+    'not an array': (lambda data: patched(data, 8, 15), 'MATLAB array'),
+    'no dimensions': (lambda data: patched(data, 32, 5, 0), 'MATLAB array'),
+    'named array': (lambda data: patched(data, 48, 1, 2), 'not unnamed'),
+}
+# malformed copies of MCOS metadata, given its region offsets, and the
+# error each raises. The property set of the first object, after the empty
+# row, is its fifth integer
+MALFORMED_METADATA = {
+    'truncated': (lambda data, offsets: data[:36], 'truncated'),
+    'version': (lambda data, offsets: patched(data, 0, 9), 'version 9'),
+    'order': (lambda data, offsets: patched(data, 16, offsets[3],
+                                            offsets[2]), 'out of order'),
+    'beyond end': (lambda data, offsets: data[:offsets[4] - 8],
+                   'beyond its end'),
+    'names': (lambda data, offsets: patched(data, 4, 1000), 'names'),
+    'object rows': (lambda data, offsets: patched(data, 20, offsets[3] + 4),
+                    'rows of 6'),
+    'property set': (lambda data, offsets: patched(
+        data, offsets[2] + 24 + 16, 99), 'property set 99'),
+    'overrun': (lambda data, offsets: patched(data, offsets[3] + 8, 1000),
+                'overrun'),
+}
+
+
+@pytest.mark.parametrize('case', MALFORMED_WORKSPACES)
+def test_malformed_workspace(workspace, case):
+    """
+    a function workspace laid out otherwise is a ValueError
+    """
+    assert workspace_cells(workspace).size
+    malform, message = MALFORMED_WORKSPACES[case]
+    with pytest.raises(ValueError, match=message):
+        workspace_cells(malform(workspace))
+
+
+@pytest.mark.parametrize('case', MALFORMED_METADATA)
+def test_malformed_metadata(workspace, case):
+    """
+    MCOS metadata laid out otherwise is a ValueError rather than a wrong
+    mapping of properties to cells
+    """
+    metadata = workspace_cells(workspace)[0].tobytes()
+    offsets = struct.unpack_from('<8I', metadata, 8)
+    assert mcos_properties(metadata)
+
+    malform, message = MALFORMED_METADATA[case]
+    with pytest.raises(ValueError, match=message):
+        mcos_properties(malform(metadata, offsets))
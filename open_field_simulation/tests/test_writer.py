@@ -0,0 +1,65 @@
+import h5py
+from main import main
+import numpy as np
+import pytest
+from reader import read_poses
+from writer import StreamingWriter
+
+
+CHUNK_SIZE = 16
+# not a multiple of CHUNK_SIZE, so the last chunk is only written by flush
+N_ROWS = 2*CHUNK_SIZE + 5
+
+
+@pytest.mark.parametrize('compression', ['gzip', None])
+def test_streaming_writer_round_trip(tmp_path, compression):
+    """
+    rows appended one at a time are read back as written, in chunks of
+    CHUNK_SIZE timepoints
+    """
+    rng = np.random.default_rng(0)
+    positions = rng.random((N_ROWS, 3, 2))
+    retries = rng.integers(0, 100, (N_ROWS, 3)).astype(np.int32)
+
+    with h5py.File(tmp_path/'run.h5', 'w') as f:
+        writer = StreamingWriter(f, chunk_size=CHUNK_SIZE,
+                                 compression=compression)
+        writer.create_dataset('positions', (3, 2))
+        writer.create_dataset('retries', (3,), dtype=np.int32)
+        for row in range(N_ROWS):
+            writer.append('positions', positions[row])
+            writer.append('retries', retries[row])
+            # full chunks are written as soon as they are complete
+            assert f['positions'].shape[0] == (row + 1)//CHUNK_SIZE*CHUNK_SIZE
+        writer.flush()
+
+    with h5py.File(tmp_path/'run.h5', 'r') as f:
+        np.testing.assert_array_equal(f['positions'][:], positions)
+        np.testing.assert_array_equal(f['retries'][:], retries)
+        assert f['positions'].chunks == (CHUNK_SIZE, 3, 2)
+        assert f['positions'].compression == compression
+        assert f['retries'].dtype == np.int32
+
+
+def test_simulation_round_trip(tmp_path):
+    """
+    a run streamed in chunks smaller than its length stores consistent
+    centers, poses, perimeters and retries at every timepoint
+    """
+    filename = main(3, simulation_length_min=0.2, seed=0,
+                    filename=str(tmp_path/'run.h5'), progress=False,
+                    chunk_size=CHUNK_SIZE, store_perimeters=True)
+
+    with h5py.File(filename, 'r') as f:
+        n_timepoints = f['pose_history'].shape[0]
+        assert n_timepoints > 2*CHUNK_SIZE
+        assert n_timepoints % CHUNK_SIZE
+
+        poses = read_poses(f)
+        centers = f['center_history'][:].reshape(n_timepoints, 3, 2)
+        np.testing.assert_array_equal(poses[..., :2], centers)
+        assert f['perimeter_history'].shape[0] == n_timepoints
+        assert f['retry_history'].shape == (n_timepoints - 1, 3)
+
+        # mice move between timepoints
+        assert (np.diff(centers, axis=0) != 0).any(axis=(1, 2)).all()
@@ -0,0 +1,501 @@
+import argparse
+import h5py
+import hashlib
+import io
+import json
+import math
+from motion import (EmpiricalMotion, heading_turns, TABLE_SIZE,
+                    wrapped_normal_std)
+import numpy as np
+import os
+from scipy.io.matlab import (loadmat, MatlabOpaque, MatReadWarning,
+                              varmats_from_mat)
+import struct
+import warnings
+
+
+# Micebodydeformation.m converts pixels to cm with 0.03048 cm per pixel
+MM_PER_PIXEL = 0.3048
+# frame rate of the tracked video, not stored in the DeepLabCut file
+FRAME_RATE_HZ = 30
+# default body and speed of main.main, whose movement duration is
+# (1/5)*(MAJOR_AXIS/AVG_SPEED) ms
+MAJOR_AXIS = 60  # mm
+STEP_MS = (1/5)*(MAJOR_AXIS/0.09)
+# moves shorter than this (mm) have no meaningful direction, e.g. tracking
+# jitter of a resting mouse, and are left out of the turn angles
+MIN_MOVE = 1.0
+# first word of the metadata of a MATLAB object in a mat file
+MCOS_MAGIC = 0xdd000000
+# versions of the MCOS metadata whose layout mcos_properties reads
+MCOS_VERSIONS = (2, 3)
+# data types of the mat file elements of the function workspace
+MI_INT8, MI_INT32, MI_UINT32, MI_MATRIX = 1, 5, 6, 14
+# default directory of the track caches, outside the data and source
+# directories so caches are never committed with them
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                                        os.path.expanduser('~/.cache')),
+                         'open_field_simulation')
+
+
+def read_mat_objects(filename):
+    """
+    MATLAB objects of a version 5 mat file, e.g. the tables written by
+    DeepLabCut scripts, which scipy.io.loadmat only returns as opaque ids.
+    Each variable only holds an object id; the properties of the objects are
+    stored in the MCOS FileWrapper__ cell array of the file's function
+    workspace, together with metadata mapping property names to cells. A
+    ValueError is raised when they are stored otherwise
+
+    Inputs
+    ------
+    filename: (str) mat file
+
+    Returns
+    -------
+    objects: (dict) {variable name: {property name: value}}
+    """
+    ids = {}
+    with warnings.catch_warnings():
+        # every object variable is read under the name None
+        warnings.simplefilter('ignore', MatReadWarning)
+        with open(filename, 'rb') as f:
+            for _, stream in varmats_from_mat(f):
+                for value in loadmat(stream).values():
+                    if not isinstance(value, MatlabOpaque):
+                        continue
+                    # metadata: magic, ndims, dims, object id, class id
+                    metadata = np.ravel(value['arr'][0])
+                    if metadata[0] == MCOS_MAGIC:
+                        ids[value['s0'][0].decode()] = int(metadata[-2])
+        workspace = loadmat(filename).get('__function_workspace__')
+
+    if workspace is None:
+        return {}
+
+    try:
+        cells = workspace_cells(workspace.tobytes())
+        properties = mcos_properties(cells[0].tobytes())
+    except ValueError as error:
+        raise ValueError(f'{filename}: {error}') from None
+
+    objects = {}
+    for name, object_id in ids.items():
+        if object_id not in properties:
+            raise ValueError(f'{filename}: variable {name} refers to '
+                             f'object {object_id}, which is not stored')
+        if any(cell >= cells.size
+               for cell in properties[object_id].values()):
+            raise ValueError(f'{filename}: a property of variable {name} '
+                             f'is beyond the {cells.size} stored cells')
+        objects[name] = {prop: cells[cell] for prop, cell in
+                         properties[object_id].items()}
+    return objects
+
+
+def workspace_cells(workspace):
+    """
+    cells of the MCOS FileWrapper__ array held by the function workspace of
+    a mat file. The workspace is a mat file of its own, whose header is
+    truncated and whose variable has an empty name, which loadmat skips, so
+    its layout is checked, raising a ValueError when it differs, and the
+    variable renamed before it is read
+
+    Inputs
+    ------
+    workspace: (bytes) the __function_workspace__ variable of a mat file
+
+    Returns
+    -------
+    cells: (np array of objects) cells of the FileWrapper__ array, the
+           metadata first
+    """
+    # version, endian indicator and padding, then the matrix tag, the array
+    # flags, the dimensions tag and at least one dimension
+    if len(workspace) < 48 or workspace[2:4] != b'IM':
+        raise ValueError('the function workspace is not a little endian '
+                         'mat file')
+    matrix_type, matrix_size = struct.unpack_from('<2I', workspace, 8)
+    flags = struct.unpack_from('<2I', workspace, 16)
+    dims_type, dims_size = struct.unpack_from('<2I', workspace, 32)
+    if (matrix_type != MI_MATRIX or matrix_size > len(workspace) - 16
+            or flags != (MI_UINT32, 8) or dims_type != MI_INT32
+            or not dims_size or dims_size % 4):
+        raise ValueError('the function workspace does not start with a '
+                         'MATLAB array')
+
+    # the name element follows the matrix tag, the array flags and the
+    # dimensions, padded to 8 bytes
+    name_start = 40 + dims_size + -dims_size % 8
+    if (name_start + 8 > len(workspace)
+            or struct.unpack_from('<2I', workspace, name_start)
+            != (MI_INT8, 0)):
+        raise ValueError('the array of the function workspace is not '
+                         'unnamed')
+    stream = (b'MATLAB 5.0 MAT-file'.ljust(116, b' ') + b'\x00'*8
+              + workspace[:4] + workspace[8:name_start]
+              + struct.pack('<HH4s', 1, 2, b'ws')
+              + workspace[name_start + 8:])
+    value = loadmat(io.BytesIO(stream))['ws']
+
+    if value.size != 1 or 'MCOS' not in (value.dtype.names or ()):
+        raise ValueError('the function workspace has no MCOS field')
+    wrapper = value.flat[0]['MCOS']
+    if (not isinstance(wrapper, MatlabOpaque)
+            or wrapper['s2'][0] != b'FileWrapper__'):
+        raise ValueError('the MCOS field of the function workspace is not '
+                         'a FileWrapper__ object')
+    cells = np.ravel(wrapper['arr'][0])
+    if not cells.size or cells[0].dtype != np.uint8:
+        raise ValueError('the FileWrapper__ object has no metadata')
+    return cells
+
+
+def mcos_properties(metadata):
+    """
+    cell of each property of each object described by the metadata of an
+    MCOS FileWrapper__ cell array. The layout is checked as it is read, and
+    a ValueError raised rather than properties mapped to the wrong cells
+
+    Inputs
+    ------
+    metadata: (bytes) first cell of the FileWrapper__ array
+
+    Returns
+    -------
+    properties: (dict) {object id: {property name: cell index}}
+    """
+    # version, number of names and the offsets of 8 regions
+    if len(metadata) < 40:
+        raise ValueError('the MCOS metadata is truncated')
+    version, n_names = struct.unpack_from('<2I', metadata, 0)
+    if version not in MCOS_VERSIONS:
+        raise ValueError(f'MCOS metadata version {version} is not one of '
+                         f'{MCOS_VERSIONS}')
+    offsets = struct.unpack_from('<8I', metadata, 8)
+    regions = (40,) + offsets[:5]
+    if list(regions) != sorted(regions) or offsets[4] > len(metadata):
+        raise ValueError('the MCOS metadata regions are out of order or '
+                         'beyond its end')
+
+    names = metadata[40:offsets[0]].split(b'\x00')[:n_names]
+    if len(names) < n_names:
+        raise ValueError(f'the MCOS metadata holds {len(names)} of its '
+                         f'{n_names} property names')
+    names = [name.decode() for name in names]
+
+    # one row of class, 0, 0, saved property set, property set, object id
+    # per object, the first one empty
+    if (offsets[3] - offsets[2]) % 24:
+        raise ValueError('the MCOS object region is not made of rows of 6 '
+                         'integers')
+    objects = np.frombuffer(metadata[offsets[2]:offsets[3]],
+                            '<u4').reshape(-1, 6)[1:]
+
+    # property sets: count then (name, kind, value) triples, 8 byte aligned
+    sets, position = [], offsets[3] + 8
+    while position < offsets[4]:
+        if position + 4 > offsets[4]:
+            raise ValueError('the MCOS property sets overrun their region')
+        n = struct.unpack_from('<I', metadata, position)[0]
+        if position + 4 + 12*n > offsets[4]:
+            raise ValueError('the MCOS property sets overrun their region')
+        triples = np.frombuffer(metadata, '<u4', 3*n,
+                                position + 4).reshape(n, 3)
+        sets.append(triples)
+        position += 4 + 12*n
+        position += -position % 8
+
+    properties = {}
+    for row in objects:
+        if not 1 <= row[4] <= len(sets):
+            raise ValueError(f'MCOS object {row[5]} refers to property set '
+                             f'{row[4]} of {len(sets)}')
+        triples = sets[row[4] - 1]
+        if ((triples[:, 0] < 1) | (triples[:, 0] > n_names)).any():
+            raise ValueError(f'MCOS object {row[5]} refers to a property '
+                             f'name beyond the {n_names} names')
+        # kind 1 values index the cells after the metadata and an empty cell
+        properties[int(row[5])] = {names[name - 1]: int(value) + 2
+                                   for name, kind, value in triples
+                                   if kind == 1}
+    return properties
+
+
+def cache_filename(filename, cache_dir=CACHE_DIR):
+    """
+    cache of the tracks of a DeepLabCut mat file. The name holds a hash of
+    the absolute path of the mat file, so mat files of the same name in
+    different directories get different caches
+
+    Inputs
+    ------
+    filename: (str) mat file
+    cache_dir: (str) directory of the caches
+
+    Returns
+    -------
+    (str) h5 file
+    """
+    path = os.path.abspath(filename)
+    digest = hashlib.sha1(path.encode()).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f'{name}_{digest}_tracks.h5')
+
+
+def write_tracks(filename, out_file):
+    """
+    copy the body part tracks of a DeepLabCut mat file, one MATLAB table of
+    x and y columns per body part, to a contiguous h5 dataset
+
+    Inputs
+    ------
+    filename: (str) mat file
+    out_file: (str) h5 file to write
+    """
+    tables = read_mat_objects(filename)
+    bodyparts = sorted(tables)
+    positions = np.stack([
+        np.column_stack([np.ravel(column)
+                         for column in np.ravel(tables[part]['data'])[:2]])
+        for part in bodyparts]).astype(np.float64)
+
+    with h5py.File(out_file, 'w') as f:
+        tracks = f.create_dataset('positions', data=positions)
+        tracks.attrs['bodyparts'] = bodyparts
+        tracks.attrs['source'] = os.path.basename(filename)
+
+
+class DeepLabCutTracks:
+    """
+    Class to read the body part tracks of a DeepLabCut mat file. The first
+    read copies them to a contiguous h5 dataset in CACHE_DIR, or cache_file
+    if given, which later reads memory map, so loading costs nothing until
+    positions are used. The cache is rebuilt whenever the mat file is newer
+
+    Attributes
+    ----------
+    filename: (str) mat file
+    bodyparts: (tuple of str) names of the tracked body parts
+    positions: (np memmap of shape n_bodyparts, n_frames, 2) x and y of
+               each body part at each frame, in pixels
+    n_frames: (int) number of frames
+
+    Methods
+    -------
+    part(name)
+        positions of one body part
+    """
+    def __init__(self, filename, cache_file=None):
+        self.filename = filename
+        if cache_file is None:
+            cache_file = cache_filename(filename)
+
+        if (not os.path.exists(cache_file) or os.path.getmtime(cache_file)
+                < os.path.getmtime(filename)):
+            os.makedirs(os.path.dirname(os.path.abspath(cache_file)),
+                        exist_ok=True)
+            write_tracks(filename, cache_file)
+
+        with h5py.File(cache_file, 'r') as f:
+            tracks = f['positions']
+            self.bodyparts = tuple(str(part)
+                                   for part in tracks.attrs['bodyparts'])
+            shape, offset = tracks.shape, tracks.id.get_offset()
+        self.positions = np.memmap(cache_file, '<f8', 'r', offset, shape)
+        self.n_frames = shape[1]
+
+    def part(self, name):
+        """
+        positions of one body part
+
+        Inputs
+        ------
+        name: (str) body part, one of bodyparts
+
+        Returns
+        -------
+        (np array of shape n_frames, 2) x and y at each frame, in pixels
+        """
+        return self.positions[self.bodyparts.index(name)]
+
+
+def wrap_angle(angle):
+    """
+    wrap angles to [-pi, pi)
+
+    Inputs
+    ------
+    angle: (float or np array) radians
+
+    Returns
+    -------
+    (float or np array) radians
+    """
+    return (angle + math.pi) % (2*math.pi) - math.pi
+
+
+class MotionFit:
+    """
+    Class to hold the motion of a tracked mouse, measured over steps of the
+    duration of a simulation move, and the simulation parameters fitted to
+    it
+
+    Attributes
+    ----------
+    step_ms: (float) duration of the steps (ms)
+    speeds: (np array of floats) speed of each step (mm/ms)
+    turns: (np array of floats) change of direction between consecutive
+           moving steps (radians)
+    body_lengths: (np array of floats) head to back distance at each frame
+                  (mm)
+    body_angles: (np array of floats) angle between the body axis and the
+                 direction of each moving step (radians)
+    avg_speed, speed_std: (float) mean and standard deviation of speeds
+    turn_std: (float) turn_std of main.main and Mouse, the standard deviation
+              of the rotations around core.Mouse.get_heading_direction, which
+              points backwards. It is fitted to the mean cosine of the turns
+              shifted by pi, see motion.heading_turns. A mouse keeping its
+              direction is fitted turns close to uniform, see main_kwargs
+    body_length: (float) head to back distance of the 10 % longest frames,
+                 where the body lies flat as in Micebodydeformation.m
+
+    Methods
+    -------
+    main_kwargs()
+        fitted speeds as keyword arguments of main.main and Mouse
+    motion(table_size)
+        motion model drawing from the measured distributions
+    """
+    def __init__(self, step_ms, speeds, turns, body_lengths, body_angles):
+        self.step_ms = step_ms
+        self.speeds = speeds
+        self.turns = turns
+        self.body_lengths = body_lengths
+        self.body_angles = body_angles
+
+        self.avg_speed = float(speeds.mean())
+        self.speed_std = float(speeds.std())
+        self.turn_std = wrapped_normal_std(heading_turns(turns))
+        self.body_length = float(np.percentile(body_lengths, 90))
+
+    def main_kwargs(self):
+        """
+        fitted speeds as keyword arguments of main.main and Mouse. The
+        tracked points do not span the whole body, so the axes of the
+        simulated mice are left as they are. turn_std is left out: the
+        gaussian turns of main.main are centered on the backward heading,
+        and no turn_std around it keeps a mouse in its direction as tracked
+        mice do, so their fitted turn_std turns the mice at random. Pass
+        motion() as the motion argument to reproduce the measured turns
+
+        Returns
+        -------
+        (dict) avg_speed and speed_std
+        """
+        return {'avg_speed': self.avg_speed, 'speed_std': self.speed_std}
+
+    def motion(self, table_size=TABLE_SIZE):
+        """
+        motion model drawing speeds and turns from the measured
+        distributions rather than gaussians, to pass to main.main or Mouse
+
+        Inputs
+        ------
+        table_size: (int) number of quantiles tabulated
+
+        Returns
+        -------
+        (motion.EmpiricalMotion)
+        """
+        return EmpiricalMotion(self.speeds, self.turns, table_size)
+
+
+def fit_motion(tracks, step_ms=None, frame_rate_hz=FRAME_RATE_HZ,
+               mm_per_pixel=MM_PER_PIXEL, head='Head', back='Back',
+               min_move=MIN_MOVE, major_axis=MAJOR_AXIS, max_iterations=10):
+    """
+    measure the speed, turning and body axis of a tracked mouse, in a few
+    vectorized operations over all frames. The mouse is located at the
+    midpoint of its head and back. Its track is cut into steps of step_ms,
+    the duration of a simulation move, so speeds and turns are measured on
+    the scale at which the simulation draws them. By default the step is
+    the movement duration main.main derives from the fitted speed,
+    (1/5)*(major_axis/avg_speed), found by iterating from STEP_MS
+
+    Inputs
+    ------
+    tracks: (DeepLabCutTracks) tracked body parts
+    step_ms: (float or None) duration of the steps (ms), None to match the
+             movement duration of the fitted speed
+    frame_rate_hz: (float) frame rate of the tracked video
+    mm_per_pixel: (float) scale of the tracked video
+    head, back: (str) body parts at the ends of the body axis
+    min_move: (float) steps shorter than this (mm) count in the speeds but
+              have no direction
+    major_axis: (float) major axis of the simulated mice (mm), which sets
+                the movement duration
+    max_iterations: (int) most steps tried to match the movement duration
+
+    Returns
+    -------
+    (MotionFit) measured distributions and fitted parameters
+    """
+    head_xy = mm_per_pixel*np.asarray(tracks.part(head))
+    back_xy = mm_per_pixel*np.asarray(tracks.part(back))
+    centers = (head_xy + back_xy)/2
+    axis = head_xy - back_xy
+    body_lengths = np.hypot(axis[:, 0], axis[:, 1])
+    body_directions = np.arctan2(axis[:, 1], axis[:, 0])
+
+    def frames_per_step(step_ms):
+        return max(int(round(step_ms*frame_rate_hz/1000)), 1)
+
+    lag = frames_per_step(STEP_MS if step_ms is None else step_ms)
+    for _ in range(max_iterations):
+        moves = np.diff(centers[::lag], axis=0)
+        distances = np.hypot(moves[:, 0], moves[:, 1])
+        speeds = distances*frame_rate_hz/(1000*lag)
+        if step_ms is not None:
+            break
+
+        # the lag main.main would move the mice by at this speed
+        matched = frames_per_step((1/5)*(major_axis/speeds.mean()))
+        if matched == lag:
+            break
+        lag = matched
+
+    # turns between consecutive steps that both moved
+    directions = np.arctan2(moves[:, 1], moves[:, 0])
+    moving = distances >= min_move
+    both = moving[1:] & moving[:-1]
+    turns = wrap_angle(np.diff(directions))[both]
+
+    # body axis at the start of each step against the step direction
+    body_angles = wrap_angle(body_directions[::lag][:-1] - directions)
+    return MotionFit(1000*lag/frame_rate_hz, speeds, turns, body_lengths,
+                     body_angles[moving])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='fit the simulation speeds to DeepLabCut tracks. Turns '
+                    'are reproduced by passing MotionFit.motion() to '
+                    'main.main')
+    parser.add_argument('filename', help='DeepLabCut mat file')
+    parser.add_argument('--fps', type=float, default=FRAME_RATE_HZ,
+                        help='frame rate of the tracked video')
+    parser.add_argument('--mm-per-pixel', type=float, default=MM_PER_PIXEL,
+                        help='scale of the tracked video')
+    parser.add_argument('--cache-file',
+                        help=f'h5 copy of the tracks, by default in '
+                             f'{CACHE_DIR}')
+    parser.add_argument('--step-ms', type=float,
+                        help='duration of the steps, by default the '
+                             'movement duration of the fitted speed')
+    args = parser.parse_args()
+
+    fit = fit_motion(DeepLabCutTracks(args.filename, args.cache_file),
+                     args.step_ms, args.fps, args.mm_per_pixel)
+    print(json.dumps(dict(fit.main_kwargs(), step_ms=fit.step_ms,
+                          body_length=fit.body_length), indent=2))
@@ -1,6 +1,7 @@
 import h5py
 import numpy as np
 import matplotlib.pyplot as plt
+from reader import read_perimeters
 
 
 # this script plots the mouse trajectories
@@ -16,7 +17,7 @@ with h5py.File(filename, 'r') as f:
     n_mice = center_history.attrs['n_mice']
     simulation_length_min = center_history.attrs['simulation_length_min']
 
-    perimeter_history = f.get('perimeter_history')
+    perimeter_history = read_perimeters(f)
     perimeter_history_np = np.array(perimeter_history)
 
 for i in range(n_mice):
@@ -0,0 +1,113 @@
+import numpy as np
+
+
+# number of rows buffered in memory and written per HDF5 chunk
+CHUNK_SIZE = 256
+
+
+class StreamingWriter:
+    """
+    Class to append rows to resizable HDF5 datasets while a simulation runs.
+    Rows are buffered in a fixed size array and written one chunk at a time
+    to chunked, compressed datasets, so memory does not grow with the length
+    of the simulation
+
+    Attributes
+    ----------
+    group: (h5py.Group or h5py.File) where the datasets are created
+    chunk_size: (int) number of rows buffered before each write, also the
+                chunk length of the datasets along time
+    compression: (str or None) h5py compression filter, None to disable
+    compression_opts: (int or None) options of the compression filter. gzip
+                      defaults to level 1, which is much faster than higher
+                      levels and compresses float positions almost as well
+    datasets: (dict) {name: h5py.Dataset} datasets written by this writer
+
+    Methods
+    -------
+    create_dataset(name, row_shape, dtype)
+        create an empty resizable dataset to append rows to
+    append(name, row)
+        append one row to a dataset
+    flush(name)
+        write the buffered rows of one or all datasets
+    """
+    def __init__(self, group, chunk_size=CHUNK_SIZE, compression='gzip',
+                 compression_opts=None):
+        if compression == 'gzip' and compression_opts is None:
+            compression_opts = 1
+
+        self.group = group
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.datasets = {}
+        self._buffers = {}
+        self._n_buffered = {}
+
+    def create_dataset(self, name, row_shape, dtype=float):
+        """
+        create an empty dataset that grows along its first axis
+
+        Inputs
+        ------
+        name: (str) name of the dataset in the group
+        row_shape: (tuple of ints) shape of one row (one timepoint)
+        dtype: (np dtype) data type of the dataset
+
+        Returns
+        -------
+        dataset: (h5py.Dataset) the new dataset, e.g. to set attrs on
+        """
+        row_shape = tuple(row_shape)
+        dataset = self.group.create_dataset(
+            name, (0,) + row_shape, dtype=dtype, maxshape=(None,) + row_shape,
+            chunks=(self.chunk_size,) + row_shape,
+            compression=self.compression,
+            compression_opts=self.compression_opts,
+            # byte shuffling lets floats compress
+            shuffle=self.compression is not None)
+
+        self.datasets[name] = dataset
+        self._buffers[name] = np.empty((self.chunk_size,) + row_shape, dtype)
+        self._n_buffered[name] = 0
+
+        return dataset
+
+    def append(self, name, row):
+        """
+        append one row to a dataset. The row is copied into the buffer, which
+        is written out when full
+
+        Inputs
+        ------
+        name: (str) name of the dataset
+        row: (np array of shape row_shape) values of the row
+        """
+        n_buffered = self._n_buffered[name]
+        self._buffers[name][n_buffered] = row
+        self._n_buffered[name] = n_buffered + 1
+
+        if n_buffered + 1 == self.chunk_size:
+            self.flush(name)
+
+    def flush(self, name=None):
+        """
+        write the buffered rows to the file
+
+        Inputs
+        ------
+        name: (str) dataset to flush, None for every dataset
+        """
+        names = self.datasets if name is None else (name,)
+
+        for name in names:
+            n_buffered = self._n_buffered[name]
+            if not n_buffered:
+                continue
+
+            dataset = self.datasets[name]
+            n_rows = dataset.shape[0]
+            dataset.resize(n_rows + n_buffered, axis=0)
+            dataset[n_rows:] = self._buffers[name][:n_buffered]
+            self._n_buffered[name] = 0